@@ -0,0 +1,178 @@
+"""
+Shared pieces of the benchmarks: a scriptable fake cdo, timing, and result
+files that can be compared between runs
+"""
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections.abc import Callable
+from datetime import UTC, datetime
+
+FAKE_CDO_VERSION = "2.4.0"
+
+# Stands in for cdo: it sleeps FAKE_CDO_LATENCY seconds and writes
+# FAKE_CDO_BYTES bytes to each of its last FAKE_CDO_NOUT arguments
+_FAKE_CDO = """#!{python}
+import os
+import sys
+import time
+
+argv = sys.argv[1:]
+if argv == ["-V"]:
+    print("Climate Data Operators version {version} (https://mpimet.mpg.de/cdo)")
+    sys.exit(0)
+time.sleep(float(os.environ.get("FAKE_CDO_LATENCY", "{latency}")))
+nout = int(os.environ.get("FAKE_CDO_NOUT", "1"))
+size = int(os.environ.get("FAKE_CDO_BYTES", "{output_bytes}"))
+for out in argv[len(argv) - nout :] if nout else []:
+    with open(out, "wb") as f:
+        f.truncate(size)
+"""
+
+
+def install_fake_cdo(
+    directory: str, latency: float = 0.0, output_bytes: int = 1024
+) -> str:
+    """
+    Write a fake cdo executable to directory
+
+    latency and output_bytes are its defaults, the FAKE_CDO_LATENCY and
+    FAKE_CDO_BYTES environment variables override them per run.
+
+    Returns: path of the executable
+    """
+    exe = os.path.join(directory, "cdo")
+    with open(exe, "w") as f:
+        f.write(
+            _FAKE_CDO.format(
+                python=sys.executable,
+                version=FAKE_CDO_VERSION,
+                latency=latency,
+                output_bytes=output_bytes,
+            )
+        )
+    os.chmod(exe, 0o755)
+    return exe
+
+
+def create_files(directory: str, n: int, size: int = 0) -> list[str]:
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(n):
+        path = os.path.join(directory, f"input_{i:07d}.nc")
+        with open(path, "wb") as f:
+            f.truncate(size)
+        paths.append(path)
+    return paths
+
+
+def measure(
+    func: Callable[[], object],
+    number: int = 100,
+    repeat: int = 5,
+    setup: Callable[[], object] | None = None,
+) -> dict[str, float]:
+    """
+    Time func, number calls per repeat; setup runs untimed before each call
+
+    Returns: median and min seconds per call over the repeats
+    """
+    if setup is None:
+        func()
+    timings = []
+    for _ in range(repeat):
+        elapsed = 0.0
+        for _ in range(number):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            elapsed += time.perf_counter() - start
+        timings.append(elapsed / number)
+    return {"median": statistics.median(timings), "min": min(timings)}
+
+
+class Results:
+    """Named measurements of a benchmark run, saved as JSON"""
+
+    def __init__(self, suite: str) -> None:
+        self.suite = suite
+        self.results: dict[str, dict[str, float | str]] = {}
+
+    def add(self, name: str, timing: dict[str, float], unit: str = "s") -> None:
+        self.results[name] = {**timing, "unit": unit}
+        value = timing["median"]
+        shown = f"{value * 1e6:12.1f} us" if unit == "s" else f"{value:12.1f} {unit}"
+        print(f"{name:<48} {shown}", flush=True)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"meta": _meta(self.suite), "results": self.results}, f, indent=2)
+            f.write("\n")
+        print(f"saved {path}")
+
+
+def default_results_path(suite: str) -> str:
+    """benchmarks/results/<suite>-<UTC time>-<git commit>.json"""
+    stamp = datetime.now(UTC).strftime("%Y%m%dT%H%M%S")
+    name = f"{suite}-{stamp}-{_git_commit() or 'nogit'}.json"
+    return os.path.join(os.path.dirname(__file__), "results", name)
+
+
+def compare(baseline: str, current: str, threshold: float = 0.1) -> int:
+    """
+    Print the change of each measurement of current against baseline;
+    "lower is better" for times, "higher is better" for rates (unit "/s")
+
+    Returns: number of measurements more than threshold worse
+    """
+    with open(baseline) as f:
+        old = json.load(f)["results"]
+    with open(current) as f:
+        new = json.load(f)["results"]
+    regressions = 0
+    for name in sorted(old.keys() & new.keys()):
+        before, after = old[name]["median"], new[name]["median"]
+        if before <= 0 or after <= 0:
+            continue
+        ratio = after / before
+        worse = 1 / ratio if str(new[name]["unit"]).endswith("/s") else ratio
+        flag = ""
+        if worse > 1 + threshold:
+            regressions += 1
+            flag = "  REGRESSION"
+        print(f"{name:<48} {ratio:8.2f}x{flag}")
+    for name in sorted(old.keys() ^ new.keys()):
+        print(f"{name:<48} {'only in ' + ('baseline' if name in old else 'current')}")
+    return regressions
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            check=False,
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def _meta(suite: str) -> dict[str, object]:
+    return {
+        "suite": suite,
+        "time": datetime.now(UTC).isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
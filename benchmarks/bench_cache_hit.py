@@ -0,0 +1,87 @@
+"""
+Cache hit latency of CdoCache.get_cache
+
+Compares the previous CdoHandler behaviour (probe cdo on construction and spawn
+`cdo -V` on every lookup) against the lazy, memoized handler.
+
+Usage:
+    python benchmarks/bench_cache_hit.py [--repeat N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+
+from xcdo.operators.cdo_cache import CdoCache
+from xcdo.operators.cdo_cache.cache_handler import CacheHandler
+from xcdo.operators.cdo_cache.cdo_handler import CdoHandler
+
+FAKE_CDO = """#!{python}
+import sys
+argv = sys.argv[1:]
+if argv == ["-V"]:
+    print("Climate Data Operators version 2.4.0")
+    sys.exit(0)
+if argv:
+    open(argv[-1], "w").write(" ")
+"""
+
+
+class EagerCdoHandler(CdoHandler):
+    """CdoHandler as it behaved before lazy probing and version memoization"""
+
+    def __init__(self, cdo: str) -> None:
+        super().__init__(cdo)
+        subprocess.run([self.cdo_path], check=False)
+
+    def version(self) -> str:
+        return self._probe_version()
+
+
+def bench(label: str, lookup: Callable[[], object], repeat: int) -> float:
+    lookup()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        lookup()
+    per_call = (time.perf_counter() - start) / repeat
+    print(f"{label:<10} {per_call * 1e6:12.1f} us/hit")
+    return per_call
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cdo = os.path.join(tmp, "cdo")
+        with open(cdo, "w") as f:
+            f.write(FAKE_CDO.format(python=sys.executable))
+        os.chmod(cdo, 0o755)
+        input_file = os.path.join(tmp, "input.nc")
+        with open(input_file, "w") as f:
+            f.write(" ")
+        argv = ("-timmean", input_file)
+
+        def before() -> object:
+            return CdoCache(EagerCdoHandler(cdo), CacheHandler(tmp)).get_cache(argv, 1)
+
+        cdo_cache = CdoCache(
+            CdoHandler(cdo, version_cache=os.path.join(tmp, "versions.json")),
+            CacheHandler(tmp),
+        )
+
+        def after() -> object:
+            return cdo_cache.get_cache(argv, 1)
+
+        t_before = bench("before", before, args.repeat)
+        t_after = bench("after", after, args.repeat)
+        print(f"speedup    {t_before / t_after:12.1f} x")
+
+
+if __name__ == "__main__":
+    main()
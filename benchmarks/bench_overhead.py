@@ -0,0 +1,348 @@
+"""
+Overhead of CdoCache, CacheHandler and CdoHandler on top of cdo
+
+cdo is replaced by a fake with configurable latency and output size, so
+the numbers are the cost of the cache itself:
+
+- hash: generate_hash of keys of 10 to 10,000 tokens
+- lookup: get_cache hit and miss latency; the miss includes spawning the
+  fake cdo, whose bare spawn time is reported as lookup.miss.spawn
+- discover: input discovery and canonicalization of -mergetime with 10 to
+  10,000 inputs
+- validate: is_cache_valid and a get_cache hit with 10 to 10,000 inputs
+- entries: populating a cache of 1k to 1M entries, hit and miss latency
+  and stats() on it
+- concurrent: lookups per second of 1 to 8 processes sharing a cache,
+  on warm entries and on entries populated concurrently
+
+Usage:
+    python benchmarks/bench_overhead.py [--quick] [--entries 1000,1000000]
+        [--only hash,lookup] [--save [PATH]] [--baseline PATH]
+
+Results are saved as JSON, by default to benchmarks/results/; compare two
+runs with `python benchmarks/compare.py BASELINE CURRENT`.
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Iterator
+from itertools import count
+
+from _harness import (
+    Results,
+    compare,
+    create_files,
+    default_results_path,
+    install_fake_cdo,
+    measure,
+)
+
+from xcdo.operators.cdo_cache import CdoCache
+from xcdo.operators.cdo_cache.cache_handler import CacheHandler
+from xcdo.operators.cdo_cache.canonical import canonicalize
+from xcdo.operators.cdo_cache.cdo_handler import CdoHandler
+
+SIZES = (10, 100, 1000, 10000)
+QUICK_SIZES = (10, 100)
+
+
+class Env:
+    """A fake cdo, a shared input file and fresh caches in a temp directory"""
+
+    def __init__(self, tmp: str, latency: float, output_bytes: int) -> None:
+        self.tmp = tmp
+        self.cdo = install_fake_cdo(tmp, latency, output_bytes)
+        self.version_cache = os.path.join(tmp, "versions.json")
+        (self.input_file,) = create_files(os.path.join(tmp, "inputs"), 1, 1024)
+        self._roots = count()
+        self._caches: list[CacheHandler] = []
+
+    def new_root(self) -> str:
+        return os.path.join(self.tmp, f"cache{next(self._roots)}")
+
+    def cache(self, root: str | None = None) -> CacheHandler:
+        cache = CacheHandler(root or self.new_root())
+        self._caches.append(cache)
+        return cache
+
+    def cdo_cache(self, root: str | None = None) -> CdoCache:
+        return CdoCache(
+            CdoHandler(self.cdo, version_cache=self.version_cache), self.cache(root)
+        )
+
+    def close(self) -> None:
+        """Flush the indexes while their directories still exist"""
+        for cache in self._caches:
+            cache.close()
+
+
+def bench_hash(env: Env, results: Results, sizes: tuple[int, ...]) -> None:
+    cache = env.cache()
+    for n in sizes:
+        key = tuple(f"/data/run/input_{i:07d}.nc" for i in range(n))
+        results.add(f"hash.{n}", measure(lambda key=key: cache.generate_hash(key)))
+
+
+def bench_lookup(env: Env, results: Results) -> None:
+    cdo_cache = env.cdo_cache()
+    argv = ("-timmean", env.input_file)
+    results.add("lookup.hit", measure(lambda: cdo_cache.get_cache(argv, 1), 500))
+
+    keys = count()
+    results.add(
+        "lookup.miss",
+        measure(
+            lambda: cdo_cache.get_cache((f"-addc,{next(keys)}", env.input_file), 1),
+            number=20,
+            repeat=3,
+        ),
+    )
+    out = os.path.join(env.tmp, "spawn.nc")
+    spawn = [env.cdo, "-addc,1", env.input_file, out]
+    results.add(
+        "lookup.miss.spawn",
+        measure(lambda: subprocess.run(spawn, check=True), number=20, repeat=3),
+    )
+
+
+def bench_discover(env: Env, results: Results, sizes: tuple[int, ...]) -> None:
+    handler = CdoHandler(env.cdo, version_cache=env.version_cache)
+    for n in sizes:
+        inputs = create_files(os.path.join(env.tmp, f"discover{n}"), n)
+        argv = ["-mergetime", *inputs]
+        number = max(1, 10000 // n)
+        results.add(
+            f"discover.{n}",
+            measure(lambda argv=argv: handler.get_input_files(argv), number),
+        )
+        results.add(
+            f"discover.{n}.canonicalize",
+            measure(lambda argv=argv: canonicalize(argv), number),
+        )
+
+
+def bench_validate(env: Env, results: Results, sizes: tuple[int, ...]) -> None:
+    for n in sizes:
+        inputs = create_files(os.path.join(env.tmp, f"validate{n}"), n)
+        cdo_cache = env.cdo_cache()
+        argv = ["-mergetime", *inputs]
+        cache_files = cdo_cache.get_cache(argv, 1)
+        cache = cdo_cache._cache
+        number = max(1, 10000 // n)
+        results.add(
+            f"validate.{n}",
+            measure(
+                lambda cache=cache, cache_files=cache_files, inputs=inputs: (
+                    cache.is_cache_valid(cache_files, inputs)
+                ),
+                number,
+            ),
+        )
+        results.add(
+            f"validate.{n}.hit",
+            measure(
+                lambda cdo_cache=cdo_cache, argv=argv: cdo_cache.get_cache(argv, 1),
+                number,
+            ),
+        )
+
+
+def bench_entries(env: Env, results: Results, sizes: tuple[int, ...]) -> None:
+    for n in sizes:
+        cdo_cache = env.cdo_cache()
+        cache = cdo_cache._cache
+        version = cdo_cache._cdo.version()
+        start = time.perf_counter()
+        for i in range(n):
+            job = cdo_cache._prepare((f"-addc,{i}", env.input_file), 1, version)
+            cache.ensure_directories_exist(job.cache_files)
+            with open(job.cache_files[0], "wb"):
+                pass
+            cache.register(job.cache_files, job.input_files)
+        elapsed = time.perf_counter() - start
+        results.add(
+            f"entries.{n}.populate", {"median": elapsed / n, "min": elapsed / n}
+        )
+
+        rng = random.Random(n)
+        results.add(
+            f"entries.{n}.hit",
+            measure(
+                lambda cdo_cache=cdo_cache, rng=rng, n=n: cdo_cache.get_cache(
+                    (f"-addc,{rng.randrange(n)}", env.input_file), 1
+                ),
+                500,
+            ),
+        )
+        keys = count(n)
+        results.add(
+            f"entries.{n}.miss",
+            measure(
+                lambda cdo_cache=cdo_cache, keys=keys: cdo_cache.get_cache(
+                    (f"-addc,{next(keys)}", env.input_file), 1
+                ),
+                number=20,
+                repeat=3,
+            ),
+        )
+        results.add(f"entries.{n}.stats", measure(cache.stats, 3, 3))
+
+
+def _lookups(
+    root: str,
+    cdo: str,
+    version_cache: str,
+    input_file: str,
+    n_lookups: int,
+    n_keys: int,
+    seed: int,
+    barrier: "multiprocessing.synchronize.Barrier",
+) -> None:
+    cache = CacheHandler(root)
+    cdo_cache = CdoCache(CdoHandler(cdo, version_cache=version_cache), cache)
+    rng = random.Random(seed)
+    keys = [rng.randrange(n_keys) for _ in range(n_lookups)]
+    barrier.wait()
+    for i in keys:
+        cdo_cache.get_cache((f"-addc,{i}", input_file), 1)
+    cache.close()
+    barrier.wait()
+
+
+def _throughput(env: Env, root: str, processes: int, lookups: int, keys: int) -> float:
+    """Returns: lookups per second of all processes together"""
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(processes + 1)
+    workers = [
+        ctx.Process(
+            target=_lookups,
+            args=(
+                root,
+                env.cdo,
+                env.version_cache,
+                env.input_file,
+                lookups,
+                keys,
+                seed,
+                barrier,
+            ),
+        )
+        for seed in range(processes)
+    ]
+    for w in workers:
+        w.start()
+    # Start timing once every process has imported and set up
+    barrier.wait()
+    start = time.perf_counter()
+    barrier.wait()
+    elapsed = time.perf_counter() - start
+    for w in workers:
+        w.join()
+        if w.exitcode != 0:
+            raise RuntimeError(f"benchmark process failed: {w.exitcode}")
+    return processes * lookups / elapsed
+
+
+def _rates(values: Iterator[float]) -> dict[str, float]:
+    rates = sorted(values)
+    return {"median": rates[len(rates) // 2], "min": rates[0]}
+
+
+def bench_concurrent(
+    env: Env, results: Results, processes: tuple[int, ...], lookups: int
+) -> None:
+    keys = 64
+    warm = env.new_root()
+    cdo_cache = env.cdo_cache(warm)
+    for i in range(keys):
+        cdo_cache.get_cache((f"-addc,{i}", env.input_file), 1)
+    for p in processes:
+        results.add(
+            f"concurrent.{p}.hit",
+            _rates(_throughput(env, warm, p, lookups, keys) for _ in range(3)),
+            "lookups/s",
+        )
+        results.add(
+            f"concurrent.{p}.populate",
+            _rates(
+                _throughput(env, env.new_root(), p, lookups // 4, keys)
+                for _ in range(3)
+            ),
+            "lookups/s",
+        )
+
+
+BENCHMARKS = ("hash", "lookup", "discover", "validate", "entries", "concurrent")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--quick", action="store_true", help="small sizes only")
+    parser.add_argument(
+        "--only", default=",".join(BENCHMARKS), help="benchmarks to run"
+    )
+    parser.add_argument(
+        "--entries", help="cache sizes, default 1000,10000,100000 (100 with --quick)"
+    )
+    parser.add_argument(
+        "--processes", default="1,2,4,8", help="process counts for concurrent"
+    )
+    parser.add_argument("--lookups", type=int, default=400, help="per process")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake cdo, s")
+    parser.add_argument("--output-bytes", type=int, default=1024, help="fake cdo")
+    parser.add_argument("--save", nargs="?", const="", help="save results as JSON")
+    parser.add_argument("--baseline", help="compare against saved results")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    only = set(args.only.split(","))
+    if unknown := only - set(BENCHMARKS):
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    sizes = QUICK_SIZES if args.quick else SIZES
+    if args.entries:
+        entries = tuple(int(n) for n in args.entries.split(","))
+    else:
+        entries = (100,) if args.quick else (1000, 10000, 100000)
+    processes = tuple(int(p) for p in args.processes.split(","))
+    lookups = 40 if args.quick else args.lookups
+
+    results = Results("overhead")
+    with tempfile.TemporaryDirectory() as tmp:
+        env = Env(tmp, args.latency, args.output_bytes)
+        try:
+            if "hash" in only:
+                bench_hash(env, results, sizes)
+            if "lookup" in only:
+                bench_lookup(env, results)
+            if "discover" in only:
+                bench_discover(env, results, sizes)
+            if "validate" in only:
+                bench_validate(env, results, sizes)
+            if "entries" in only:
+                bench_entries(env, results, entries)
+            if "concurrent" in only:
+                bench_concurrent(env, results, processes, lookups)
+        finally:
+            env.close()
+
+    path = None
+    if args.save is not None:
+        path = args.save or default_results_path(results.suite)
+        results.save(path)
+    if args.baseline:
+        if path is None:
+            path = os.path.join(tempfile.gettempdir(), "xcdo-bench-current.json")
+            results.save(path)
+        sys.exit(1 if compare(args.baseline, path, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
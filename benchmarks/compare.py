@@ -0,0 +1,29 @@
+"""
+Compare two saved benchmark runs
+
+Prints current/baseline per measurement and exits with status 1 if any is
+more than the threshold worse.
+
+Usage:
+    python benchmarks/compare.py BASELINE CURRENT [--threshold 0.1]
+"""
+
+import argparse
+import sys
+
+from _harness import compare
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+    sys.exit(1 if compare(args.baseline, args.current, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
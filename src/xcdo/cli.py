@@ -0,0 +1,166 @@
+"""
+Command line interface of xcdo
+
+    xcdo [cdo options] -operator ... [outputs]
+    xcdo cache stats [--root DIR]
+    xcdo cache gc [--root DIR] [--max-bytes SIZE] [--max-entries N]
+                  [--policy {lru,lfu,size,gds}]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import cast, get_args
+
+from .operators.cdo_cache import CdoCache
+from .operators.cdo_cache.argv_parser import parse
+from .operators.cdo_cache.cache_handler import CacheHandler
+from .operators.cdo_cache.cdo_handler import CdoHandler
+from .operators.cdo_cache.exceptions import CdoError
+from .operators.cdo_cache.materialize import linkMethod, materialize
+from .operators.cdo_cache.metrics import JsonlTrace, Metrics
+from .operators.cdo_cache.types import evictionPolicy
+
+# cdo binary run by `xcdo <cdo command>`
+CDO_ENV = "XCDO_CDO"
+# File the lookups and cdo runs of `xcdo <cdo command>` are traced to
+TRACE_ENV = "XCDO_TRACE"
+# "hardlink" lets `xcdo <cdo command>` hardlink outputs to the cache files
+# where they can't be reflinked, e.g. on ext4, Lustre or GPFS
+LINK_ENV = "XCDO_LINK"
+
+_HARDLINK_METHODS: tuple[linkMethod, ...] = ("reflink", "hardlink", "copy")
+
+_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(size: str) -> int:
+    """Parse a byte size like 500M or 2G"""
+    value = size.strip().upper().removesuffix("B").removesuffix("I")
+    unit = value[-1:] if value[-1:] in _UNITS else ""
+    try:
+        return int(float(value.removesuffix(unit)) * _UNITS[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {size}")
+
+
+def format_size(size: int) -> str:
+    value = float(size)
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if value < 1024:
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} TiB"
+
+
+def _cache_handler(args: argparse.Namespace) -> CacheHandler:
+    return CacheHandler(
+        args.root,
+        max_bytes=args.max_bytes,
+        max_entries=args.max_entries,
+        policy=cast(evictionPolicy, args.policy),
+    )
+
+
+def _cache_stats(args: argparse.Namespace) -> int:
+    stats = _cache_handler(args).stats()
+    budget_bytes = format_size(stats.max_bytes) if stats.max_bytes else "-"
+    print(f"root:        {stats.root}")
+    print(f"entries:     {stats.entries} (max {stats.max_entries or '-'})")
+    print(f"size:        {format_size(stats.bytes)} (max {budget_bytes})")
+    print(f"reclaimable: {format_size(stats.reclaimable_bytes)} by eviction")
+    print(f"             {format_size(stats.orphaned_bytes)} in orphaned files")
+    return 0
+
+
+def _cache_gc(args: argparse.Namespace) -> int:
+    count, freed = _cache_handler(args).gc()
+    print(f"evicted {count} entries, reclaimed {format_size(freed)}")
+    return 0
+
+
+def run_cdo(argv: list[str], cdo: str | None = None, root: str | None = None) -> int:
+    """
+    Run a cdo command line, output files included, through the cache
+
+    The outputs are reflinked or copied out of the cache, see
+    `materialize`, and the output of information operators is printed from
+    the cache. Commands the cache can't handle, e.g. with an output prefix
+    or not understood by the parser, are passed to cdo as they are.
+
+    With $XCDO_LINK=hardlink, outputs that can't be reflinked are
+    hardlinked to the cache files, so no data is copied; an output must
+    then not be modified or overwritten in place, e.g. by a later cdo run
+    writing to the same path, as that modifies the cache entry too.
+    Delete it first instead.
+
+    Params:
+        cdo: cdo binary, defaults to $XCDO_CDO, else "cdo"
+        root: cache root directory, see `CacheHandler`
+    Returns: the exit status of cdo
+    """
+    handler = CdoHandler(cdo or os.environ.get(CDO_ENV, "cdo"))
+    try:
+        command = parse(argv, with_outputs=True)
+        n_outputs = command.n_outputs
+    except CdoError:
+        command, n_outputs = None, 0
+
+    try:
+        if command is None:
+            # Not understood, or writing files with an output prefix
+            return subprocess.run([handler.cdo_path, *argv], check=False).returncode
+        trace = os.environ.get(TRACE_ENV)
+        metrics = Metrics([JsonlTrace(trace)]) if trace else None
+        cdo_cache = CdoCache(handler, CacheHandler(root), metrics=metrics)
+        if n_outputs == 0:
+            stdout, stderr = cdo_cache.get_info(argv)
+            sys.stdout.write(stdout)
+            sys.stderr.write(stderr)
+            return 0
+        inputs = argv[: len(argv) - n_outputs]
+        cache_files = cdo_cache.get_cache(inputs, n_outputs)
+        if os.environ.get(LINK_ENV) == "hardlink":
+            methods = _HARDLINK_METHODS
+        else:
+            methods = ("reflink", "copy")
+        for cache_file, output in zip(cache_files, command.outputs):
+            materialize(cache_file, output, methods)
+    except CdoError as e:
+        # cdo has printed its errors already, unless its output was captured
+        if e.msg or e.stderr:
+            print(e, file=sys.stderr)
+        return e.returncode
+    return 0
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="xcdo", description="Extended cdo")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cache = commands.add_parser("cache", help="manage the cdo cache")
+    actions = cache.add_subparsers(dest="action", required=True)
+    for name, func, help in (
+        ("stats", _cache_stats, "report cache usage and reclaimable space"),
+        ("gc", _cache_gc, "evict entries over budget and remove orphans"),
+    ):
+        action = actions.add_parser(name, help=help)
+        action.set_defaults(func=func)
+        action.add_argument("--root", help="cache root directory")
+        action.add_argument("--max-bytes", type=parse_size, help="e.g. 500G")
+        action.add_argument("--max-entries", type=int)
+        action.add_argument("--policy", choices=get_args(evictionPolicy), default="lru")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] not in ("cache", "-h", "--help"):
+        return run_cdo(argv)
+    args = _parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
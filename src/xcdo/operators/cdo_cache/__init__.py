@@ -1,3 +1,4 @@
 from .cdo_cache import CdoCache
+from .pipeline import Expr, Pipeline
 
-__all__ = ["CdoCache"]
+__all__ = ["CdoCache", "Expr", "Pipeline"]
@@ -0,0 +1,253 @@
+from dataclasses import dataclass
+
+from .catalog import Operator, get_operator
+from .exceptions import CdoError
+from .types import argvType
+
+# Global cdo options that take a value as the next argument
+OPTIONS_WITH_VALUE = frozenset(
+    (
+        "-b",
+        "-f",
+        "-g",
+        "-k",
+        "-m",
+        "-P",
+        "-t",
+        "-z",
+        "--filter",
+        "--format",
+        "--netcdf_hdr_pad",
+        "--percentile",
+        "--precision",
+        "--seed",
+        "--timestat_date",
+        "--worker",
+    )
+)
+
+# Parameters with one of these suffixes, or that look like a path, are
+# files the result depends on, e.g. grid descriptions or remap weights
+_FILE_SUFFIXES = (
+    ".nc",
+    ".nc4",
+    ".grb",
+    ".grb2",
+    ".grib",
+    ".grib2",
+    ".srv",
+    ".ext",
+    ".ieg",
+    ".txt",
+)
+_PATH_PREFIXES = ("/", "./", "../", "~/")
+
+
+# Operators that read many records or compute interpolation weights,
+# worth keeping as intermediate results of a chain
+_EXPENSIVE_PREFIXES = ("merge", "cat", "ens", "remap", "gen", "interpolate")
+
+
+def is_file_param(value: str) -> bool:
+    return value.startswith(_PATH_PREFIXES) or value.lower().endswith(_FILE_SUFFIXES)
+
+
+@dataclass(frozen=True)
+class Node:
+    """An operator applied to its inputs, which are subtrees or file names"""
+
+    operator: Operator
+    params: tuple[str, ...] = ()
+    children: tuple["Node | str", ...] = ()
+
+    @property
+    def token(self) -> str:
+        return ",".join((f"-{self.operator.name}", *self.params))
+
+    def to_argv(self, nested: bool = False) -> list[str]:
+        argv = [self.token]
+        if self.operator.variadic and (
+            nested or any(isinstance(c, Node) for c in self.children)
+        ):
+            # Brackets delimit the inputs of a variadic operator in a chain
+            argv.append("[")
+            argv.extend(_child_argv(self.children))
+            argv.append("]")
+        else:
+            argv.extend(_child_argv(self.children))
+        return argv
+
+    def param_files(self) -> list[str]:
+        files: list[str] = []
+        for p in self.params:
+            value = p.partition("=")[2] if "=" in p else p
+            if is_file_param(value):
+                files.append(value)
+        return files
+
+    def input_files(self) -> list[str]:
+        """Input files of the whole tree, including files given as parameters"""
+        files = self.param_files()
+        for c in self.children:
+            files.extend(c.input_files() if isinstance(c, Node) else [c])
+        return files
+
+    def walk(self) -> list["Node"]:
+        """All operator nodes of the tree, outermost first"""
+        nodes: list[Node] = [self]
+        for c in self.children:
+            if isinstance(c, Node):
+                nodes.extend(c.walk())
+        return nodes
+
+
+def is_expensive(node: Node) -> bool:
+    """
+    Cost heuristic for intermediate caching: operators that combine several
+    inputs or remap are expensive, cheap selections are not
+    """
+    if node.operator.variadic and len(node.children) > 1:
+        return True
+    return node.operator.name.startswith(_EXPENSIVE_PREFIXES)
+
+
+def _child_argv(children: tuple[Node | str, ...]) -> list[str]:
+    argv: list[str] = []
+    for c in children:
+        argv.extend(c.to_argv(nested=True) if isinstance(c, Node) else [c])
+    return argv
+
+
+@dataclass(frozen=True)
+class Command:
+    """A parsed cdo command line"""
+
+    options: tuple[str, ...]
+    root: Node
+    outputs: tuple[str, ...] = ()
+
+    def to_argv(self, outputs: bool = True) -> list[str]:
+        argv = [*self.options, *self.root.to_argv()]
+        if outputs:
+            argv.extend(self.outputs)
+        return argv
+
+    def input_files(self) -> tuple[str, ...]:
+        return tuple(sorted(set(self.root.input_files())))
+
+    @property
+    def n_outputs(self) -> int:
+        """
+        Raises:
+            CdoError: if the operator writes a variable number of outputs
+        """
+        n = self.root.operator.n_outputs
+        if n < 0:
+            raise CdoError(
+                f"cdo operator '{self.root.operator.name}' writes files with an "
+                "output prefix, the number of outputs is unknown"
+            )
+        return n
+
+
+def _split(token: str) -> tuple[str, tuple[str, ...]]:
+    name, *params = token.removeprefix("-").split(",")
+    return name, tuple(params)
+
+
+def _is_option_token(token: str) -> bool:
+    # Global options are single letters or long options; any other
+    # '-token' names an operator, possibly one missing from the catalog
+    return token.startswith("--") or (len(token) == 2 and token[1].isalpha())
+
+
+class _Parser:
+    def __init__(self, tokens: argvType) -> None:
+        self.tokens = tokens
+        self.pos = 0
+
+    def at_end(self) -> bool:
+        return self.pos >= len(self.tokens)
+
+    def next(self) -> str:
+        if self.at_end():
+            raise CdoError("unexpected end of cdo command, missing inputs")
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def node(self, token: str) -> Node:
+        name, params = _split(token)
+        operator = get_operator(name)
+        children: list[Node | str] = []
+        if operator.variadic:
+            if not self.at_end() and self.tokens[self.pos] == "[":
+                self.pos += 1
+                while self.tokens[self.pos : self.pos + 1] != ["]"]:
+                    children.append(self.child())
+                self.pos += 1
+            else:
+                while not self.at_end() and self.tokens[self.pos] != "]":
+                    children.append(self.child())
+            if not children:
+                raise CdoError(f"missing inputs for cdo operator '{name}'")
+        else:
+            for _ in range(operator.n_inputs):
+                children.append(self.child())
+        return Node(operator, params, tuple(children))
+
+    def child(self) -> Node | str:
+        token = self.next()
+        if token == "]":
+            raise CdoError("unbalanced ']' in cdo command")
+        if token.startswith("-") and token != "-":
+            # Unknown operators are reported by name, not taken as files
+            return self.node(token)
+        return token
+
+
+def parse(argv: argvType, with_outputs: bool = False) -> Command:
+    """
+    Parse a cdo command line into its operator tree
+
+    The arity of each operator comes from the operator catalog, so inputs
+    and outputs are found structurally, without filesystem calls. Operators
+    missing from the catalog can't be parsed, the error names them.
+
+    Params:
+        argv: cdo arguments
+        with_outputs: whether argv ends with the output files
+    Raises:
+        CdoError: if argv is not a valid cdo command
+    """
+    argv = list(argv)
+    pos = 0
+    options: list[str] = []
+    while pos < len(argv) and _is_option_token(argv[pos]):
+        options.append(argv[pos])
+        if argv[pos] in OPTIONS_WITH_VALUE:
+            pos += 1
+            if pos == len(argv):
+                raise CdoError(f"missing value for cdo option '{argv[pos - 1]}'")
+            options.append(argv[pos])
+        pos += 1
+    if pos == len(argv):
+        raise CdoError("no cdo operator found")
+
+    token = argv[pos]
+    operator = get_operator(_split(token)[0])
+    end = len(argv)
+    outputs: tuple[str, ...] = ()
+    if with_outputs:
+        n_outputs = 1 if operator.n_outputs < 0 else operator.n_outputs
+        end -= n_outputs
+        if end <= pos:
+            raise CdoError(f"missing outputs for cdo operator '{operator.name}'")
+        outputs = tuple(argv[end:])
+
+    parser = _Parser(argv[pos + 1 : end])
+    root = parser.node(token)
+    if not parser.at_end():
+        extra = " ".join(parser.tokens[parser.pos :])
+        raise CdoError(f"unexpected arguments in cdo command: {extra}")
+    return Command(tuple(options), root, outputs)
@@ -1,22 +1,254 @@
-# import hashlib
 import hashlib
 import os
+import re
+import socket
+import threading
+import time
+import uuid
+from collections.abc import Callable, Iterable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 
+from .cache_index import CacheIndex, IndexEntry, fileStamp
 from .exceptions import CacheError
+from .fingerprint import file_fingerprint
 from .interfaces import ICacheHandler
-from .types import argvType
+from .lock import FileLock
+from .types import (
+    LineageEntry,
+    RunStats,
+    argvType,
+    evictionPolicy,
+    fingerprintPolicy,
+)
+
+CACHE_DIR_ENV = "XCDO_CACHE_DIR"
+# Overrides the number of files above which stat calls are issued
+# concurrently, e.g. lower on networked filesystems where every stat is a
+# metadata-server round trip
+PARALLEL_STAT_ENV = "XCDO_PARALLEL_STAT_THRESHOLD"
+
+_PARALLEL_STAT_THRESHOLD = 32
+_UNCACHED_PREFIX = ".uncached."
+_STAT_WORKERS = 16
+
+# Shared by all stat_many calls, created on first use
+_stat_pool: ThreadPoolExecutor | None = None
+_stat_pool_lock = threading.Lock()
+
+
+def _stat(path: str) -> os.stat_result | None:
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
+def _uncached_paths(cache_files: argvType) -> tuple[str, ...]:
+    return tuple(
+        os.path.join(os.path.dirname(f), _UNCACHED_PREFIX + os.path.basename(f))
+        for f in cache_files
+    )
+
+
+def _file_id(st: os.stat_result) -> tuple[int, int, int, int]:
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _stat_executor() -> ThreadPoolExecutor:
+    global _stat_pool
+    with _stat_pool_lock:
+        if _stat_pool is None:
+            _stat_pool = ThreadPoolExecutor(
+                _STAT_WORKERS, thread_name_prefix="xcdo-stat"
+            )
+        return _stat_pool
+
+
+def _reset_stat_executor() -> None:
+    # The threads of the pool don't survive a fork
+    global _stat_pool, _stat_pool_lock
+    _stat_pool = None
+    _stat_pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_stat_executor)
+
+
+def parallel_stat_threshold() -> int:
+    """Number of files above which `stat_many` stats concurrently"""
+    value = os.environ.get(PARALLEL_STAT_ENV)
+    return int(value) if value else _PARALLEL_STAT_THRESHOLD
+
+
+def stat_many(
+    paths: Sequence[str], threshold: int | None = None
+) -> list[os.stat_result | None]:
+    """
+    Stat all paths in one pass, None for missing files
+
+    Params:
+        threshold: number of paths from which the stat calls are issued
+            concurrently, defaults to `parallel_stat_threshold()`
+    """
+    if threshold is None:
+        threshold = parallel_stat_threshold()
+    if len(paths) < threshold:
+        return [_stat(p) for p in paths]
+    return list(_stat_executor().map(_stat, paths))
+
+
+def default_cache_root() -> str:
+    root = os.environ.get(CACHE_DIR_ENV)
+    if root:
+        return root
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "xcdo", "cdo_cache")
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    root: str
+    entries: int
+    bytes: int
+    max_entries: int | None
+    max_bytes: int | None
+    # Bytes that eviction would free to get within the budgets
+    reclaimable_bytes: int
+    # Temp files of crashed writers, outputs that were not admitted
+    orphaned_bytes: int
+
+
+def _subdirs(path: str) -> list[str]:
+    try:
+        with os.scandir(path) as it:
+            return [e.path for e in it if len(e.name) == 2 and e.is_dir()]
+    except FileNotFoundError:
+        return []
 
 
 class CacheHandler(ICacheHandler):
-    _file_prefix = ".cdo_cache_"
+    """
+    Cache entries live under `root` in two levels of hash-prefix shards,
+    `<root>/ab/cd/<hash>_<i><suffix>`, next to the SQLite index
+    `<root>/index.sqlite` and, with `dedup`, the blob store `<root>/blobs`.
+
+    The root defaults to $XCDO_CACHE_DIR, else $XDG_CACHE_HOME/xcdo/cdo_cache.
+    """
+
+    _entry_pattern = re.compile(r"^([0-9a-f]{8,})_(\d+)((?:\.\w+)*)$")
+
+    def __init__(
+        self,
+        root: str | None = None,
+        use_index: bool = True,
+        lock_stale_after: float = 120.0,
+        max_bytes: int | None = None,
+        max_entries: int | None = None,
+        policy: evictionPolicy = "lru",
+        evict_grace: float = 60.0,
+        gc_interval: float | None = None,
+        admit_min_cost: float = 0.0,
+        fingerprint: fingerprintPolicy | None = None,
+        dedup: bool = False,
+        evict_on_commit: bool = True,
+        before_evict: Callable[[tuple[str, ...]], bool] | None = None,
+    ) -> None:
+        """
+        Params:
+            max_bytes, max_entries: cache budgets, enforced after every
+                write and by `evict`; they need the index
+            policy: which entries to evict first, least recently used
+                ("lru"), least frequently used ("lfu"), the largest per
+                hit ("size") or the cheapest to rebuild per byte by
+                GreedyDual-Size ("gds")
+            evict_grace: entries accessed within this many seconds are
+                never evicted, as they may still be being read
+            gc_interval: if set, run `gc` every gc_interval seconds in a
+                background thread
+            admit_min_cost: entries whose cdo run took less wall time
+                (seconds) are not worth their storage; `commit` moves their
+                outputs to files of the same key that are not indexed,
+                `<hash>_<i>` prefixed with ".uncached.", which the next run
+                replaces and `gc` removes once unmodified for evict_grace
+            fingerprint: key and validate entries on the contents of their
+                input files instead of their paths and mtimes, hashing
+                samples of each file ("sample") or all of it ("full"), see
+                `file_fingerprint`; it needs the index, where fingerprints
+                are kept per (device, inode, size, mtime_ns) so unchanged
+                files are read only once
+            dedup: store each distinct output once, in a content-addressed
+                blob store under root/blobs keyed by the digest of the
+                output, with cache files as hardlinks of the blobs; it
+                needs the index, where the links are counted so budgets
+                count a blob once and evicting an entry only frees the
+                blobs no other entry is linked to. Cache files must not
+                be modified in place.
+            evict_on_commit: enforce the budgets after every write; if
+                False they are only enforced by `evict` and `gc`
+            before_evict: called with the cache files of an entry, under
+                its lock, before the entry is evicted, e.g. to move it to
+                another tier; the entry is kept if it returns False
+        """
+        # Resolved, so cache files recorded as inputs match canonical paths
+        self.root = os.path.realpath(root or default_cache_root())
+        self.lock_stale_after = lock_stale_after
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.policy: evictionPolicy = policy
+        self.evict_grace = evict_grace
+        self.admit_min_cost = admit_min_cost
+        self.fingerprint: fingerprintPolicy | None = fingerprint
+        self.dedup = dedup
+        self.evict_on_commit = evict_on_commit
+        self.before_evict = before_evict
+        self.blob_root = os.path.join(self.root, "blobs")
+        self._known_dirs: set[str] = set()
+        self._subscribers: list[Callable[[tuple[str, ...]], None]] = []
+        self._index: CacheIndex | None = None
+        if use_index:
+            self.ensure_directories_exist((os.path.join(self.root, "index.sqlite"),))
+            # Hits within the grace period must reach other processes
+            self._index = CacheIndex(
+                os.path.join(self.root, "index.sqlite"), evict_grace / 2
+            )
+            if self._index.created:
+                self.rebuild_index()
+        elif max_bytes is not None or max_entries is not None:
+            raise CacheError("cache budgets need the index")
+        elif fingerprint is not None:
+            raise CacheError("fingerprints need the index")
+        elif dedup:
+            raise CacheError("deduplication needs the index")
+        self._gc_stop = threading.Event()
+        if gc_interval is not None:
+            threading.Thread(
+                target=self._gc_loop, args=(gc_interval,), daemon=True
+            ).start()
 
     def ensure_directories_exist(self, paths: argvType) -> None:
-        raise NotImplementedError
+        for p in paths:
+            d = os.path.dirname(p)
+            if d not in self._known_dirs:
+                os.makedirs(d, exist_ok=True)
+                self._known_dirs.add(d)
+
+    def _shard(self, hash_code: str) -> str:
+        return os.path.join(self.root, hash_code[:2], hash_code[2:4])
 
-    def generate_cache_paths(self, noutputs: int, hash_code: str) -> tuple[str, ...]:
+    def generate_cache_paths(
+        self,
+        noutputs: int,
+        hash_code: str,
+        suffixes: argvType = (),
+    ) -> tuple[str, ...]:
+        if suffixes and len(suffixes) != noutputs:
+            raise CacheError("number of suffixes and outputs differ")
+        shard = self._shard(hash_code)
         cache_paths: list[str] = []
         for i in range(noutputs):
-            cache_paths.append(f"{self._file_prefix}{i}_{hash_code}")
+            suffix = suffixes[i] if suffixes else ""
+            cache_paths.append(os.path.join(shard, f"{hash_code}_{i}{suffix}"))
         return tuple(cache_paths)
 
     def cache_exists(self, cache_files: argvType) -> bool:
@@ -31,23 +263,615 @@ class CacheHandler(ICacheHandler):
         if not cache_files:
             return False
 
-        for c in cache_files:
-            if not os.path.isfile(c):
+        index = self._index
+        entry = index.lookup(cache_files) if index else None
+        if (
+            index is not None
+            and entry is not None
+            and entry.inputs is not None
+            and entry.digests is not None
+            and self.fingerprint is not None
+        ):
+            return self._is_content_valid(cache_files, input_files, entry)
+
+        if index is not None and entry is not None and entry.inputs is not None:
+            if entry.stale or set(input_files) != {p for p, _, _ in entry.inputs}:
+                return False
+            # Cache files of other entries are not looked at: rewriting or
+            # removing them marks this entry stale
+            sources = [p for p in input_files if p not in entry.parents]
+            stats = stat_many((*cache_files, *sources))
+            cache_stats = stats[: len(cache_files)]
+            if any(s is None for s in cache_stats):
+                return False
+            current = {
+                (p, s.st_size, s.st_mtime_ns)
+                for p, s in zip(sources, stats[len(cache_files) :])
+                if s is not None
+            }
+            recorded = {i for i in entry.inputs if i[0] not in entry.parents}
+            sizes = tuple(s.st_size for s in cache_stats if s is not None)
+            if entry.sizes != sizes:
+                return False
+            if current != recorded:
+                index.invalidate(p for p, _, _ in recorded - current)
+                return False
+            index.touch(cache_files, entry.last_access)
+            return True
+
+        stats = stat_many((*cache_files, *input_files))
+        cache_stats = stats[: len(cache_files)]
+        input_stats = stats[len(cache_files) :]
+        if any(s is None for s in cache_stats):
+            return False
+
+        if input_stats:
+            if any(s is None for s in input_stats):
                 return False
+            latest_input = max(s.st_mtime for s in input_stats if s is not None)
+            oldest_cache = min(s.st_mtime for s in cache_stats if s is not None)
+            if not latest_input < oldest_cache:
+                return False
+
+        if self._index is not None:
+            # Upgrade legacy or rescanned entries so the next lookup is exact
+            self._record(cache_files, input_files, stats)
+        return True
+
+    def _is_content_valid(
+        self, cache_files: argvType, input_files: argvType, entry: IndexEntry
+    ) -> bool:
+        """Validate an entry on the fingerprints of its inputs"""
+        assert self._index is not None and entry.inputs is not None
+        assert entry.digests is not None
+        if entry.stale or len(input_files) != len(entry.inputs):
+            return False
+        # Same cache files of other entries as recorded are trusted, as
+        # rewriting or removing them marks this entry stale
+        checked = [
+            i
+            for i, p in enumerate(input_files)
+            if not (p == entry.inputs[i][0] and p in entry.parents)
+        ]
+        paths = [input_files[i] for i in checked]
+        stats = stat_many((*cache_files, *paths))
+        cache_stats = stats[: len(cache_files)]
+        if any(s is None for s in cache_stats):
+            return False
+        if entry.sizes != tuple(s.st_size for s in cache_stats if s is not None):
+            return False
+        digests = self._digests(paths, stats[len(cache_files) :])
+        changed = [
+            entry.inputs[i][0]
+            for i, digest in zip(checked, digests)
+            if digest != entry.digests[i]
+        ]
+        if changed:
+            self._index.invalidate(p for p in changed if p in input_files)
+            return False
+        self._index.touch(cache_files, entry.last_access)
+        return True
+
+    def lookup(self, cache_files: argvType) -> IndexEntry | None:
+        """
+        Returns: the index record of an entry, None without the index or if
+            the entry is not recorded
+        """
+        if self._index is None:
+            return None
+        return self._index.lookup(cache_files)
+
+    def fingerprints(self, input_files: argvType) -> tuple[str, ...] | None:
+        if self.fingerprint is None:
+            return None
+        digests = self._digests(input_files, stat_many(input_files))
+        # Missing files are keyed on their path, the cdo run fails anyway
+        return tuple(d or p for p, d in zip(input_files, digests))
+
+    def memoize(self, path: str, kind: str, compute: Callable[[], str]) -> str:
+        # Kept next to the fingerprints, per (device, inode, size, mtime_ns)
+        st = _stat(path) if self._index is not None else None
+        if self._index is None or st is None:
+            return compute()
+        file_id = _file_id(st)
+        value = self._index.fingerprint(file_id, kind)
+        if value is None:
+            value = compute()
+            st = _stat(path)
+            # Not recorded if the file was modified while it was read
+            if st is not None and _file_id(st) == file_id:
+                self._index.record_fingerprint(file_id, kind, value)
+        return value
+
+    def _digests(
+        self, paths: argvType, stats: Sequence[os.stat_result | None]
+    ) -> list[str | None]:
+        """Memoized fingerprints of files, None for missing files"""
+        assert self._index is not None and self.fingerprint is not None
+        digests: list[str | None] = []
+        for path, st in zip(paths, stats):
+            if st is None:
+                digests.append(None)
+                continue
+            file_id = _file_id(st)
+            digest = self._index.fingerprint(file_id, self.fingerprint)
+            if digest is None:
+                try:
+                    digest = file_fingerprint(path, self.fingerprint)
+                except FileNotFoundError:
+                    digests.append(None)
+                    continue
+                self._index.record_fingerprint(file_id, self.fingerprint, digest)
+            digests.append(digest)
+        return digests
 
-        if not input_files:
+    def lock(self, cache_files: argvType) -> FileLock:
+        if not cache_files:
+            raise CacheError("no cache files provided")
+        self.ensure_directories_exist(cache_files)
+        return FileLock(self._lock_path(cache_files), stale_after=self.lock_stale_after)
+
+    def alock(self, cache_files: argvType) -> FileLock:
+        # FileLock also waits asynchronously with `async with`
+        return self.lock(cache_files)
+
+    def generate_temp_paths(self, cache_files: argvType) -> tuple[str, ...]:
+        self.ensure_directories_exist(cache_files)
+        # Same directory as the cache files so that commit is a plain rename
+        tag = f"{socket.gethostname()}.{os.getpid()}.{uuid.uuid4().hex[:8]}"
+        return tuple(
+            os.path.join(os.path.dirname(f), f".tmp.{tag}.{os.path.basename(f)}")
+            for f in cache_files
+        )
+
+    def commit(
+        self,
+        temp_files: argvType,
+        cache_files: argvType,
+        input_files: argvType,
+        run_stats: RunStats | None = None,
+        argv: argvType | None = None,
+        always_admit: bool = False,
+    ) -> tuple[str, ...]:
+        if len(temp_files) != len(cache_files):
+            raise CacheError("number of temp files and cache files differ")
+        for f in temp_files:
+            if not os.path.isfile(f):
+                raise CacheError(f"cache output {f} was not written")
+        if not always_admit and not self._admitted(run_stats):
+            uncached = _uncached_paths(cache_files)
+            for tmp, final in zip(temp_files, uncached):
+                os.replace(tmp, final)
+            return uncached
+        blobs = self._store_blobs(temp_files) if self.dedup else None
+        replaced: list[str] = []
+        evicted: tuple[fileStamp, ...] | None = None
+        if self._index is not None:
+            evicted = self._index.evicted_inputs(cache_files)
+            replaced = self._index.remove(cache_files)
+        self._notify(cache_files)
+        for tmp, final in zip(temp_files, cache_files):
+            os.replace(tmp, final)
+        self._register(cache_files, input_files, run_stats, argv, blobs)
+        if self._index is not None:
+            if not self._recomputed(cache_files, evicted):
+                self._index.invalidate(cache_files)
+            self._drop_blobs(replaced)
+        if (
+            self.evict_on_commit
+            and self._index is not None
+            and self._over_budget(*self._index.totals())
+        ):
+            self.evict(keep=cache_files)
+        return tuple(cache_files)
+
+    def _admitted(self, run_stats: RunStats | None) -> bool:
+        return run_stats is None or run_stats.wall_time >= self.admit_min_cost
+
+    def _recomputed(
+        self, cache_files: argvType, evicted: tuple[fileStamp, ...] | None
+    ) -> bool:
+        """
+        Whether a committed entry was evicted before and is produced from
+        the same inputs again, so the entries produced from it still hold
+        """
+        assert self._index is not None
+        entry = self._index.lookup(cache_files)
+        if evicted is None or entry is None or entry.inputs is None:
+            return False
+
+        def sources(inputs: Iterable[fileStamp]) -> set[tuple[str] | fileStamp]:
+            # Cache files of other entries are rewritten when recomputed
+            return {(i[0],) if i[0] in entry.parents else i for i in inputs}
+
+        return sources(entry.inputs) == sources(evicted)
+
+    def _blob_path(self, digest: str) -> str:
+        algorithm, _, hex_digest = digest.rpartition(":")
+        name = f"{algorithm.replace(':', '-')}-{hex_digest}"
+        return os.path.join(self.blob_root, hex_digest[:2], name)
+
+    def _store_blobs(self, temp_files: argvType) -> list[str | None]:
+        """
+        Link each temp file to the blob of its contents, adding the blob
+        if it is new, or replace the temp file with a link of the existing
+        blob
+
+        Returns: the digest of each blob, None for files kept on their own
+            because the filesystem has no hardlinks
+        """
+        blobs: list[str | None] = []
+        for tmp in temp_files:
+            digest = file_fingerprint(tmp, "full")
+            blob = self._blob_path(digest)
+            self.ensure_directories_exist((blob,))
+            blobs.append(digest if self._link_blob(tmp, blob) else None)
+        return blobs
+
+    def _link_blob(self, tmp: str, blob: str) -> bool:
+        for _ in range(2):
+            try:
+                os.link(tmp, blob)
+                return True
+            except FileExistsError:
+                pass
+            except OSError:
+                return False
+            try:
+                if os.stat(blob).st_size != os.stat(tmp).st_size:
+                    return False
+                # Linked next to tmp first, so tmp is replaced atomically
+                os.link(blob, f"{tmp}.blob")
+            except FileNotFoundError:
+                # The blob was dropped meanwhile, add it again
+                continue
+            except OSError:
+                return False
+            os.replace(f"{tmp}.blob", tmp)
             return True
+        return False
+
+    def _drop_blobs(self, digests: Iterable[str]) -> None:
+        """Remove the blobs no cache file is linked to anymore"""
+        assert self._index is not None
+        for digest in digests:
+            if self._index.blob_refs(digest) == 0:
+                self.discard((self._blob_path(digest),))
+
+    def discard(self, temp_files: argvType) -> None:
+        for f in temp_files:
+            try:
+                os.remove(f)
+            except FileNotFoundError:
+                pass
+
+    def register(self, cache_files: argvType, input_files: argvType) -> None:
+        self._register(cache_files, input_files)
+
+    def _register(
+        self,
+        cache_files: argvType,
+        input_files: argvType,
+        run_stats: RunStats | None = None,
+        argv: argvType | None = None,
+        blobs: Sequence[str | None] | None = None,
+    ) -> None:
+        if self._index is None:
+            return
+        stats = stat_many((*cache_files, *input_files))
+        if any(s is None for s in stats):
+            raise CacheError("cannot register missing cache or input files")
+        self._record(cache_files, input_files, stats, run_stats, argv, blobs)
+
+    def _record(
+        self,
+        cache_files: argvType,
+        input_files: argvType,
+        stats: Sequence[os.stat_result | None],
+        run_stats: RunStats | None = None,
+        argv: argvType | None = None,
+        blobs: Sequence[str | None] | None = None,
+    ) -> None:
+        assert self._index is not None
+        sizes = [s.st_size for s in stats[: len(cache_files)] if s is not None]
+        inputs: list[fileStamp] = [
+            (p, s.st_size, s.st_mtime_ns)
+            for p, s in zip(input_files, stats[len(cache_files) :])
+            if s is not None
+        ]
+        admitted = self._admitted(run_stats)
+        digests = None
+        if self.fingerprint is not None:
+            input_stats = stats[len(cache_files) :]
+            digests = [d or "" for d in self._digests(input_files, input_stats)]
+        self._index.record(
+            cache_files, sizes, inputs, run_stats, admitted, argv, digests, blobs
+        )
+
+    def restamp(
+        self, cache_files: argvType, input_files: argvType, keyed_files: argvType
+    ) -> bool:
+        if self._index is None:
+            return False
+        entry = self._index.lookup(cache_files)
+        if (
+            entry is None
+            or entry.stale
+            or entry.inputs is None
+            or [p for p, _, _ in entry.inputs] != list(input_files)
+        ):
+            return False
+        stats = stat_many((*cache_files, *input_files))
+        if any(s is None for s in stats):
+            return False
+        sizes = tuple(s.st_size for s in stats[: len(cache_files)] if s is not None)
+        if entry.sizes != sizes:
+            return False
+        input_stats = stats[len(cache_files) :]
+        inputs = [
+            (p, s.st_size, s.st_mtime_ns)
+            for p, s in zip(input_files, input_stats)
+            if s is not None
+        ]
+        if inputs != list(entry.inputs):
+            digests = None
+            if self.fingerprint is not None:
+                digests = [d or "" for d in self._digests(input_files, input_stats)]
+            unkeyed = [
+                i
+                for i, (p, stamp) in enumerate(zip(input_files, entry.inputs))
+                if p not in keyed_files and inputs[i] != stamp
+            ]
+            # The key doesn't cover the other inputs, e.g. grid files; only
+            # the same content under a new stamp keeps the entry
+            if unkeyed and (
+                digests is None
+                or entry.digests is None
+                or any(digests[i] != entry.digests[i] for i in unkeyed)
+            ):
+                return False
+            self._index.restamp(cache_files, inputs, digests)
+        self._index.touch(cache_files, entry.last_access)
+        return True
+
+    def rebuild_index(self) -> int:
+        """
+        Rebuild the index by scanning the cache shards
+
+        Recovered entries have unknown inputs and are validated by mtime on
+        their next lookup.
+
+        Returns: number of entries found
+        """
+        if self._index is None:
+            raise CacheError("cache index is not enabled")
+        # hash -> output number -> (path, size)
+        found: dict[str, dict[int, tuple[str, int]]] = {}
+        for shard in self._scan_shards():
+            with os.scandir(shard) as it:
+                for e in it:
+                    m = self._entry_pattern.match(e.name)
+                    if m and e.is_file():
+                        outputs = found.setdefault(m[1], {})
+                        outputs[int(m[2])] = (e.path, e.stat().st_size)
+
+        entries: list[tuple[argvType, list[int]]] = []
+        for outputs in found.values():
+            n = len(outputs)
+            if sorted(outputs) != list(range(n)):
+                continue
+            entries.append(
+                (
+                    tuple(outputs[i][0] for i in range(n)),
+                    [outputs[i][1] for i in range(n)],
+                )
+            )
+        return self._index.replace_all(entries)
+
+    def invalidate(self, paths: argvType) -> int:
+        if self._index is None:
+            return 0
+        return self._index.invalidate(paths)
+
+    def stale_entries(self) -> list[LineageEntry]:
+        if self._index is None:
+            return []
+        # Entries whose source inputs changed, with their descendants
+        recorded = self._index.source_inputs()
+        paths = sorted({stamp[0] for _, sources in recorded for stamp, _ in sources})
+        current = dict(zip(paths, stat_many(paths)))
+        digests: dict[str, str | None] = {}
+        changed: set[str] = set()
+        for _, sources in recorded:
+            for (p, size, mtime_ns), digest in sources:
+                s = current[p]
+                if s is not None and (s.st_size, s.st_mtime_ns) == (size, mtime_ns):
+                    continue
+                if s is not None and digest and self.fingerprint is not None:
+                    # Touched but not modified, e.g. copied with a new mtime
+                    if p not in digests:
+                        (digests[p],) = self._digests((p,), (s,))
+                    if digests[p] == digest:
+                        continue
+                changed.add(p)
+        if changed:
+            self._index.invalidate(changed)
+        return self._index.stale_entries()
+
+    def subscribe(self, callback: Callable[[tuple[str, ...]], None]) -> None:
+        self._subscribers.append(callback)
+
+    def _notify(self, cache_files: argvType) -> None:
+        for callback in self._subscribers:
+            callback(tuple(cache_files))
+
+    def _lock_path(self, cache_files: argvType) -> str:
+        shard, name = os.path.split(cache_files[0])
+        return os.path.join(shard, f"{name.partition('_')[0]}.lock")
+
+    def _over_budget(self, count: int, total: int) -> bool:
+        return (self.max_entries is not None and count > self.max_entries) or (
+            self.max_bytes is not None and total > self.max_bytes
+        )
+
+    def evict(self, keep: argvType = (), dry_run: bool = False) -> tuple[int, int]:
+        """
+        Evict entries that were not admitted, then entries until the cache
+        fits its budgets
+
+        Entries that are locked, or were accessed within `evict_grace`
+        seconds, are skipped.
+
+        Params:
+            keep: cache files of an entry that must not be evicted
+            dry_run: only count what would be evicted
+        Returns: number of entries and bytes evicted
+        """
+        if self._index is None:
+            return 0, 0
+        count, total = self._index.totals()
+        evicted = freed = 0
+        now = time.time()
+        for candidate in self._index.eviction_candidates(self.policy):
+            # Entries that were not admitted come first and go regardless
+            if candidate.admitted and not self._over_budget(
+                count - evicted, total - freed
+            ):
+                break
+            if candidate.outputs == tuple(keep):
+                continue
+            if now - candidate.last_access < self.evict_grace:
+                continue
+            size = self._index.exclusive_bytes(candidate.outputs)
+            if dry_run:
+                if FileLock(self._lock_path(candidate.outputs)).locked:
+                    continue
+            elif not self._remove_entry(candidate.outputs):
+                continue
+            elif self.policy == "gds":
+                self._index.inflate(candidate.priority)
+            evicted += 1
+            freed += size
+        return evicted, freed
+
+    def _remove_entry(self, cache_files: argvType) -> bool:
+        assert self._index is not None
+        lock = FileLock(self._lock_path(cache_files), stale_after=self.lock_stale_after)
+        # An entry being populated or removed by someone else is left alone
+        if not lock.try_acquire():
+            return False
+        try:
+            if self.before_evict is not None and not self.before_evict(
+                tuple(cache_files)
+            ):
+                return False
+            # Entries produced from it keep their outputs and stay valid
+            blobs = self._index.remove(cache_files, keep_lineage=True)
+            self._notify(cache_files)
+            self.discard(cache_files)
+            self._drop_blobs(blobs)
+        finally:
+            lock.release()
+        return True
+
+    def totals(self) -> tuple[int, int]:
+        """
+        Returns: number of entries and their total size in bytes, (0, 0)
+            without the index
+        """
+        if self._index is None:
+            return 0, 0
+        return self._index.totals()
+
+    def stats(self) -> CacheStats:
+        entries, total = self.totals()
+        _, reclaimable = self.evict(dry_run=True)
+        orphans = self._orphans()
+        return CacheStats(
+            root=self.root,
+            entries=entries,
+            bytes=total,
+            max_entries=self.max_entries,
+            max_bytes=self.max_bytes,
+            reclaimable_bytes=reclaimable,
+            orphaned_bytes=sum(size for _, size in orphans),
+        )
+
+    def _orphans(self) -> list[tuple[str, int]]:
+        """
+        Temp files of crashed writers, outputs that were not admitted, lock
+        files of dead owners, and blobs no entry is linked to, e.g. after
+        the index was rebuilt
+        """
+        orphans: list[tuple[str, int]] = []
+        now = time.time()
+        if self._index is not None and os.path.isdir(self.blob_root):
+            linked = {self._blob_path(d) for d in self._index.blob_digests()}
+            for shard in _subdirs(self.blob_root):
+                with os.scandir(shard) as it:
+                    for e in it:
+                        if e.path in linked:
+                            continue
+                        st = e.stat()
+                        if now - st.st_mtime > self.lock_stale_after:
+                            # Cache files still linked to it keep the data
+                            orphans.append((e.path, st.st_size * (st.st_nlink == 1)))
+        for shard in self._scan_shards():
+            with os.scandir(shard) as it:
+                for e in it:
+                    if e.name.startswith(".tmp."):
+                        st = e.stat()
+                        if now - st.st_mtime > self.lock_stale_after:
+                            orphans.append((e.path, st.st_size))
+                    elif e.name.startswith(_UNCACHED_PREFIX):
+                        # Outputs that were not admitted, see `commit`
+                        st = e.stat()
+                        if now - st.st_mtime > self.evict_grace:
+                            orphans.append((e.path, st.st_size))
+                    elif e.name.endswith(".lock"):
+                        if FileLock(e.path, self.lock_stale_after).is_stale():
+                            orphans.append((e.path, 0))
+        return orphans
+
+    def gc(self) -> tuple[int, int]:
+        """
+        Evict entries over budget and remove orphaned files, and the
+        lineage of evicted entries no entry is produced from anymore
+
+        Returns: number of entries and bytes reclaimed
+        """
+        count, freed = self.evict()
+        if self._index is not None:
+            self._index.prune_evicted()
+        for path, size in self._orphans():
+            if path.endswith(".lock"):
+                FileLock(path, self.lock_stale_after).break_if_stale()
+            else:
+                self.discard((path,))
+                freed += size
+        return count, freed
+
+    def _gc_loop(self, interval: float) -> None:
+        while not self._gc_stop.wait(interval):
+            self.gc()
 
-        latest_input_file = max(input_files, key=os.path.getmtime)
-        oldest_cache_file = min(cache_files, key=os.path.getmtime)
+    def close(self) -> None:
+        self._gc_stop.set()
+        if self._index is not None:
+            self._index.close()
 
-        return os.path.getmtime(latest_input_file) < os.path.getmtime(oldest_cache_file)
+    def _scan_shards(self) -> list[str]:
+        shards: list[str] = []
+        for level1 in _subdirs(self.root):
+            shards.extend(_subdirs(level1))
+        return shards
 
     def generate_hash(self, argv: argvType) -> str:
         if not argv:
             raise CacheError("empty commands")
 
-        combined_string = " ".join(argv)
+        # NUL can't occur in arguments, so different argv never join alike
+        combined_string = "\0".join(argv)
         hash_object = hashlib.sha256(combined_string.encode())
         hash_code = hash_object.hexdigest()
         return hash_code
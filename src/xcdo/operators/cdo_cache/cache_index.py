@@ -0,0 +1,751 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+
+from .types import LineageEntry, RunStats, argvType, evictionPolicy
+
+# (path, size, mtime_ns)
+fileStamp = tuple[str, int, int]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    outputs TEXT NOT NULL,
+    sizes TEXT NOT NULL,
+    inputs TEXT,
+    created REAL NOT NULL,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    last_access REAL NOT NULL DEFAULT 0,
+    hits INTEGER NOT NULL DEFAULT 0,
+    wall_time REAL NOT NULL DEFAULT 0,
+    cpu_time REAL NOT NULL DEFAULT 0,
+    admitted INTEGER NOT NULL DEFAULT 1,
+    priority REAL NOT NULL DEFAULT 0,
+    argv TEXT,
+    stale INTEGER NOT NULL DEFAULT 0,
+    digests TEXT
+)
+"""
+
+# Content fingerprints of files and other values derived from their content
+# (see `CacheHandler.memoize`), valid as long as the file is not modified
+_FINGERPRINTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    policy TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (dev, ino, size, mtime_ns, policy)
+)
+"""
+
+# Lineage: the entry owning each cache file, and the files each entry
+# was produced from
+_FILES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    key TEXT NOT NULL
+)
+"""
+
+_LINEAGE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lineage (
+    key TEXT NOT NULL,
+    input TEXT NOT NULL,
+    PRIMARY KEY (key, input)
+)
+"""
+
+_LINEAGE_INDEX = "CREATE INDEX IF NOT EXISTS lineage_input ON lineage (input)"
+
+# Cache files that are hardlinks of a blob of the content-addressed store,
+# the references that keep the blob
+_BLOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    path TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL
+)
+"""
+
+_BLOBS_INDEX = "CREATE INDEX IF NOT EXISTS blobs_digest ON blobs (digest)"
+
+# Evicted entries other entries were produced from: their files and lineage
+# rows are kept, so a change of their inputs still reaches those entries
+_EVICTED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS evicted (
+    key TEXT PRIMARY KEY,
+    outputs TEXT NOT NULL,
+    inputs TEXT,
+    digests TEXT
+)
+"""
+
+# Entries produced, directly or through other entries, from the files in
+# the temporary table `changed`
+_DESCENDANTS = """
+WITH RECURSIVE descendants(key) AS (
+    SELECT l.key FROM lineage l JOIN changed c ON l.input = c.path
+    UNION
+    SELECT l.key FROM lineage l
+    JOIN files f ON l.input = f.path
+    JOIN descendants d ON f.key = d.key
+)
+"""
+
+_META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+)
+"""
+
+# Columns added after the first schema version: name -> definition
+_MIGRATIONS = {
+    "bytes": "INTEGER NOT NULL DEFAULT 0",
+    "last_access": "REAL NOT NULL DEFAULT 0",
+    "hits": "INTEGER NOT NULL DEFAULT 0",
+    "wall_time": "REAL NOT NULL DEFAULT 0",
+    "cpu_time": "REAL NOT NULL DEFAULT 0",
+    "admitted": "INTEGER NOT NULL DEFAULT 1",
+    "priority": "REAL NOT NULL DEFAULT 0",
+    "argv": "TEXT",
+    "stale": "INTEGER NOT NULL DEFAULT 0",
+    "digests": "TEXT",
+}
+
+# GreedyDual-Size priority: the inflation value L plus the cost of
+# rebuilding the entry per byte it occupies
+_GDS_PRIORITY = (
+    "COALESCE((SELECT value FROM meta WHERE name = 'gds_l'), 0)"
+    " + wall_time / MAX(bytes, 1)"
+)
+
+_EVICTION_ORDER: dict[evictionPolicy, str] = {
+    "lru": "last_access ASC",
+    "lfu": "hits ASC, last_access ASC",
+    # Largest bytes per hit first
+    "size": "CAST(bytes AS REAL) / (hits + 1) DESC, last_access ASC",
+    "gds": "priority ASC, last_access ASC",
+}
+
+# Access updates are buffered to keep hits free of index writes
+_TOUCH_FLUSH_SIZE = 256
+_TOUCH_FLUSH_INTERVAL = 10.0
+
+
+@dataclass(frozen=True)
+class IndexEntry:
+    outputs: tuple[str, ...]
+    sizes: tuple[int, ...]
+    # None if the inputs are unknown, e.g. for entries recovered by a rescan
+    inputs: tuple[fileStamp, ...] | None
+    # Inputs that are cache files of other entries
+    parents: frozenset[str] = frozenset()
+    # An entry some of whose inputs were rewritten since it was produced
+    stale: bool = False
+    # Content fingerprints of the inputs, in the order of inputs, if the
+    # entry was recorded with fingerprints
+    digests: tuple[str, ...] | None = None
+    # cdo command producing the entry, without the outputs, if recorded
+    argv: tuple[str, ...] | None = None
+    # cost of producing the entry
+    run_stats: RunStats | None = None
+    # last access time as written to the index, see `CacheIndex.touch`
+    last_access: float = 0.0
+
+
+@dataclass(frozen=True)
+class EvictionCandidate:
+    outputs: tuple[str, ...]
+    bytes: int
+    last_access: float
+    admitted: bool
+    priority: float
+
+
+class CacheIndex:
+    """
+    Persistent SQLite index of the cache entries
+
+    Each entry records its output files with their sizes and the
+    (path, size, mtime_ns) stamps of the input files it was produced from,
+    so a lookup is a single indexed query. Entries also track their last
+    access time and hit count for eviction.
+
+    The entries form a lineage graph: an entry whose inputs are cache
+    files of other entries is their child. Rewriting an entry marks all
+    its descendants stale, so their lookups fail without looking at the
+    files. An evicted entry leaves its descendants valid: its lineage is
+    kept while they exist, see `remove`.
+    """
+
+    def __init__(self, path: str, max_access_lag: float | None = None) -> None:
+        """
+        Params:
+            max_access_lag: seconds the last access time written to the
+                index may lag behind a hit before the hit is written at
+                once instead of buffered, see `touch`
+        """
+        self.path = path
+        self.max_access_lag = max_access_lag
+        self._lock = threading.Lock()
+        self._touched: dict[str, tuple[float, int]] = {}
+        self._last_flush = time.monotonic()
+        self.created = not os.path.exists(path)
+        try:
+            self._conn = self._connect()
+        except sqlite3.DatabaseError:
+            os.replace(path, f"{path}.corrupt")
+            self.created = True
+            self._conn = self._connect()
+        atexit.register(self.flush)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        try:
+            conn.execute(_SCHEMA)
+            conn.execute(_META_SCHEMA)
+            conn.execute(_FILES_SCHEMA)
+            conn.execute(_LINEAGE_SCHEMA)
+            conn.execute(_LINEAGE_INDEX)
+            conn.execute(_FINGERPRINTS_SCHEMA)
+            conn.execute(_BLOBS_SCHEMA)
+            conn.execute(_BLOBS_INDEX)
+            conn.execute(_EVICTED_SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+            for name, definition in _MIGRATIONS.items():
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE entries ADD COLUMN {name} {definition}")
+            conn.commit()
+        except sqlite3.DatabaseError:
+            conn.close()
+            raise
+        return conn
+
+    @staticmethod
+    def key(cache_files: argvType) -> str:
+        return "\0".join(cache_files)
+
+    def lookup(self, cache_files: argvType) -> IndexEntry | None:
+        key = self.key(cache_files)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT outputs, sizes, inputs, stale, digests, argv, wall_time, "
+                "cpu_time, last_access FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+            parents = self._conn.execute(
+                "SELECT l.input FROM lineage l JOIN files f ON l.input = f.path "
+                "WHERE l.key = ?",
+                (key,),
+            ).fetchall()
+        if row is None:
+            return None
+        (
+            outputs,
+            sizes,
+            inputs,
+            stale,
+            digests,
+            argv,
+            wall_time,
+            cpu_time,
+            last_access,
+        ) = row
+        return IndexEntry(
+            outputs=tuple(json.loads(outputs)),
+            sizes=tuple(json.loads(sizes)),
+            inputs=(
+                None
+                if inputs is None
+                else tuple((p, s, m) for p, s, m in json.loads(inputs))
+            ),
+            parents=frozenset(p for (p,) in parents),
+            stale=bool(stale),
+            digests=None if digests is None else tuple(json.loads(digests)),
+            argv=None if argv is None else tuple(json.loads(argv)),
+            run_stats=RunStats(wall_time=wall_time, cpu_time=cpu_time),
+            last_access=last_access,
+        )
+
+    def record(
+        self,
+        outputs: argvType,
+        sizes: Iterable[int],
+        inputs: Iterable[fileStamp] | None,
+        run_stats: RunStats | None = None,
+        admitted: bool = True,
+        argv: argvType | None = None,
+        digests: Iterable[str] | None = None,
+        blobs: Iterable[str | None] | None = None,
+    ) -> None:
+        """
+        Params:
+            run_stats: cost of producing the entry; kept from the previous
+                record of the entry if not given
+            admitted: False for entries that are not worth keeping, they
+                are evicted first
+            argv: cdo command producing the entry, without the outputs;
+                kept from the previous record of the entry if not given
+            digests: content fingerprints of the inputs
+            blobs: for each output, the digest of the blob it is a
+                hardlink of, None if it is stored on its own
+        """
+        inputs = None if inputs is None else list(inputs)
+        sizes = list(sizes)
+        row = self._row(outputs, sizes, inputs)
+        key = row[0]
+        with self._lock, self._conn:
+            if argv is None:
+                previous = self._conn.execute(
+                    "SELECT argv FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                command = previous[0] if previous else None
+            else:
+                command = json.dumps(list(argv))
+            if run_stats is None:
+                previous = self._conn.execute(
+                    "SELECT wall_time, cpu_time FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                wall_time, cpu_time = previous or (0.0, 0.0)
+            else:
+                wall_time, cpu_time = run_stats.wall_time, run_stats.cpu_time
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, outputs, sizes, inputs, "
+                "created, bytes, last_access, wall_time, cpu_time, admitted, argv, "
+                "digests, hits) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, "
+                "COALESCE((SELECT hits FROM entries WHERE key = ?), 0))",
+                (
+                    *row,
+                    wall_time,
+                    cpu_time,
+                    int(admitted),
+                    command,
+                    None if digests is None else json.dumps(list(digests)),
+                    key,
+                ),
+            )
+            self._link(key, outputs, inputs)
+            self._conn.execute("DELETE FROM evicted WHERE key = ?", (key,))
+            self._conn.executemany(
+                "DELETE FROM blobs WHERE path = ?", [(p,) for p in outputs]
+            )
+            if blobs is not None:
+                self._conn.executemany(
+                    "INSERT INTO blobs VALUES (?, ?, ?)",
+                    [
+                        (p, digest, size)
+                        for p, digest, size in zip(outputs, blobs, sizes)
+                        if digest is not None
+                    ],
+                )
+            self._conn.execute(
+                f"UPDATE entries SET priority = {_GDS_PRIORITY} WHERE key = ?",
+                (key,),
+            )
+
+    def restamp(
+        self,
+        cache_files: argvType,
+        inputs: Iterable[fileStamp],
+        digests: Iterable[str] | None = None,
+    ) -> None:
+        """Replace the recorded stamps and fingerprints of an entry's inputs"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE entries SET inputs = ?, digests = ? WHERE key = ?",
+                (
+                    json.dumps([list(i) for i in inputs]),
+                    None if digests is None else json.dumps(list(digests)),
+                    self.key(cache_files),
+                ),
+            )
+
+    def touch(self, cache_files: argvType, last_access: float | None = None) -> None:
+        """
+        Record a cache hit
+
+        Hits are buffered and written in batches, on the next hit after
+        the flush interval or when the buffer is full. Other processes only
+        see the written access time, e.g. to keep entries in their eviction
+        grace period, so a hit is written at once when the written one is
+        older than `max_access_lag`.
+
+        Params:
+            last_access: the access time written for the entry, e.g. from
+                `lookup`
+        """
+        key = self.key(cache_files)
+        now = time.time()
+        with self._lock:
+            _, hits = self._touched.get(key, (0.0, 0))
+            self._touched[key] = (now, hits + 1)
+            due = (
+                len(self._touched) >= _TOUCH_FLUSH_SIZE
+                or time.monotonic() - self._last_flush > _TOUCH_FLUSH_INTERVAL
+                or (
+                    last_access is not None
+                    and self.max_access_lag is not None
+                    and now - last_access > self.max_access_lag
+                )
+            )
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered access updates"""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._last_flush = time.monotonic()
+            if not touched:
+                return
+            with self._conn:
+                self._conn.executemany(
+                    "UPDATE entries SET last_access = MAX(last_access, ?), "
+                    f"hits = hits + ?, priority = {_GDS_PRIORITY} WHERE key = ?",
+                    [(t, h, k) for k, (t, h) in touched.items()],
+                )
+
+    def _link(
+        self, key: str, outputs: argvType, inputs: Iterable[fileStamp] | None
+    ) -> None:
+        # Called with the lock held, in a transaction
+        self._conn.execute("DELETE FROM lineage WHERE key = ?", (key,))
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO files VALUES (?, ?)", [(p, key) for p in outputs]
+        )
+        if inputs is not None:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO lineage VALUES (?, ?)",
+                [(key, p) for p, _, _ in inputs],
+            )
+
+    def remove(self, cache_files: argvType, keep_lineage: bool = False) -> list[str]:
+        """
+        Params:
+            keep_lineage: keep the lineage of the entry if other entries
+                were produced from it, as for an evicted entry: they stay
+                valid, and are marked stale when its inputs change
+        Returns: digests of the blobs the entry's files were linked to
+        """
+        key = self.key(cache_files)
+        paths = [(p,) for p in cache_files]
+        with self._lock, self._conn:
+            has_children = (
+                keep_lineage
+                and self._conn.execute(
+                    "SELECT 1 FROM lineage l JOIN files f ON l.input = f.path "
+                    "WHERE f.key = ? LIMIT 1",
+                    (key,),
+                ).fetchone()
+            )
+            if has_children:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO evicted "
+                    "SELECT key, outputs, inputs, digests FROM entries WHERE key = ?",
+                    (key,),
+                )
+            else:
+                self._conn.execute("DELETE FROM evicted WHERE key = ?", (key,))
+                self._conn.execute("DELETE FROM files WHERE key = ?", (key,))
+                self._conn.execute("DELETE FROM lineage WHERE key = ?", (key,))
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            digests = {
+                row[0]
+                for p in paths
+                for row in self._conn.execute(
+                    "SELECT digest FROM blobs WHERE path = ?", p
+                )
+            }
+            self._conn.executemany("DELETE FROM blobs WHERE path = ?", paths)
+        return sorted(digests)
+
+    def evicted_inputs(self, cache_files: argvType) -> tuple[fileStamp, ...] | None:
+        """
+        Returns: the inputs an evicted entry was produced from, if its
+            lineage was kept
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT inputs FROM evicted WHERE key = ?", (self.key(cache_files),)
+            ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return tuple((p, s, m) for p, s, m in json.loads(row[0]))
+
+    def prune_evicted(self) -> int:
+        """
+        Drop the lineage of evicted entries no entry is produced from anymore
+
+        Returns: number of evicted entries dropped
+        """
+        dropped = 0
+        with self._lock, self._conn:
+            while True:
+                keys = self._conn.execute(
+                    "SELECT key FROM evicted v WHERE NOT EXISTS (SELECT 1 FROM "
+                    "lineage l JOIN files f ON l.input = f.path WHERE f.key = v.key)"
+                ).fetchall()
+                if not keys:
+                    return dropped
+                for table in ("evicted", "files", "lineage"):
+                    self._conn.executemany(f"DELETE FROM {table} WHERE key = ?", keys)
+                dropped += len(keys)
+
+    def blob_refs(self, digest: str) -> int:
+        """Returns: number of cache files linked to the blob"""
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM blobs WHERE digest = ?", (digest,)
+            ).fetchone()
+        return count
+
+    def blob_digests(self) -> set[str]:
+        """Returns: digests of the blobs cache files are linked to"""
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT digest FROM blobs").fetchall()
+        return {digest for (digest,) in rows}
+
+    def exclusive_bytes(self, cache_files: argvType) -> int:
+        """
+        Returns: bytes removing the entry frees, i.e. not counting blobs
+            other entries are linked to
+        """
+        key = self.key(cache_files)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT bytes FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return 0
+            own: dict[str, list[int]] = {}
+            for p in cache_files:
+                for digest, size in self._conn.execute(
+                    "SELECT digest, size FROM blobs WHERE path = ?", (p,)
+                ):
+                    own.setdefault(digest, []).append(size)
+            total = row[0]
+            for digest, sizes in own.items():
+                (refs,) = self._conn.execute(
+                    "SELECT COUNT(*) FROM blobs WHERE digest = ?", (digest,)
+                ).fetchone()
+                # Files of one blob take its size once, and none if the
+                # blob is kept by other entries
+                total -= sum(sizes) if refs > len(sizes) else sum(sizes[1:])
+        return total
+
+    def invalidate(self, paths: Iterable[str]) -> int:
+        """
+        Mark the entries produced from paths stale, and their descendants
+
+        Returns: number of entries that became stale
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS changed (path TEXT PRIMARY KEY)"
+            )
+            self._conn.execute("DELETE FROM changed")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO changed VALUES (?)", [(p,) for p in paths]
+            )
+            # rowcount is not reported for statements starting with WITH
+            before = self._conn.total_changes
+            self._conn.execute(
+                f"{_DESCENDANTS} UPDATE entries SET stale = 1 "
+                "WHERE stale = 0 AND key IN (SELECT key FROM descendants)"
+            )
+            count = self._conn.total_changes - before
+            self._conn.execute("DELETE FROM changed")
+        return count
+
+    def source_inputs(
+        self,
+    ) -> list[tuple[tuple[str, ...], tuple[tuple[fileStamp, str | None], ...]]]:
+        """
+        Outputs and recorded stamps and fingerprints of the inputs that are
+        not cache files, of the entries that are not stale and of the
+        evicted entries whose lineage is kept
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT outputs, inputs, digests FROM entries "
+                "WHERE stale = 0 AND inputs IS NOT NULL "
+                "UNION ALL SELECT outputs, inputs, digests FROM evicted "
+                "WHERE inputs IS NOT NULL"
+            ).fetchall()
+            cache_files = {p for (p,) in self._conn.execute("SELECT path FROM files")}
+        result: list[
+            tuple[tuple[str, ...], tuple[tuple[fileStamp, str | None], ...]]
+        ] = []
+        for outputs, inputs, digests in rows:
+            stamps: list[fileStamp] = [(p, s, m) for p, s, m in json.loads(inputs)]
+            recorded = json.loads(digests) if digests else [None] * len(stamps)
+            sources = tuple(
+                (stamp, digest)
+                for stamp, digest in zip(stamps, recorded)
+                if stamp[0] not in cache_files
+            )
+            if sources:
+                result.append((tuple(json.loads(outputs)), sources))
+        return result
+
+    def fingerprint(
+        self, file_id: tuple[int, int, int, int], policy: str
+    ) -> str | None:
+        """
+        Params:
+            file_id: (device, inode, size, mtime_ns) of a file
+            policy: fingerprint policy, or kind of a memoized value
+        Returns: the fingerprint recorded for the file, if any
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest FROM fingerprints WHERE dev = ? AND ino = ? "
+                "AND size = ? AND mtime_ns = ? AND policy = ?",
+                (*file_id, policy),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def record_fingerprint(
+        self, file_id: tuple[int, int, int, int], policy: str, digest: str
+    ) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?)",
+                (*file_id, policy, digest),
+            )
+
+    def stale_entries(self) -> list[LineageEntry]:
+        """
+        Stale entries with the entries they were produced from; the command
+        of entries produced from an evicted entry is not given, as their
+        inputs are gone
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, outputs, argv, inputs FROM entries WHERE stale = 1"
+            ).fetchall()
+            edges = self._conn.execute(
+                "SELECT l.key, e.outputs FROM lineage l "
+                "JOIN files f ON l.input = f.path JOIN entries e ON f.key = e.key "
+                "WHERE l.key IN (SELECT key FROM entries WHERE stale = 1)"
+            ).fetchall()
+            orphaned = {
+                key
+                for (key,) in self._conn.execute(
+                    "SELECT l.key FROM lineage l "
+                    "JOIN files f ON l.input = f.path JOIN evicted v ON f.key = v.key"
+                )
+            }
+        parents: dict[str, set[tuple[str, ...]]] = {}
+        for key, outputs in edges:
+            parents.setdefault(key, set()).add(tuple(json.loads(outputs)))
+        return [
+            LineageEntry(
+                outputs=tuple(json.loads(outputs)),
+                argv=(
+                    None if argv is None or key in orphaned else tuple(json.loads(argv))
+                ),
+                inputs=(
+                    () if inputs is None else tuple(p for p, _, _ in json.loads(inputs))
+                ),
+                parents=tuple(sorted(parents.get(key, ()))),
+            )
+            for key, outputs, argv, inputs in rows
+        ]
+
+    def totals(self) -> tuple[int, int]:
+        """
+        Returns: number of entries and their total size in bytes, counting
+            each blob once
+        """
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0) "
+                "- (SELECT COALESCE(SUM(size), 0) FROM blobs) "
+                "+ (SELECT COALESCE(SUM(size), 0) FROM "
+                "(SELECT MAX(size) AS size FROM blobs GROUP BY digest)) "
+                "FROM entries"
+            ).fetchone()
+        return count, total
+
+    def eviction_candidates(
+        self, policy: evictionPolicy
+    ) -> Iterator[EvictionCandidate]:
+        """Entries in the order they should be evicted"""
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT outputs, bytes, last_access, admitted, priority FROM entries "
+                f"ORDER BY admitted ASC, {_EVICTION_ORDER[policy]}"
+            ).fetchall()
+        for outputs, size, last_access, admitted, priority in rows:
+            yield EvictionCandidate(
+                tuple(json.loads(outputs)), size, last_access, bool(admitted), priority
+            )
+
+    def inflate(self, priority: float) -> None:
+        """Raise the GreedyDual-Size inflation value to an evicted priority"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO meta VALUES ('gds_l', ?) ON CONFLICT(name) "
+                "DO UPDATE SET value = MAX(value, excluded.value)",
+                (priority,),
+            )
+
+    def replace_all(self, entries: Iterable[tuple[argvType, Iterable[int]]]) -> int:
+        """
+        Replace the index contents with entries whose inputs are unknown
+
+        Returns: number of entries recorded
+        """
+        rows = [self._row(outputs, sizes, None) for outputs, sizes in entries]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.execute("DELETE FROM files")
+            self._conn.execute("DELETE FROM lineage")
+            self._conn.execute("DELETE FROM blobs")
+            self._conn.execute("DELETE FROM evicted")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries "
+                "(key, outputs, sizes, inputs, created, bytes, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?)",
+                [(p, row[0]) for row in rows for p in json.loads(row[1])],
+            )
+        return len(rows)
+
+    def _row(
+        self,
+        outputs: argvType,
+        sizes: Iterable[int],
+        inputs: Iterable[fileStamp] | None,
+    ) -> tuple[str, str, str, str | None, float, int, float]:
+        sizes = list(sizes)
+        now = time.time()
+        return (
+            self.key(outputs),
+            json.dumps(list(outputs)),
+            json.dumps(sizes),
+            None if inputs is None else json.dumps([list(i) for i in inputs]),
+            now,
+            sum(sizes),
+            now,
+        )
+
+    def close(self) -> None:
+        self.flush()
+        atexit.unregister(self.flush)
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,175 @@
+import math
+import os
+import re
+from collections.abc import Callable, Mapping
+from dataclasses import replace
+from functools import lru_cache
+
+from .argv_parser import OPTIONS_WITH_VALUE, Command, Node, is_file_param, parse
+from .catalog import get_operator, is_operator
+from .exceptions import CdoError
+from .types import argvType
+
+# Global options that don't change the outputs: silent, verbose, overwrite,
+# warnings, I/O locking and the number of threads
+NEUTRAL_OPTIONS = frozenset(
+    ("-O", "-s", "-v", "-w", "-L", "--silent", "--verbose", "--no_warnings")
+)
+NEUTRAL_OPTIONS_WITH_VALUE = frozenset(("-P", "--worker"))
+
+# Operators whose parameters are names, codes or other strings that only
+# look like numbers, e.g. the GRIB parameter "1.10" is not "1.1"
+_STRING_PARAMS = frozenset(
+    (
+        "chname",
+        "chparam",
+        "chunit",
+        "changemulti",
+        "delmulti",
+        "delname",
+        "delparam",
+        "select",
+        "delete",
+        "selgridname",
+        "selmulti",
+        "selname",
+        "seloperator",
+        "selparam",
+        "selstdname",
+        "selzaxisname",
+        "setattribute",
+        "setcalendar",
+        "setgriduri",
+        "setname",
+        "setparam",
+        "setpartab",
+        "setprojparams",
+        "setrcaname",
+        "setreftime",
+        "settaxis",
+        "setunit",
+    )
+)
+
+_NUMBER = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?")
+
+
+def canonical_path(path: str) -> str:
+    """
+    Absolute path with symlinks resolved
+
+    Directories are resolved once per process (see `_real_dir`), so a
+    directory symlink retargeted afterwards is not seen; the file itself is
+    checked on every call.
+    """
+    path = os.path.expanduser(path)
+    head, tail = os.path.split(path)
+    if tail in ("", ".", ".."):
+        return os.path.realpath(path)
+    if not os.path.isabs(head):
+        head = os.path.join(os.getcwd(), head)
+    real = os.path.join(_real_dir(head), tail)
+    return os.path.realpath(real) if os.path.islink(real) else real
+
+
+@lru_cache(maxsize=4096)
+def _real_dir(path: str) -> str:
+    # Files of a command mostly share a few directories; realpath costs a
+    # lstat per path component
+    return os.path.realpath(path)
+
+
+def canonical_number(value: str) -> str:
+    """
+    Shortest spelling of a numeric literal, e.g. "1.50" -> "1.5",
+    "1e3" -> "1000"; other values are returned unchanged
+    """
+    if not _NUMBER.fullmatch(value):
+        return value
+    number = float(value)
+    if not math.isfinite(number):
+        return value
+    if number.is_integer() and abs(number) < 1e15:
+        return str(int(number))
+    return repr(number)
+
+
+def canonicalize(
+    argv: argvType,
+    paths: Mapping[str, str] | None = None,
+    keep_neutral: bool = False,
+) -> tuple[str, ...]:
+    """
+    Canonical form of a cdo command, without its outputs, for cache keys
+
+    Commands that give the same outputs map to the same form: aliases are
+    replaced by the operators they stand for, input and parameter files
+    by their resolved absolute paths, numeric parameters by their shortest
+    spelling, and global options are sorted with those that don't change
+    the outputs (`NEUTRAL_OPTIONS`) dropped. Commands that can't be parsed
+    are returned as given, with the files in `paths` replaced.
+
+    Params:
+        paths: files of the command already resolved by `canonical_path`,
+            to not resolve them again
+        keep_neutral: keep the neutral options, e.g. for commands whose
+            printed output is their result, which -s, -v and -w change
+    """
+    paths = paths or {}
+    try:
+        command = parse(argv)
+    except CdoError:
+        return tuple(paths.get(a, a) for a in argv)
+
+    def resolve(path: str) -> str:
+        resolved = paths.get(path)
+        return canonical_path(path) if resolved is None else resolved
+
+    return tuple(
+        _canonical_command(command, resolve, keep_neutral).to_argv(outputs=False)
+    )
+
+
+def _canonical_command(
+    command: Command, resolve: Callable[[str], str], keep_neutral: bool
+) -> Command:
+    groups: list[tuple[str, ...]] = []
+    options = list(command.options)
+    while options:
+        option = options.pop(0)
+        value = (options.pop(0),) if option in OPTIONS_WITH_VALUE and options else ()
+        if not keep_neutral and (
+            option in NEUTRAL_OPTIONS or option in NEUTRAL_OPTIONS_WITH_VALUE
+        ):
+            continue
+        groups.append((option, *value))
+    # A repeated option overrides the earlier one, its order matters
+    if len({g[0] for g in groups}) == len(groups):
+        groups.sort()
+    return replace(
+        command,
+        options=tuple(o for g in groups for o in g),
+        root=_canonical_node(command.root, resolve),
+    )
+
+
+def _canonical_node(node: Node, resolve: Callable[[str], str]) -> Node:
+    operator = node.operator
+    if operator.alias_of is not None and is_operator(operator.alias_of):
+        operator = get_operator(operator.alias_of)
+    numeric = operator.name not in _STRING_PARAMS
+    params = tuple(_canonical_param(p, numeric, resolve) for p in node.params)
+    children = tuple(
+        _canonical_node(c, resolve) if isinstance(c, Node) else resolve(c)
+        for c in node.children
+    )
+    return Node(operator, params, children)
+
+
+def _canonical_param(param: str, numeric: bool, resolve: Callable[[str], str]) -> str:
+    key, sep, value = param.rpartition("=")
+    if is_file_param(value):
+        return f"{key}{sep}{resolve(value)}"
+    if numeric:
+        return f"{key}{sep}{canonical_number(value)}"
+    return param
@@ -0,0 +1,146 @@
+import re
+from dataclasses import dataclass
+from functools import cache
+from importlib import resources
+
+from .exceptions import CdoError
+
+_LINE = re.compile(r"^(\S+)\s+(.*?)\s*\((-?\d+)\|(-?\d+)\)\s*$")
+
+# Operators whose result for a time step only depends on the input time
+# steps of the same calendar year, so a command made of them can be run a
+# year at a time. The catalog file doesn't record this.
+TIME_LOCAL = frozenset(
+    (
+        # Arithmetic and selection per time step
+        "abs",
+        "sqr",
+        "sqrt",
+        "exp",
+        "ln",
+        "log10",
+        "sin",
+        "cos",
+        "addc",
+        "subc",
+        "mulc",
+        "divc",
+        "expr",
+        "aexpr",
+        "setmissval",
+        "setctomiss",
+        "setrtomiss",
+        "selname",
+        "selvar",
+        "selcode",
+        "sellevel",
+        "sellonlatbox",
+        "selindexbox",
+        "delname",
+        "chname",
+        "setattribute",
+        "setunit",
+        "setgrid",
+        # Spatial statistics and interpolation per time step
+        "fldmean",
+        "fldsum",
+        "fldmin",
+        "fldmax",
+        "fldstd",
+        "zonmean",
+        "zonsum",
+        "mermean",
+        "vertmean",
+        "vertsum",
+        "remapbil",
+        "remapbic",
+        "remapnn",
+        "remapdis",
+        "remapcon",
+        "remaplaf",
+        # Statistics over periods within a calendar year
+        "daymean",
+        "daysum",
+        "daymin",
+        "daymax",
+        "daystd",
+        "dayavg",
+        "monmean",
+        "monsum",
+        "monmin",
+        "monmax",
+        "monavg",
+        "yearmean",
+        "yearsum",
+        "yearmin",
+        "yearmax",
+        "yearavg",
+    )
+)
+
+
+@dataclass(frozen=True)
+class Operator:
+    """
+    A cdo operator from the operator catalog
+
+    n_inputs and n_outputs are the number of input and output streams;
+    -1 means any number of inputs, or an output prefix (obase) for outputs.
+    """
+
+    name: str
+    description: str
+    n_inputs: int
+    n_outputs: int
+    # Name of the operator this one is an alias of
+    alias_of: str | None = None
+
+    @property
+    def variadic(self) -> bool:
+        return self.n_inputs < 0
+
+    @property
+    def time_local(self) -> bool:
+        return (self.alias_of or self.name) in TIME_LOCAL
+
+
+def parse_catalog(text: str) -> dict[str, Operator]:
+    """
+    Parse lines of the form `name  description  (n_inputs|n_outputs)`
+    """
+    operators: dict[str, Operator] = {}
+    for line in text.splitlines():
+        m = _LINE.match(line)
+        if m is None:
+            continue
+        name, description, n_inputs, n_outputs = m.groups()
+        alias_of = None
+        if description.startswith("-->"):
+            alias_of = description.removeprefix("-->").strip()
+        operators[name] = Operator(
+            name, description, int(n_inputs), int(n_outputs), alias_of
+        )
+    return operators
+
+
+@cache
+def load_catalog() -> dict[str, Operator]:
+    """The catalog shipped with xcdo, parsed once on first use"""
+    package = resources.files(__name__.rpartition(".")[0])
+    text = package.joinpath("cdo_operators.txt").read_text()
+    return parse_catalog(text)
+
+
+def get_operator(name: str) -> Operator:
+    """
+    Raises:
+        CdoError: if the operator is not in the catalog
+    """
+    try:
+        return load_catalog()[name]
+    except KeyError:
+        raise CdoError(f"Unknown cdo operator '{name}'")
+
+
+def is_operator(name: str) -> bool:
+    return name in load_catalog()
@@ -1,26 +1,705 @@
-from dataclasses import dataclass
+import asyncio
+import contextlib
+import json
+import os
+import time
+import weakref
+from collections.abc import Callable, Iterable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field, replace
+from graphlib import TopologicalSorter
+from typing import TYPE_CHECKING, Any
 
+from .argv_parser import Node, is_expensive, parse
+from .cache_handler import stat_many
+from .cache_index import fileStamp
+from .canonical import canonical_path, canonicalize
+from .catalog import get_operator
+from .datasets import DatasetCache, default_chunks
+from .exceptions import CacheError, CdoError
+from .info_cache import InfoCache
 from .interfaces import ICacheHandler, ICdoHandler
-from .types import argvType
+from .metrics import Metrics
+from .storage import StorageFormat, to_zarr, zarr_storage
+from .types import LineageEntry, RunStats, argvType
+
+if TYPE_CHECKING:
+    import xarray as xr
+
+# Cache files of an information operator: its stdout and stderr
+_INFO_SUFFIXES = (".stdout", ".stderr")
+
+_NO_TIMER = contextlib.nullcontext()
+
+
+@dataclass(frozen=True)
+class _Job:
+    argv: argvType
+    input_files: argvType
+    cache_files: tuple[str, ...]
+    # Converts the outputs of cdo after the run, see `StorageFormat.zarr`
+    storage: StorageFormat | None = None
+    # Command recorded for rebuild, with absolute input paths so that it
+    # runs the same from any working directory; argv if not given
+    canonical_argv: argvType | None = None
+    # Inputs whose content read by the command the key covers, see
+    # `ICacheHandler.restamp`
+    keyed_files: tuple[str, ...] = ()
+    # Cache files that are inputs of other entries are kept whatever their
+    # cost, see `ICacheHandler.commit`
+    always_admit: bool = False
+
+    @property
+    def recorded_argv(self) -> argvType:
+        return self.argv if self.canonical_argv is None else self.canonical_argv
+
+
+_EntryLocks = weakref.WeakValueDictionary[tuple[str, ...], asyncio.Lock]
 
 
 @dataclass
 class CdoCache:
     _cdo: ICdoHandler
     _cache: ICacheHandler
+    max_workers: int | None = None
+    datasets: DatasetCache = field(default_factory=DatasetCache)
+    info: InfoCache = field(default_factory=InfoCache)
+    # Lookup outcomes and timings, cdo runtimes; None records nothing
+    metrics: Metrics | None = None
+    # Format of the cache outputs, None keeps the format cdo writes
+    storage: StorageFormat | None = None
+    _subscribed: bool = field(default=False, init=False, repr=False)
+    # Limits the concurrent cdo runs of aget_cache, one per event loop
+    _semaphores: (
+        "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]"
+    ) = field(default_factory=weakref.WeakKeyDictionary, init=False, repr=False)
+    # Lets the aget_cache calls of an event loop for the same entry wait
+    # for each other, not poll its file lock
+    _entry_locks: (
+        "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _EntryLocks]"
+    ) = field(default_factory=weakref.WeakKeyDictionary, init=False, repr=False)
+
+    def get_cache(
+        self,
+        argv: argvType,
+        n_outputs: int | None = None,
+        suffixes: argvType = (),
+        intermediates: bool | Callable[[Node], bool] = False,
+        storage: StorageFormat | None = None,
+    ) -> tuple[str, ...]:
+        """
+        Get the cache files of a cdo command, running cdo on a miss
+
+        Outputs the cache doesn't admit are returned in files that are not
+        cache entries, see `ICacheHandler.commit`.
+
+        Params:
+            argv: cdo command without the output files
+            n_outputs: number of output files, inferred from the operator
+                catalog if not given
+            suffixes: file extension for each output, e.g. ".nc"
+            intermediates: cache inner subtrees of a chained command as
+                entries of their own and run the command on their cache
+                files. True keeps the subtrees `is_expensive` picks, a
+                callable marks the subtrees to keep explicitly. Kept
+                subtrees are admitted whatever their cost.
+            storage: format of the cache files, defaults to `self.storage`;
+                intermediates are kept in a format cdo reads
+        """
+        storage = storage or self.storage
+        with self._timer("lookup", argv):
+            cdo_version = self._cdo.version()
+            if intermediates:
+                keep = is_expensive if intermediates is True else intermediates
+                inner = storage.for_cdo() if storage is not None else None
+                argv = self._split(argv, keep, cdo_version, inner)
+            job = self._prepare(argv, n_outputs, cdo_version, suffixes, storage)
+            return self._get(job)
+
+    async def aget_cache(
+        self,
+        argv: argvType,
+        n_outputs: int | None = None,
+        suffixes: argvType = (),
+        storage: StorageFormat | None = None,
+    ) -> tuple[str, ...]:
+        """
+        Async version of `get_cache`
+
+        Waiting for an entry another caller is populating does not block
+        the event loop, at most `max_workers` (default: number of CPUs) cdo
+        runs are started concurrently per event loop, and cancelling the
+        call kills its cdo process. The filesystem and index work of the
+        lookup runs in worker threads.
+        """
+        cdo_version = await asyncio.to_thread(self._cdo.version)
+        job = await asyncio.to_thread(
+            self._prepare,
+            argv,
+            n_outputs,
+            cdo_version,
+            suffixes,
+            storage or self.storage,
+        )
+        if await asyncio.to_thread(self._is_valid, job):
+            self._record_lookup(job, True)
+            return job.cache_files
+        async with (
+            self._entry_lock(job.cache_files),
+            self._cache.alock(job.cache_files),
+        ):
+            valid = await asyncio.to_thread(self._is_valid, job)
+            self._record_lookup(job, valid)
+            if not valid:
+                return await self._apopulate(job)
+        return job.cache_files
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_workers or os.cpu_count() or 1)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    def _entry_lock(self, cache_files: tuple[str, ...]) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        locks = self._entry_locks.get(loop)
+        if locks is None:
+            locks = weakref.WeakValueDictionary()
+            self._entry_locks[loop] = locks
+        lock = locks.get(cache_files)
+        if lock is None:
+            lock = asyncio.Lock()
+            locks[cache_files] = lock
+        return lock
+
+    async def _apopulate(self, job: _Job) -> tuple[str, ...]:
+        temp_files = self._cache.generate_temp_paths(job.cache_files)
+        outputs = _run_outputs(job, temp_files)
+        try:
+            async with self._semaphore():
+                run_stats = await self._cdo.arun((*job.argv, *outputs))
+            if self.metrics is not None:
+                self.metrics.run(job.argv, run_stats)
+            if outputs != temp_files:
+                await asyncio.to_thread(self._convert, job, outputs, temp_files)
+            return await asyncio.to_thread(
+                self._cache.commit,
+                temp_files,
+                job.cache_files,
+                job.input_files,
+                run_stats,
+                job.recorded_argv,
+                job.always_admit,
+            )
+        except BaseException:
+            self._cache.discard((*temp_files, *outputs))
+            raise
+
+    def get_dataset(
+        self,
+        argv: argvType,
+        n_outputs: int | None = None,
+        intermediates: bool | Callable[[Node], bool] = False,
+        storage: StorageFormat | None = None,
+        **open_kwargs: Any,
+    ) -> tuple["xr.Dataset", ...]:
+        """
+        Get the cache files of a cdo command as lazily opened Datasets
+
+        Open datasets are kept in `datasets`, so hot entries are not
+        re-opened; they are closed when the entry is rewritten or evicted.
+
+        Params:
+            storage: see `get_cache`, Zarr entries are opened with the
+                zarr engine
+            open_kwargs: passed to `xarray.open_dataset`; chunks defaults
+                to dask chunks if dask is installed
+        """
+        if not self._subscribed:
+            self._cache.subscribe(self.datasets.invalidate)
+            self._subscribed = True
+        open_kwargs.setdefault("chunks", default_chunks())
+        cache_files = self.get_cache(
+            argv, n_outputs, intermediates=intermediates, storage=storage
+        )
+        return tuple(self.datasets.get(f, **open_kwargs) for f in cache_files)
+
+    def get_info(self, argv: argvType) -> tuple[str, str]:
+        """
+        Get the output of a cdo command that writes no files, e.g. sinfo,
+        griddes, showname or ntime, running cdo on a miss
+
+        The stdout and stderr of the run are stored as cache files, which
+        are validated like those of `get_cache`, behind the in-memory tier
+        `info`, which only compares the stamps of the input files.
+
+        Returns: stdout and stderr of the command
+        Raises:
+            ValueError: if the command writes files
+        """
+        if not argv:
+            raise ValueError("no commands provided")
+        if self._cdo.get_n_outputs(argv) != 0:
+            raise ValueError("cdo command writes files, use get_cache")
+        # The printed output depends on -s, -v and -w
+        job = self._prepare(
+            argv, 2, self._cdo.version(), _INFO_SUFFIXES, keep_neutral=True
+        )
+        stamps = _stamps(job.input_files)
+        if stamps is not None:
+            output = self.info.get(job.cache_files, stamps)
+            if output is not None:
+                return output
+        if self._is_valid(job):
+            self._record_lookup(job, True)
+            stdout, stderr = (_read_text(f) for f in job.cache_files)
+        else:
+            with self._cache.lock(job.cache_files):
+                valid = self._is_valid(job)
+                self._record_lookup(job, valid)
+                files = job.cache_files if valid else self._populate_info(job)
+                stdout, stderr = (_read_text(f) for f in files)
+                if files != job.cache_files:
+                    # Not admitted, the output was only kept for this call
+                    self._cache.discard(files)
+        if stamps is not None:
+            self.info.put(job.cache_files, stamps, (stdout, stderr))
+        return stdout, stderr
+
+    def _populate_info(self, job: _Job) -> tuple[str, ...]:
+        temp_files = self._cache.generate_temp_paths(job.cache_files)
+        try:
+            start = time.perf_counter()
+            outputs = self._cdo.captured_run(job.argv)
+            run_stats = RunStats(wall_time=time.perf_counter() - start)
+            if self.metrics is not None:
+                self.metrics.run(job.argv, run_stats)
+            for path, text in zip(temp_files, outputs):
+                with open(path, "w", newline="") as f:
+                    f.write(text)
+            return self._cache.commit(
+                temp_files,
+                job.cache_files,
+                job.input_files,
+                run_stats,
+                job.recorded_argv,
+                job.always_admit,
+            )
+        except BaseException:
+            self._cache.discard(temp_files)
+            raise
+
+    def get_cache_chunked(
+        self,
+        argv: argvType,
+        chunk_years: int = 1,
+        max_workers: int | None = None,
+    ) -> tuple[str, ...]:
+        """
+        Get the cache file of a time-local cdo command, computed in time
+        chunks
+
+        The input is split into chunks of `chunk_years` calendar years that
+        are run concurrently, cached under their own keys, and concatenated
+        with mergetime. A chunk is keyed on the timestamps and fingerprints
+        of its time steps (see `ICdoHandler.get_time_fingerprints`), so when
+        the input is appended to or partly rewritten, only the chunks whose
+        time steps changed are computed again; the others are revalidated
+        with the new stamps of the input. The fingerprints are memoized by
+        the cache handler (see `ICacheHandler.memoize`), so the input is
+        only read again once it is modified. Parameter files, e.g. grids, are
+        validated as usual, so changing them recomputes every chunk. The
+        input is recorded as an input of every chunk, see
+        `ICacheHandler.invalidate`.
+
+        Commands that are not made of time-local operators (see
+        `catalog.TIME_LOCAL`) over a single input file, with a single
+        output, fall back to `get_cache`.
+
+        Params:
+            max_workers: maximum number of concurrent chunk runs,
+                defaults to `self.max_workers` or the number of CPUs
+        """
+        if not argv:
+            raise ValueError("no commands provided")
+        if chunk_years < 1:
+            raise ValueError("chunk_years should be a positive integer")
+        command = parse(argv)
+        nodes = command.root.walk()
+        data_files = {c for n in nodes for c in n.children if isinstance(c, str)}
+        if (
+            len(data_files) != 1
+            or command.root.operator.n_outputs != 1
+            or not all(n.operator.time_local for n in nodes)
+        ):
+            return self.get_cache(argv)
+        (data_file,) = data_files
+        cdo_version = self._cdo.version()
+        steps = self._time_fingerprints(data_file, cdo_version)
+        if not steps:
+            return self.get_cache(argv)
+        fingerprints = dict(steps)
+
+        # The chunks are read by mergetime
+        storage = self.storage.for_cdo() if self.storage is not None else None
+        resolved = {
+            f: canonical_path(f)
+            for f in (data_file, *(f for n in nodes for f in n.param_files()))
+        }
+        param_files = tuple(
+            sorted({resolved[f] for n in nodes for f in n.param_files()})
+        )
+        input_files = (resolved[data_file], *param_files)
+        jobs: list[_Job] = []
+        for years, stamps in _year_chunks((s for s, _ in steps), chunk_years):
+            select = Node(get_operator("selyear"), (years,), (data_file,))
+            root = _replace_input(command.root, data_file, select)
+            chunk_argv = [*command.options, *root.to_argv()]
+            if storage is not None:
+                chunk_argv = storage.apply(chunk_argv)
+            canonical_argv = canonicalize(chunk_argv, resolved)
+            hash_code = self._cache.generate_hash(
+                (
+                    *canonical_argv,
+                    cdo_version,
+                    *stamps,
+                    *(fingerprints[s] for s in stamps),
+                )
+            )
+            cache_files = self._cache.generate_cache_paths(1, hash_code)
+            jobs.append(
+                _Job(
+                    chunk_argv,
+                    input_files,
+                    cache_files,
+                    None,
+                    canonical_argv,
+                    (resolved[data_file],),
+                    # Read by mergetime
+                    always_admit=True,
+                )
+            )
 
-    def get_cache(self, argv: argvType, n_outputs: int) -> tuple[str, ...]:
+        workers = max_workers or self.max_workers or os.cpu_count() or 1
+        with ThreadPoolExecutor(max(1, min(workers, len(jobs)))) as pool:
+            chunks = [f for files in pool.map(self._get, jobs) for f in files]
+        return self.get_cache([*command.options, "-mergetime", *chunks], 1)
+
+    def _time_fingerprints(self, path: str, cdo_version: str) -> list[tuple[str, str]]:
+        """`ICdoHandler.get_time_fingerprints` of a file, memoized"""
+        memo = self._cache.memoize(
+            path,
+            f"time-fingerprints:{cdo_version}",
+            lambda: json.dumps(self._cdo.get_time_fingerprints(path)),
+        )
+        return [(stamp, fingerprint) for stamp, fingerprint in json.loads(memo)]
+
+    def get_cache_many(
+        self,
+        requests: Iterable[tuple[argvType, int | None]],
+        max_workers: int | None = None,
+    ) -> list[tuple[str, ...] | Exception]:
+        """
+        Get the cache files of many independent cdo commands
+
+        Identical requests are collapsed and the misses are run concurrently,
+        each in its own cdo process.
+
+        Params:
+            requests: (argv, n_outputs) pairs, n_outputs may be None to
+                infer it
+            max_workers: maximum number of concurrent cdo processes,
+                defaults to `self.max_workers` or the number of CPUs
+        Returns:
+            cache files or the raised exception for each request, in order
+        """
+        requests = list(requests)
+        if not requests:
+            return []
+        cdo_version = self._cdo.version()
+
+        keys: list[tuple[str, ...] | Exception] = []
+        jobs: dict[tuple[str, ...], _Job] = {}
+        for argv, n_outputs in requests:
+            try:
+                job = self._prepare(argv, n_outputs, cdo_version, (), self.storage)
+            except (CdoError, CacheError, ValueError, OSError) as e:
+                # Invalid requests fail on their own
+                keys.append(e)
+                continue
+            key = tuple(job.cache_files)
+            jobs.setdefault(key, job)
+            keys.append(key)
+
+        workers = max_workers or self.max_workers or os.cpu_count() or 1
+        with ThreadPoolExecutor(max(1, min(workers, len(jobs)))) as pool:
+            futures = {key: pool.submit(self._get, job) for key, job in jobs.items()}
+
+        results: list[tuple[str, ...] | Exception] = []
+        for key in keys:
+            if isinstance(key, Exception):
+                results.append(key)
+                continue
+            error = futures[key].exception()
+            if error is None:
+                results.append(key)
+            elif isinstance(error, Exception):
+                results.append(error)
+            else:
+                raise error
+        return results
+
+    def rebuild(self, max_workers: int | None = None) -> list[tuple[str, ...]]:
+        """
+        Recompute the stale cache entries, see `ICacheHandler.invalidate`
+
+        Entries are rebuilt parents first, independent entries concurrently.
+        Entries whose command is unknown, and their descendants, are left
+        stale; they are recomputed by the next `get_cache`.
+
+        Params:
+            max_workers: maximum number of concurrent cdo processes,
+                defaults to `self.max_workers` or the number of CPUs
+        Returns:
+            cache files of the rebuilt entries, in the order they finished
+        """
+        entries = {e.outputs: e for e in self._cache.stale_entries()}
+        if not entries:
+            return []
+        graph = TopologicalSorter(
+            {k: [p for p in e.parents if p in entries] for k, e in entries.items()}
+        )
+        graph.prepare()
+        skipped: set[tuple[str, ...]] = set()
+        rebuilt: list[tuple[str, ...]] = []
+        workers = max_workers or self.max_workers or os.cpu_count() or 1
+        with ThreadPoolExecutor(max(1, min(workers, len(entries)))) as pool:
+            running: dict[Future[tuple[str, ...]], tuple[str, ...]] = {}
+            while graph.is_active():
+                for key in graph.get_ready():
+                    entry = entries[key]
+                    if entry.argv is None or skipped.intersection(entry.parents):
+                        skipped.add(key)
+                        graph.done(key)
+                        continue
+                    running[pool.submit(self._rebuild, entry)] = key
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rebuilt.append(future.result())
+                    graph.done(running.pop(future))
+        return rebuilt
+
+    def _rebuild(self, entry: LineageEntry) -> tuple[str, ...]:
+        assert entry.argv is not None
+        # The recorded command has the format options, Zarr outputs are
+        # converted again
+        storage = zarr_storage(entry.outputs[0])
+        # Entries produced from it read its cache files
+        job = _Job(entry.argv, entry.inputs, entry.outputs, storage, always_admit=True)
+        return self._get(job)
+
+    def _prepare(
+        self,
+        argv: argvType,
+        n_outputs: int | None,
+        cdo_version: str,
+        suffixes: argvType = (),
+        storage: StorageFormat | None = None,
+        keep_neutral: bool = False,
+    ) -> _Job:
         if not argv:
             raise ValueError("no commands provided")
+        if n_outputs is None:
+            n_outputs = self._cdo.get_n_outputs(argv)
         if n_outputs < 1:
             raise ValueError("n_outputs should be a positive integer")
-        cdo_version = self._cdo.version()
-        input_files = self._cdo.get_input_files(argv)
-        hash_code = self._cache.generate_hash((*argv, cdo_version, *input_files))
-        cache_files = self._cache.generate_cache_paths(n_outputs, hash_code)
-        if not self._cache.cache_exists(cache_files):
-            self._cdo.run((*argv, *cache_files))
-            return cache_files
-        if input_files and not self._cache.is_cache_valid(cache_files, input_files):
-            self._cdo.run((*argv, *cache_files))
-        return cache_files
+        extra_key: tuple[str, ...] = ()
+        if storage is not None:
+            argv = storage.apply(argv)
+            suffixes = storage.suffixes(suffixes, n_outputs)
+            extra_key = storage.key()
+        with self._timer("discover", argv):
+            given_inputs = self._cdo.get_input_files(argv)
+            input_files = tuple(canonical_path(f) for f in given_inputs)
+        with self._timer("hash", argv):
+            canonical_argv = canonicalize(
+                argv, dict(zip(given_inputs, input_files)), keep_neutral
+            )
+            digests = self._cache.fingerprints(input_files)
+            if digests is None:
+                key = (*canonical_argv, cdo_version, *input_files, *extra_key)
+            else:
+                # Identical data at different paths shares the entry
+                content = dict(zip(input_files, digests))
+                key = (
+                    *(content.get(a, a) for a in canonical_argv),
+                    cdo_version,
+                    *digests,
+                    *extra_key,
+                )
+            hash_code = self._cache.generate_hash(key)
+        cache_files = self._cache.generate_cache_paths(n_outputs, hash_code, suffixes)
+        return _Job(argv, input_files, cache_files, storage, canonical_argv)
+
+    def _split(
+        self,
+        argv: argvType,
+        keep: Callable[[Node], bool],
+        cdo_version: str,
+        storage: StorageFormat | None = None,
+    ) -> list[str]:
+        """Replace the kept subtrees of argv with their cache files"""
+        command = parse(argv)
+        root = self._cache_subtrees(
+            command.root, command.options, keep, cdo_version, storage
+        )
+        return replace(command, root=root).to_argv(outputs=False)
+
+    def _cache_subtrees(
+        self,
+        node: Node,
+        options: tuple[str, ...],
+        keep: Callable[[Node], bool],
+        cdo_version: str,
+        storage: StorageFormat | None,
+    ) -> Node:
+        children: list[Node | str] = []
+        for child in node.children:
+            if isinstance(child, Node):
+                # Innermost first, so kept subtrees read kept subtrees
+                child = self._cache_subtrees(child, options, keep, cdo_version, storage)
+                if child.operator.n_outputs == 1 and keep(child):
+                    argv = [*options, *child.to_argv()]
+                    job = self._prepare(argv, 1, cdo_version, (), storage)
+                    (child,) = self._get(replace(job, always_admit=True))
+            children.append(child)
+        return replace(node, children=tuple(children))
+
+    def _get(self, job: _Job) -> tuple[str, ...]:
+        if self._is_valid(job):
+            self._record_lookup(job, True)
+            return job.cache_files
+        with self._cache.lock(job.cache_files):
+            # Another process may have populated the entry while we waited
+            valid = self._is_valid(job)
+            self._record_lookup(job, valid)
+            if not valid:
+                return self._populate(job)
+        return job.cache_files
+
+    def _populate(self, job: _Job) -> tuple[str, ...]:
+        """Returns: the files holding the outputs, see `ICacheHandler.commit`"""
+        temp_files = self._cache.generate_temp_paths(job.cache_files)
+        outputs = _run_outputs(job, temp_files)
+        try:
+            run_stats = self._cdo.run((*job.argv, *outputs))
+            if self.metrics is not None:
+                self.metrics.run(job.argv, run_stats)
+            if outputs != temp_files:
+                self._convert(job, outputs, temp_files)
+            return self._cache.commit(
+                temp_files,
+                job.cache_files,
+                job.input_files,
+                run_stats,
+                job.recorded_argv,
+                job.always_admit,
+            )
+        except BaseException:
+            self._cache.discard((*temp_files, *outputs))
+            raise
+
+    def _convert(
+        self, job: _Job, outputs: tuple[str, ...], temp_files: tuple[str, ...]
+    ) -> None:
+        """Convert the netCDF outputs of cdo to the Zarr temp files"""
+        assert job.storage is not None
+        with self._timer("convert", job.argv):
+            for src, dst in zip(outputs, temp_files):
+                to_zarr(src, dst, job.storage.layout)
+                os.remove(src)
+
+    def _is_valid(self, job: _Job) -> bool:
+        with self._timer("validate", job.argv):
+            if job.keyed_files and self._cache.restamp(
+                job.cache_files, job.input_files, job.keyed_files
+            ):
+                return True
+            return self._cache.is_cache_valid(job.cache_files, job.input_files)
+
+    def _timer(self, phase: str, argv: argvType) -> contextlib.AbstractContextManager:
+        if self.metrics is None:
+            return _NO_TIMER
+        return self.metrics.timer(phase, argv)
+
+    def _record_lookup(self, job: _Job, valid: bool) -> None:
+        if self.metrics is None:
+            return
+        if valid:
+            outcome = "hit"
+        elif self._cache.cache_exists(job.cache_files):
+            # The entry is there but out of date
+            outcome = "stale"
+        else:
+            outcome = "miss"
+        self.metrics.lookup(job.argv, job.cache_files, outcome)
+
+
+def _run_outputs(job: _Job, temp_files: tuple[str, ...]) -> tuple[str, ...]:
+    """Files cdo writes: the temp files, or netCDF files next to them"""
+    if job.storage is None or not job.storage.zarr:
+        return temp_files
+    # Temp names, so gc removes them when left behind
+    return tuple(f"{f}.nc" for f in temp_files)
+
+
+def _stamps(paths: argvType) -> tuple[fileStamp, ...] | None:
+    """(path, size, mtime_ns) of files, None if any is missing"""
+    stamps: list[fileStamp] = []
+    for path, st in zip(paths, stat_many(paths)):
+        if st is None:
+            return None
+        stamps.append((path, st.st_size, st.st_mtime_ns))
+    return tuple(stamps)
+
+
+def _read_text(path: str) -> str:
+    with open(path, newline="") as f:
+        return f.read()
+
+
+def _year_chunks(
+    timestamps: Iterable[str], chunk_years: int
+) -> list[tuple[str, tuple[str, ...]]]:
+    """
+    Group timestamps into chunks of calendar years
+
+    Returns: (cdo year range "first/last", timestamps) of each chunk
+    """
+    by_year: dict[int, list[str]] = {}
+    for stamp in timestamps:
+        year = int(stamp[:1] + stamp[1:].partition("-")[0])
+        by_year.setdefault(year, []).append(stamp)
+    years = sorted(by_year)
+    chunks: list[tuple[str, tuple[str, ...]]] = []
+    for i in range(0, len(years), chunk_years):
+        group = years[i : i + chunk_years]
+        stamps = tuple(s for y in group for s in by_year[y])
+        chunks.append((f"{group[0]}/{group[-1]}", stamps))
+    return chunks
+
+
+def _replace_input(node: Node, path: str, new: Node) -> Node:
+    children = tuple(
+        (
+            _replace_input(c, path, new)
+            if isinstance(c, Node)
+            else new if c == path else c
+        )
+        for c in node.children
+    )
+    return replace(node, children=children)
@@ -1,56 +1,277 @@
+import asyncio
+import hashlib
+import json
 import os
 import re
+import resource
+import shutil
 import subprocess
+import time
 
+from .argv_parser import parse
 from .exceptions import CdoError
+from .governor import ResourceGovernor
 from .interfaces import ICdoHandler
-from .types import argvType
+from .types import RunStats, argvType
+
+# (resolved binary path, inode, mtime_ns) -> version string
+_version_cache: dict[tuple[str, int, int], str] = {}
+
+# Seconds between checks for the exit of an async run, where the process
+# can't be waited for through a pidfd
+_POLL_INTERVAL = 0.05
+
+# A field of `cdo info`: "  <n> : <date> <time> <level, size, missing,
+# minimum, mean, maximum, parameter>"; the header has n = -1
+_INFO_LINE = re.compile(r"\s*\d+\s*:\s*(\S+)\s+(\S+)\s+(.*)")
+
+
+def _default_version_cache() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "xcdo", "cdo_versions.json")
+
+
+async def _wait4(pid: int) -> tuple[int, resource.struct_rusage]:
+    """
+    `os.wait4` of a child process without blocking the event loop
+
+    Returns: wait status and resource usage of the child
+    """
+    try:
+        fd: int | None = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        # Not Linux, or before 5.3
+        fd = None
+    if fd is not None:
+        loop = asyncio.get_running_loop()
+        exited = loop.create_future()
+        loop.add_reader(fd, lambda: exited.done() or exited.set_result(None))
+        try:
+            await exited
+        finally:
+            loop.remove_reader(fd)
+            os.close(fd)
+    while (waited := _reap(pid)) is None:
+        await asyncio.sleep(_POLL_INTERVAL)
+    return waited
+
+
+def _reap(pid: int) -> tuple[int, resource.struct_rusage] | None:
+    # WNOHANG: returns at once, with None while the child still runs
+    reaped, status, rusage = os.wait4(pid, os.WNOHANG)
+    return (status, rusage) if reaped else None
+
+
+def _spawn(args: list[str]) -> subprocess.Popen[bytes]:
+    # Only forks and execs, the wait for the child is left to the caller
+    return subprocess.Popen(args)
+
+
+def _run_stats(start: float, rusage: resource.struct_rusage) -> RunStats:
+    return RunStats(
+        wall_time=time.perf_counter() - start,
+        cpu_time=rusage.ru_utime + rusage.ru_stime,
+        max_rss=rusage.ru_maxrss * 1024,
+        read_blocks=rusage.ru_inblock,
+        write_blocks=rusage.ru_oublock,
+        major_faults=rusage.ru_majflt,
+    )
+
+
+def _with_threads(argv: argvType, threads: int) -> argvType:
+    # A thread count given by the caller wins
+    if "-P" in argv:
+        return argv
+    return ("-P", str(threads), *argv)
 
 
 class CdoHandler(ICdoHandler):
-    def __init__(self, cdo: str = "cdo") -> None:
+    def __init__(
+        self,
+        cdo: str = "cdo",
+        version_cache: str | None = None,
+        governor: ResourceGovernor | None = None,
+        priority: int = 0,
+    ) -> None:
+        """
+        Params:
+            governor: if given, runs wait for cores and memory from the
+                governor and get its number of cdo threads (-P); share one
+                governor between the handlers of a node
+            priority: priority of the runs with the governor, e.g. higher
+                for interactive than for batch work
+        """
         self._cdo = cdo
+        self._cdo_path: str | None = None
+        self._version_cache = version_cache or _default_version_cache()
+        self.governor = governor
+        self.priority = priority
+        # (path, inode, size, mtime_ns) -> (timestamp, fingerprint) pairs
+        self._time_fingerprints: dict[
+            tuple[str, int, int, int], tuple[tuple[str, str], ...]
+        ] = {}
+
+    @property
+    def cdo_path(self) -> str:
+        """Resolved path of the cdo binary, probed on first use"""
+        if self._cdo_path is None:
+            path = shutil.which(self._cdo)
+            if path is None:
+                raise CdoError(f"Command '{self._cdo}' not found")
+            self._cdo_path = os.path.realpath(path)
+        return self._cdo_path
+
+    def run(self, argv: argvType) -> RunStats:
+        if self.governor is None:
+            return self._run(argv)
+        with self.governor.reserve(argv, self.priority) as grant:
+            run_stats = self._run(_with_threads(argv, grant.threads))
+        self.governor.observe(argv, run_stats.max_rss)
+        return run_stats
+
+    def _run(self, argv: argvType) -> RunStats:
+        start = time.perf_counter()
+        proc = subprocess.Popen([self.cdo_path, *argv])
         try:
-            subprocess.run([cdo])
-        except FileNotFoundError:
-            raise CdoError("Command 'cdo' not found")
+            # wait4 gives the rusage of this child alone, unlike
+            # getrusage(RUSAGE_CHILDREN) with concurrent runs
+            _, status, rusage = os.wait4(proc.pid, 0)
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        proc.returncode = ret = os.waitstatus_to_exitcode(status)
+        if ret != 0:
+            raise CdoError(returncode=ret)
+        return _run_stats(start, rusage)
 
-    def run(self, argv: argvType) -> None:
-        ret = subprocess.run(
-            [self._cdo, *argv],
-        ).returncode
+    async def arun(self, argv: argvType) -> RunStats:
+        """Run cdo without blocking the event loop; cancelling kills the process"""
+        if self.governor is None:
+            return await self._arun(argv)
+        grant = await self.governor.aacquire(argv, self.priority)
+        try:
+            run_stats = await self._arun(_with_threads(argv, grant.threads))
+        finally:
+            self.governor.release(grant)
+        self.governor.observe(argv, run_stats.max_rss)
+        return run_stats
+
+    async def _arun(self, argv: argvType) -> RunStats:
+        start = time.perf_counter()
+        proc = _spawn([self.cdo_path, *argv])
+        try:
+            # Reaped here rather than by the event loop, for the rusage of
+            # the child, see `_run`
+            status, rusage = await _wait4(proc.pid)
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        proc.returncode = ret = os.waitstatus_to_exitcode(status)
         if ret != 0:
             raise CdoError(returncode=ret)
+        return _run_stats(start, rusage)
 
     def get_input_files(self, argv: argvType) -> tuple[str, ...]:
-        input_files = self._get_input_files(argv)
-        return tuple(sorted(set(input_files)))
-
-    def _get_input_files(self, argv: argvType) -> list[str]:
-        input_files: list[str] = []
-        for arg in argv:
-            if arg.startswith("-"):
-                input_files.extend(self._get_input_files(arg.split(",")[1:]))
-            elif "=" in arg:
-                input_files.extend(self._get_input_files(arg.split("=")[1:]))
-            elif os.path.isfile(arg):
-                input_files.append(arg)
-        return input_files
+        if not argv:
+            return ()
+        return parse(argv).input_files()
+
+    def get_n_outputs(self, argv: argvType) -> int:
+        return parse(argv).n_outputs
+
+    def get_time_fingerprints(self, path: str) -> tuple[tuple[str, str], ...]:
+        """
+        The fingerprint of a time step hashes the level, grid size, missing
+        values count, minimum, mean and maximum cdo info prints for each of
+        its fields, so changes that keep all of these at cdo's printed
+        precision are not seen.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            raise CdoError(f"File '{path}' not found")
+        key = (path, st.st_ino, st.st_size, st.st_mtime_ns)
+        fingerprints = self._time_fingerprints.get(key)
+        if fingerprints is None:
+            output, _ = self.captured_run(("-s", "-info", path))
+            fields: dict[str, list[str]] = {}
+            for line in output.splitlines():
+                m = _INFO_LINE.fullmatch(line)
+                if m:
+                    fields.setdefault(f"{m[1]}T{m[2]}", []).append(m[3].strip())
+            fingerprints = tuple(
+                (
+                    stamp,
+                    hashlib.blake2b("\n".join(f).encode(), digest_size=16).hexdigest(),
+                )
+                for stamp, f in fields.items()
+            )
+            self._time_fingerprints[key] = fingerprints
+        return fingerprints
 
     def version(self) -> str:
-        output, _ = self._captured_run(("-V",))
+        path = self.cdo_path
+        try:
+            st = os.stat(path)
+        except OSError:
+            raise CdoError(f"Command '{self._cdo}' not found")
+        key = (path, st.st_ino, st.st_mtime_ns)
+
+        version = _version_cache.get(key)
+        if version is None:
+            version = self._read_version_cache(key)
+        if version is None:
+            version = self._probe_version()
+            self._write_version_cache(key, version)
+        _version_cache[key] = version
+        return version
+
+    def _probe_version(self) -> str:
+        output, error = self.captured_run(("-V",))
         pattern = r"Climate Data Operators version (\d+\.\d+\.\d+)"
 
-        match = re.search(pattern, output)
+        match = re.search(pattern, output) or re.search(pattern, error)
         if match:
             return match.group(1)
         else:
             raise CdoError("Could not find cdo version")
 
-    def _captured_run(self, commands: argvType) -> tuple[str, str]:
+    @staticmethod
+    def _version_key(key: tuple[str, int, int]) -> str:
+        return ":".join(str(k) for k in key)
+
+    def _load_version_cache(self) -> dict[str, str]:
+        try:
+            with open(self._version_cache) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}  # type: ignore
+
+    def _read_version_cache(self, key: tuple[str, int, int]) -> str | None:
+        version = self._load_version_cache().get(self._version_key(key))
+        return version if isinstance(version, str) else None
+
+    def _write_version_cache(self, key: tuple[str, int, int], version: str) -> None:
+        data = self._load_version_cache()
+        data[self._version_key(key)] = version
+        tmp = f"{self._version_cache}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self._version_cache), exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self._version_cache)
+        except OSError:
+            # The on-disk cache is only an optimisation
+            pass
+
+    def captured_run(self, argv: argvType) -> tuple[str, str]:
         ret = subprocess.run(
-            [self._cdo, *commands],
+            [self.cdo_path, *argv],
             capture_output=True,
+            check=False,
         )
         if ret.returncode != 0:
             raise CdoError(
@@ -0,0 +1,101 @@
+import importlib.util
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
+from typing import TYPE_CHECKING, Any
+
+from .storage import ZARR_SUFFIX, open_zarr
+
+if TYPE_CHECKING:
+    import xarray as xr
+
+# (inode, size, mtime_ns) of the file a dataset was opened from
+_fileId = tuple[int, int, int]
+
+
+def _open_dataset(path: str, **kwargs: Any) -> "xr.Dataset":
+    if path.endswith(ZARR_SUFFIX):
+        return open_zarr(path, **kwargs)
+    import xarray as xr
+
+    return xr.open_dataset(path, **kwargs)
+
+
+def default_chunks() -> dict[str, Any] | None:
+    """
+    Chunk with dask, one chunk per file, if dask is installed; otherwise
+    leave the variables as lazily loaded backend arrays
+    """
+    return {} if importlib.util.find_spec("dask") is not None else None
+
+
+class DatasetCache:
+    """
+    In-process LRU of open xarray Datasets
+
+    Keeping a dataset open keeps its file handle and its decoded
+    coordinates, so hot cache files are not re-opened and their headers
+    not re-parsed. An entry is reopened when its file was replaced, and
+    dropped when the file is gone or `invalidate` is called.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 32,
+        open_dataset: Callable[..., "xr.Dataset"] = _open_dataset,
+    ) -> None:
+        self.maxsize = maxsize
+        self._open_dataset = open_dataset
+        self._lock = threading.Lock()
+        # (path, open kwargs) -> (file id, dataset)
+        self._datasets: OrderedDict[tuple[str, str], tuple[_fileId, xr.Dataset]] = (
+            OrderedDict()
+        )
+
+    def get(self, path: str, **kwargs: Any) -> "xr.Dataset":
+        """
+        Open path lazily, or reuse the open dataset
+
+        Returns: a shallow copy of the cached dataset, so callers may
+            modify it without affecting other callers
+        Raises:
+            FileNotFoundError: if path does not exist
+        """
+        st = os.stat(path)
+        file_id = (st.st_ino, st.st_size, st.st_mtime_ns)
+        key = (path, repr(sorted(kwargs.items())))
+        with self._lock:
+            cached = self._datasets.get(key)
+            if cached is not None and cached[0] == file_id:
+                self._datasets.move_to_end(key)
+                return cached[1].copy()
+        dataset = self._open_dataset(path, **kwargs)
+        with self._lock:
+            previous = self._datasets.pop(key, None)
+            self._datasets[key] = (file_id, dataset)
+            closing = [] if previous is None else [previous[1]]
+            while len(self._datasets) > self.maxsize:
+                closing.append(self._datasets.popitem(last=False)[1][1])
+        for ds in closing:
+            ds.close()
+        return dataset.copy()
+
+    def invalidate(self, paths: Iterable[str]) -> None:
+        """Close and drop the datasets opened from paths"""
+        paths = set(paths)
+        with self._lock:
+            keys = [k for k in self._datasets if k[0] in paths]
+            closing = [self._datasets.pop(k)[1] for k in keys]
+        for ds in closing:
+            ds.close()
+
+    def clear(self) -> None:
+        with self._lock:
+            closing = [ds for _, ds in self._datasets.values()]
+            self._datasets.clear()
+        for ds in closing:
+            ds.close()
+
+    def __len__(self) -> int:
+        return len(self._datasets)
@@ -0,0 +1,65 @@
+import hashlib
+import importlib
+import mmap
+import os
+from typing import Any
+
+from .exceptions import CacheError
+from .types import fingerprintPolicy
+
+# Bytes hashed at each sample position
+SAMPLE_SIZE = 64 * 1024
+# Number of evenly spaced samples, the first and last included
+N_SAMPLES = 16
+
+_READ_SIZE = 1024**2
+
+
+def _hasher() -> tuple[str, Any]:
+    """
+    A fast non-cryptographic hash if xxhash is installed, else blake2b
+
+    Returns: (algorithm name, hash object)
+    """
+    try:
+        xxhash = importlib.import_module("xxhash")
+    except ImportError:
+        return "b2", hashlib.blake2b(digest_size=16)
+    return "xxh3", xxhash.xxh3_128()
+
+
+def file_fingerprint(
+    path: str,
+    policy: fingerprintPolicy = "sample",
+    sample_size: int = SAMPLE_SIZE,
+    n_samples: int = N_SAMPLES,
+) -> str:
+    """
+    Fingerprint of the contents of a file
+
+    "full" hashes the whole file. "sample" hashes the file size and
+    `n_samples` memory-mapped windows of `sample_size` bytes spread over
+    the file, which reads a few MiB of files of any size; it misses
+    changes that fall between the windows, and hashes files smaller than
+    the samples in full.
+
+    Returns: "<algorithm>:<policy>:<hex digest>"
+    Raises:
+        FileNotFoundError: if path does not exist
+    """
+    if policy not in ("sample", "full"):
+        raise CacheError(f"unknown fingerprint policy: {policy}")
+    name, h = _hasher()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        h.update(size.to_bytes(8, "little"))
+        if policy == "full" or size <= sample_size * n_samples:
+            while chunk := f.read(_READ_SIZE):
+                h.update(chunk)
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                step = (size - sample_size) // max(n_samples - 1, 1)
+                for i in range(n_samples):
+                    start = i * step
+                    h.update(m[start : start + sample_size])
+    return f"{name}:{policy[0]}:{h.hexdigest()}"
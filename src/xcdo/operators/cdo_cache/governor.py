@@ -0,0 +1,206 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from .argv_parser import parse
+from .exceptions import CdoError
+from .types import argvType
+
+# Memory assumed for operators that have not run yet
+DEFAULT_JOB_MEMORY = 256 * 1024**2
+
+# Weight of the previous estimate when a run used less memory than it
+_ESTIMATE_DECAY = 0.9
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def available_memory() -> int:
+    return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def operator_key(argv: argvType) -> str:
+    """The operator chain of a cdo command, e.g. "fldmean-mergetime" """
+    try:
+        command = parse(argv, with_outputs=True)
+    except CdoError:
+        return ""
+    return "-".join(n.operator.name for n in command.root.walk())
+
+
+@dataclass(frozen=True)
+class Grant:
+    """Resources given to a job"""
+
+    threads: int
+    memory: int
+
+
+@dataclass(order=True)
+class _Request:
+    # (-priority, arrival), the heap pops the highest priority first
+    order: tuple[int, int]
+    memory: int = field(compare=False)
+    notify: Callable[[], None] = field(compare=False)
+    grant: Grant | None = field(default=None, compare=False)
+
+
+class ResourceGovernor:
+    """
+    Shares the cores and memory of a node between concurrent cdo runs
+
+    Each job is given a number of cdo threads (`-P`) and an amount of
+    memory, estimated per operator chain from the peak RSS of its past
+    runs. Jobs queue when the node is saturated and are started highest
+    priority first, in arrival order within a priority; a job larger
+    than the free memory waits until the jobs running before it finish,
+    but always starts on an idle node.
+    """
+
+    def __init__(
+        self,
+        cores: int | None = None,
+        memory: int | None = None,
+        max_threads: int | None = None,
+        default_memory: int = DEFAULT_JOB_MEMORY,
+    ) -> None:
+        """
+        Params:
+            cores: cores to give out, defaults to the cores this process
+                may run on
+            memory: bytes to give out, defaults to the physical memory
+            max_threads: most threads for a single job, defaults to cores
+        """
+        self.cores = cores or available_cores()
+        self.memory = memory or available_memory()
+        self.max_threads = max_threads or self.cores
+        self.default_memory = default_memory
+        self._lock = threading.Lock()
+        self._queue: list[_Request] = []
+        self._arrivals = itertools.count()
+        self._used_cores = 0
+        self._used_memory = 0
+        # operator key -> estimated peak memory
+        self._estimates: dict[str, int] = {}
+
+    @property
+    def used(self) -> tuple[int, int]:
+        """Cores and bytes given out"""
+        with self._lock:
+            return self._used_cores, self._used_memory
+
+    def estimate(self, argv: argvType) -> int:
+        """Estimated peak memory of a cdo command in bytes"""
+        with self._lock:
+            return self._estimates.get(operator_key(argv), self.default_memory)
+
+    def observe(self, argv: argvType, max_rss: int) -> None:
+        """Learn from the peak memory of a finished run"""
+        if max_rss <= 0:
+            return
+        key = operator_key(argv)
+        with self._lock:
+            previous = self._estimates.get(key)
+            if previous is None or max_rss >= previous:
+                self._estimates[key] = max_rss
+            else:
+                self._estimates[key] = int(
+                    _ESTIMATE_DECAY * previous + (1 - _ESTIMATE_DECAY) * max_rss
+                )
+
+    def _submit(
+        self, argv: argvType, priority: int, notify: Callable[[], None]
+    ) -> _Request:
+        request = _Request(
+            (-priority, next(self._arrivals)), self.estimate(argv), notify
+        )
+        with self._lock:
+            heapq.heappush(self._queue, request)
+            self._dispatch()
+        return request
+
+    def _dispatch(self) -> None:
+        # Called with the lock held
+        while self._queue:
+            head = self._queue[0]
+            free_cores = self.cores - self._used_cores
+            free_memory = self.memory - self._used_memory
+            idle = self._used_cores == 0
+            if not idle and (free_cores < 1 or head.memory > free_memory):
+                return
+            heapq.heappop(self._queue)
+            # Leave cores for the jobs still waiting
+            share = max(1, free_cores // (len(self._queue) + 1))
+            head.grant = Grant(min(share, self.max_threads), head.memory)
+            self._used_cores += head.grant.threads
+            self._used_memory += head.grant.memory
+            head.notify()
+
+    def _cancel(self, request: _Request) -> None:
+        with self._lock:
+            if request.grant is None:
+                self._queue.remove(request)
+                heapq.heapify(self._queue)
+                return
+        self.release(request.grant)
+
+    def acquire(self, argv: argvType, priority: int = 0) -> Grant:
+        """
+        Wait until the node has room for the job
+
+        Params:
+            argv: the cdo command, with its outputs
+            priority: jobs with a higher priority start first
+        """
+        granted = threading.Event()
+        request = self._submit(argv, priority, granted.set)
+        try:
+            granted.wait()
+        except BaseException:
+            self._cancel(request)
+            raise
+        assert request.grant is not None
+        return request.grant
+
+    async def aacquire(self, argv: argvType, priority: int = 0) -> Grant:
+        """Async version of `acquire`, cancelling gives up the place"""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify() -> None:
+            loop.call_soon_threadsafe(
+                lambda: granted.done() or granted.set_result(None)
+            )
+
+        request = self._submit(argv, priority, notify)
+        try:
+            await granted
+        except BaseException:
+            self._cancel(request)
+            raise
+        assert request.grant is not None
+        return request.grant
+
+    def release(self, grant: Grant) -> None:
+        with self._lock:
+            self._used_cores -= grant.threads
+            self._used_memory -= grant.memory
+            self._dispatch()
+
+    @contextmanager
+    def reserve(self, argv: argvType, priority: int = 0) -> Iterator[Grant]:
+        grant = self.acquire(argv, priority)
+        try:
+            yield grant
+        finally:
+            self.release(grant)
@@ -0,0 +1,51 @@
+import threading
+from collections import OrderedDict
+
+from .cache_index import fileStamp
+
+
+class InfoCache:
+    """
+    In-process LRU of the outputs of information operators
+
+    The memory tier in front of the cache files of `CdoCache.get_info`.
+    An output is kept with the (path, size, mtime_ns) stamps of the input
+    files it was produced from, and a lookup with other stamps misses.
+    """
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        # cache files -> (input stamps, (stdout, stderr))
+        self._outputs: OrderedDict[
+            tuple[str, ...], tuple[tuple[fileStamp, ...], tuple[str, str]]
+        ] = OrderedDict()
+
+    def get(
+        self, cache_files: tuple[str, ...], stamps: tuple[fileStamp, ...]
+    ) -> tuple[str, str] | None:
+        with self._lock:
+            cached = self._outputs.get(cache_files)
+            if cached is None or cached[0] != stamps:
+                return None
+            self._outputs.move_to_end(cache_files)
+            return cached[1]
+
+    def put(
+        self,
+        cache_files: tuple[str, ...],
+        stamps: tuple[fileStamp, ...],
+        output: tuple[str, str],
+    ) -> None:
+        with self._lock:
+            self._outputs[cache_files] = (stamps, output)
+            self._outputs.move_to_end(cache_files)
+            while len(self._outputs) > self.maxsize:
+                self._outputs.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._outputs.clear()
+
+    def __len__(self) -> int:
+        return len(self._outputs)
@@ -1,6 +1,11 @@
+import asyncio
 from abc import ABC, abstractmethod
+from collections.abc import Callable
+from contextlib import AbstractAsyncContextManager, AbstractContextManager
+from types import TracebackType
+from typing import Any
 
-from .types import argvType
+from .types import LineageEntry, RunStats, argvType
 
 
 class ICdoHandler(ABC):
@@ -9,14 +14,28 @@ class ICdoHandler(ABC):
     """
 
     @abstractmethod
-    def run(self, argv: argvType) -> None:
+    def run(self, argv: argvType) -> RunStats:
         """
         Run cdo with arguments
 
+        Returns: wall time and resource usage of the run
         Raises:
             CdoError: If the execution fails
         """
 
+    async def arun(self, argv: argvType) -> RunStats:
+        """
+        Run cdo with arguments without blocking the event loop; cancelling
+        the call stops the run
+
+        The default runs `run` in a worker thread.
+
+        Returns: wall time and resource usage of the run
+        Raises:
+            CdoError: If the execution fails
+        """
+        return await asyncio.to_thread(self.run, argv)
+
     @abstractmethod
     def get_input_files(
         self,
@@ -33,6 +52,37 @@ class ICdoHandler(ABC):
             CdoError: If failed to find input files
         """
 
+    @abstractmethod
+    def get_n_outputs(self, argv: argvType) -> int:
+        """
+        Get the number of output files of cdo commands
+        Params:
+            argv: cdo commands without the output files
+        Raises:
+            CdoError: If the number of outputs can't be determined
+        """
+
+    @abstractmethod
+    def captured_run(self, argv: argvType) -> tuple[str, str]:
+        """
+        Run cdo with arguments, e.g. an information operator that writes no
+        files
+
+        Returns: stdout and stderr of the run
+        Raises:
+            CdoError: If the execution fails
+        """
+
+    @abstractmethod
+    def get_time_fingerprints(self, path: str) -> tuple[tuple[str, str], ...]:
+        """
+        Get a fingerprint of the data of each time step of a data file
+
+        Returns: (timestamp, fingerprint) of each time step, in file order
+        Raises:
+            CdoError: If the file can't be read
+        """
+
     @abstractmethod
     def version(self) -> str:
         """
@@ -45,16 +95,26 @@ class ICdoHandler(ABC):
 
 class ICacheHandler(ABC):
     @abstractmethod
-    def generate_cache_paths(self, noutputs: int, hash_code: str) -> tuple[str, ...]:
+    def generate_cache_paths(
+        self,
+        noutputs: int,
+        hash_code: str,
+        suffixes: argvType = (),
+    ) -> tuple[str, ...]:
         """
         Generates valid cache paths
 
-        Ensures that the directory trees for the paths are created.
+        The directory trees for the paths are created lazily, when the
+        entry is locked for writing.
 
+        Params:
+            suffixes: file extension for each output, e.g. ".nc"
         Returns:
             - path strings: tuple[str,...]
+        Raises:
+            CacheError:
+                - if suffixes are given but their number differs from noutputs
         """
-        pass
 
     @abstractmethod
     def cache_exists(self, cache_files: argvType) -> bool:
@@ -76,13 +136,157 @@ class ICacheHandler(ABC):
         """
         Returns:
             - True: if the oldest cache_file is newer than latest input_file
-            - True: if input_files empty
+            - True: if the cache_files exist and input_files empty
+            - True: if the cache_files and input_files match the ones
+                recorded by `register`
             - False:
+        """
+
+    @abstractmethod
+    def lock(self, cache_files: argvType) -> AbstractContextManager[Any]:
+        """
+        Returns:
+            - context manager holding an exclusive, inter-process lock on
+              the cache entry while it is populated
+        Raises:
+            CacheError:
+                - if cache_files is empty
+        """
+
+    def alock(self, cache_files: argvType) -> AbstractAsyncContextManager[Any]:
+        """
+        Async version of `lock`, waiting for the lock without blocking the
+        event loop
+
+        The default acquires `lock` in a worker thread.
+        """
+        return _ThreadedLock(self.lock(cache_files))
+
+    @abstractmethod
+    def generate_temp_paths(self, cache_files: argvType) -> tuple[str, ...]:
+        """
+        Generates unique temporary paths to write the cache_files into
+
+        Returns:
+            - path strings: tuple[str,...]
+        """
+
+    @abstractmethod
+    def commit(
+        self,
+        temp_files: argvType,
+        cache_files: argvType,
+        input_files: argvType,
+        run_stats: RunStats | None = None,
+        argv: argvType | None = None,
+        always_admit: bool = False,
+    ) -> tuple[str, ...]:
+        """
+        Atomically move the written temp_files to cache_files and register
+        the entry; entries produced from the previous cache_files become
+        stale
+
+        Params:
+            run_stats: cost of producing the entry, used for admission and
+                eviction
+            argv: cdo command producing the entry, without the outputs,
+                recorded so the entry can be rebuilt
+            always_admit: admit the entry whatever its cost, e.g. an
+                intermediate whose cache files are inputs of other entries
+
+        Returns:
+            - the files holding the outputs: cache_files, or, if the entry
+              is not admitted, files of the same key outside the cache
+              that the next run of the entry replaces
+
+        Raises:
+            CacheError:
+                - if any of the temp_files was not written
+        """
+
+    @abstractmethod
+    def discard(self, temp_files: argvType) -> None:
+        """
+        Remove the temp_files of a failed run
+        """
+
+    @abstractmethod
+    def register(self, cache_files: argvType, input_files: argvType) -> None:
+        """
+        Record freshly written cache_files and the input_files they were
+        produced from
+
         Raises:
             CacheError:
-                - if cache_files empty
+                - if cache_files or input_files do not exist
+        """
+
+    @abstractmethod
+    def invalidate(self, paths: argvType) -> int:
+        """
+        Mark the entries produced from paths stale, directly or through
+        other entries
+
+        Returns:
+            - number of entries that became stale
         """
 
+    @abstractmethod
+    def stale_entries(self) -> list[LineageEntry]:
+        """
+        Returns:
+            - entries that are stale, including those whose input files
+              changed since they were produced
+        """
+
+    @abstractmethod
+    def subscribe(self, callback: Callable[[tuple[str, ...]], None]) -> None:
+        """
+        Call callback with the cache files of an entry before the entry
+        is rewritten or removed, e.g. to close open handles on them
+        """
+
+    def fingerprints(self, input_files: argvType) -> tuple[str, ...] | None:
+        """
+        Returns:
+            - content fingerprints of input_files, to key cache entries on
+              instead of the paths
+            - None: if entries are keyed on the input paths, the default
+        """
+        return None
+
+    def memoize(self, path: str, kind: str, compute: Callable[[], str]) -> str:
+        """
+        Memoize a value derived from the content of a file, e.g. the
+        fingerprints of its time steps, for as long as the file is not
+        modified
+
+        The default computes the value on every call.
+
+        Params:
+            kind: what the value is, values of different kinds are kept
+                apart
+            compute: computes the value of the file as it is
+        """
+        return compute()
+
+    def restamp(
+        self, cache_files: argvType, input_files: argvType, keyed_files: argvType
+    ) -> bool:
+        """
+        Validate an entry keyed on the content of the part of keyed_files
+        it reads: it holds whatever the stamps of the keyed_files, unless it
+        was invalidated or its cache files changed. The other input_files
+        must be unchanged. Changed stamps are recorded.
+
+        Returns:
+            - True if the entry is valid
+            - False: if there is no such entry, it is stale, its inputs
+              differ or other inputs changed; the default, then use
+              `is_cache_valid`
+        """
+        return False
+
     @abstractmethod
     def generate_hash(self, argv: argvType) -> str:
         """
@@ -92,3 +296,19 @@ class ICacheHandler(ABC):
         Raises CacheError:
             - if commands empty
         """
+
+
+class _ThreadedLock(AbstractAsyncContextManager[Any]):
+    def __init__(self, lock: AbstractContextManager[Any]) -> None:
+        self._lock = lock
+
+    async def __aenter__(self) -> Any:
+        return await asyncio.to_thread(self._lock.__enter__)
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self._lock.__exit__(exc_type, exc, tb)
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+import uuid
+from types import TracebackType
+from typing import Self
+
+from .exceptions import CacheError
+
+
+class FileLock:
+    """
+    Inter-process lock backed by a lock file, safe on shared filesystems
+
+    The lock file is created with O_CREAT | O_EXCL, which is atomic on local
+    filesystems, NFSv3+ and Lustre/GPFS. It records the owner's host, pid and
+    a unique token, and its mtime is refreshed by a heartbeat while held.
+
+    A lock is stale and gets broken when its owner process is gone (checked
+    for owners on this host) or when it has not been refreshed for
+    `stale_after` seconds.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        timeout: float | None = None,
+        stale_after: float = 120.0,
+        poll_interval: float = 0.05,
+    ) -> None:
+        self.path = path
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self._token = f"{socket.gethostname()} {os.getpid()} {uuid.uuid4().hex}"
+        self._heartbeat: threading.Thread | None = None
+        self._released = threading.Event()
+
+    def try_acquire(self) -> bool:
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(self._token)
+        self._released.clear()
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+        return True
+
+    def _poll(self, start: float) -> bool:
+        if self.try_acquire():
+            return True
+        self.break_if_stale()
+        if self.timeout is not None and time.monotonic() - start > self.timeout:
+            raise CacheError(f"timed out waiting for lock {self.path}")
+        return False
+
+    def acquire(self) -> None:
+        start = time.monotonic()
+        delay = self.poll_interval
+        while not self._poll(start):
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    async def aacquire(self) -> None:
+        """Wait for the lock without blocking the event loop"""
+        start = time.monotonic()
+        delay = self.poll_interval
+        while not self._poll(start):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    def release(self) -> None:
+        if self._heartbeat is None:
+            return
+        self._released.set()
+        self._heartbeat.join()
+        self._heartbeat = None
+        if read_owner(self.path) == self._token:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def _beat(self) -> None:
+        while not self._released.wait(self.stale_after / 4):
+            try:
+                os.utime(self.path)
+            except OSError:
+                break
+
+    def is_stale(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return False
+        if time.time() - mtime > self.stale_after:
+            return True
+        owner = read_owner(self.path)
+        if owner is None:
+            return False
+        host, _, rest = owner.partition(" ")
+        pid = rest.partition(" ")[0]
+        if host != socket.gethostname() or not pid.isdigit():
+            return False
+        return not _pid_alive(int(pid))
+
+    def break_if_stale(self) -> bool:
+        """
+        Remove the lock file if it is stale
+
+        Returns: True if a stale lock was broken
+        """
+        if not self.is_stale():
+            return False
+        owner = read_owner(self.path)
+        # Renaming first makes sure only one waiter breaks a given lock
+        moved = f"{self.path}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(self.path, moved)
+        except FileNotFoundError:
+            return False
+        if read_owner(moved) != owner:
+            # The lock was re-acquired between the check and the rename
+            try:
+                os.link(moved, self.path)
+            except FileExistsError:
+                pass
+        os.remove(moved)
+        return True
+
+    @property
+    def locked(self) -> bool:
+        return os.path.exists(self.path)
+
+    def __enter__(self) -> Self:
+        self.acquire()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.release()
+
+    async def __aenter__(self) -> Self:
+        await self.aacquire()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.release()
+
+
+def read_owner(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,70 @@
+import os
+import shutil
+import uuid
+from typing import Literal
+
+linkMethod = Literal["reflink", "hardlink", "copy"]
+
+# Linux ioctl sharing the extents of one file with another (btrfs, xfs,
+# bcachefs and overlays on them)
+_FICLONE = 0x40049409
+
+
+def _reflink(src: str, dst: str) -> None:
+    import fcntl
+
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+
+
+def _hardlink(src: str, dst: str) -> None:
+    os.link(src, dst)
+
+
+def _copy(src: str, dst: str) -> None:
+    shutil.copyfile(src, dst)
+
+
+_METHODS = {"reflink": _reflink, "hardlink": _hardlink, "copy": _copy}
+
+
+def materialize(
+    src: str,
+    dst: str,
+    methods: tuple[linkMethod, ...] = ("reflink", "copy"),
+) -> linkMethod:
+    """
+    Make dst a file with the contents of the cache file src, without
+    copying data if the filesystem allows
+
+    The methods are tried in order: a reflink gives dst its own inode
+    sharing src's data copy-on-write; a copy works across filesystems. A
+    hardlink shares the inode, so modifying dst in place modifies the
+    cache entry, and with dedup every entry with the same contents; it is
+    only tried if asked for. An existing dst is replaced atomically.
+
+    Returns: the method that succeeded
+    Raises:
+        OSError: if none of the methods succeeded
+    """
+    if "hardlink" in methods and os.path.exists(dst) and os.path.samefile(src, dst):
+        # Already linked, and renaming onto the same inode does nothing
+        return "hardlink"
+    tmp = os.path.join(
+        os.path.dirname(os.path.abspath(dst)),
+        f".{os.path.basename(dst)}.{uuid.uuid4().hex[:8]}.tmp",
+    )
+    error: OSError | None = None
+    for method in methods:
+        try:
+            _METHODS[method](src, tmp)
+            os.replace(tmp, dst)
+            return method
+        except OSError as e:
+            error = e
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+    assert error is not None
+    raise error
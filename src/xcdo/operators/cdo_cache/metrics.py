@@ -0,0 +1,299 @@
+import atexit
+import cProfile
+import json
+import os
+import threading
+import time
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from dataclasses import asdict
+from typing import Any
+
+from .argv_parser import OPTIONS_WITH_VALUE
+from .types import RunStats, argvType
+
+# Upper bounds in seconds of the buckets of the duration histograms
+DEFAULT_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0, 600.0)
+
+# (metric name, sorted (label, value) pairs)
+_seriesKey = tuple[str, tuple[tuple[str, str], ...]]
+
+
+def operator_label(argv: argvType) -> str:
+    """Name of the outermost operator of a cdo command, without parsing it"""
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in OPTIONS_WITH_VALUE:
+            skip = True
+        elif arg.startswith("-") and len(arg) > 1 and arg[1] != "-":
+            name = arg[1:].partition(",")[0]
+            # Single letter flags are options, e.g. -O or -s
+            if len(name) > 1:
+                return name
+    return "unknown"
+
+
+class Sink:
+    """Receives the trace events and the metrics of a `Metrics`"""
+
+    def event(self, record: dict[str, Any]) -> None:
+        """Called for every trace event"""
+
+    def flush(self, metrics: "Metrics") -> None:
+        """Called to export the current metrics"""
+
+
+class PrometheusFile(Sink):
+    """
+    Writes the metrics in the Prometheus text exposition format, e.g. for
+    the textfile collector of the node exporter
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def flush(self, metrics: "Metrics") -> None:
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(tmp, "w") as f:
+            f.write(metrics.to_prometheus())
+        os.replace(tmp, self.path)
+
+
+class JsonlTrace(Sink):
+    """Appends every trace event as a line of JSON"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def event(self, record: dict[str, Any]) -> None:
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+
+
+class SlowProfiler:
+    """
+    Profiles lookups with cProfile and keeps the profiles of those slower
+    than threshold seconds in directory, for `python -m pstats`
+
+    Profiling slows every lookup down, enable it to investigate.
+    """
+
+    def __init__(self, directory: str, threshold: float = 1.0) -> None:
+        self.directory = directory
+        self.threshold = threshold
+
+    @contextmanager
+    def profile(self, label: str) -> Iterator[None]:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active in this thread
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.threshold:
+                os.makedirs(self.directory, exist_ok=True)
+                name = f"{time.strftime('%Y%m%dT%H%M%S')}.{os.getpid()}"
+                name += f".{threading.get_ident()}.{label}.prof"
+                profiler.dump_stats(os.path.join(self.directory, name))
+
+
+class _Histogram:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+
+class Metrics:
+    """
+    Counters and histograms of cache lookups and cdo runs, with pluggable
+    sinks for export and tracing
+
+    Metrics recorded by `CdoCache`, labelled by the outermost operator:
+
+    - xcdo_lookups_total{operator, outcome}: lookups by outcome, "hit",
+      "miss" (no entry) or "stale" (the entry was invalid)
+    - xcdo_phase_seconds{operator, phase}: histogram of the time spent in
+      "lookup" (the whole call), "discover" (input files), "hash",
+      "validate" (stat and index), "run" (cdo) and "convert" (to Zarr, see
+      `StorageFormat`)
+    - xcdo_cdo_cpu_seconds_total, xcdo_cdo_read_blocks_total,
+      xcdo_cdo_write_blocks_total{operator}: child rusage of the cdo runs
+    - xcdo_cdo_max_rss_bytes{operator}: largest peak RSS of a cdo run
+    """
+
+    def __init__(
+        self,
+        sinks: Sequence[Sink] = (),
+        profiler: SlowProfiler | None = None,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        flush_interval: float = 10.0,
+    ) -> None:
+        """
+        Params:
+            sinks: receive the trace events, and the metrics every
+                flush_interval seconds and at exit
+            profiler: profiles the lookups
+        """
+        self.sinks = tuple(sinks)
+        self.profiler = profiler
+        self.buckets = tuple(buckets)
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._counters: dict[_seriesKey, float] = {}
+        self._gauges: dict[_seriesKey, float] = {}
+        self._histograms: dict[_seriesKey, _Histogram] = {}
+        self._last_flush = time.monotonic()
+        if self.sinks:
+            atexit.register(self.flush)
+
+    @staticmethod
+    def _key(name: str, labels: dict[str, str]) -> _seriesKey:
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def maximum(self, name: str, value: float, **labels: str) -> None:
+        """Set a gauge to value if that is larger"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = max(self._gauges.get(key, value), value)
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram.counts[i] += 1
+                    break
+            histogram.count += 1
+            histogram.sum += value
+
+    def event(self, name: str, **fields: Any) -> None:
+        """Send a trace event to the sinks"""
+        if not self.sinks:
+            return
+        record = {"time": time.time(), "event": name, **fields}
+        for sink in self.sinks:
+            sink.event(record)
+
+    @contextmanager
+    def timer(self, phase: str, argv: argvType) -> Iterator[None]:
+        """Observe the duration of a phase of a cdo command"""
+        operator = operator_label(argv)
+        start = time.perf_counter()
+        try:
+            if phase == "lookup" and self.profiler is not None:
+                with self.profiler.profile(operator):
+                    yield
+            else:
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("xcdo_phase_seconds", elapsed, operator=operator, phase=phase)
+            if phase == "lookup":
+                self._maybe_flush()
+
+    def lookup(self, argv: argvType, cache_files: argvType, outcome: str) -> None:
+        operator = operator_label(argv)
+        self.inc("xcdo_lookups_total", operator=operator, outcome=outcome)
+        self.event("lookup", operator=operator, outcome=outcome, key=cache_files[0])
+
+    def run(self, argv: argvType, run_stats: RunStats) -> None:
+        """Record the resource usage of a cdo run"""
+        operator = operator_label(argv)
+        self.observe(
+            "xcdo_phase_seconds", run_stats.wall_time, operator=operator, phase="run"
+        )
+        self.inc("xcdo_cdo_cpu_seconds_total", run_stats.cpu_time, operator=operator)
+        self.inc("xcdo_cdo_read_blocks_total", run_stats.read_blocks, operator=operator)
+        self.inc(
+            "xcdo_cdo_write_blocks_total", run_stats.write_blocks, operator=operator
+        )
+        self.maximum("xcdo_cdo_max_rss_bytes", run_stats.max_rss, operator=operator)
+        self.event("cdo_run", argv=list(argv), **asdict(run_stats))
+
+    def counter(self, name: str, **labels: str) -> float:
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def histogram(self, name: str, **labels: str) -> tuple[int, float]:
+        """Returns: number and sum of the observations"""
+        with self._lock:
+            histogram = self._histograms.get(self._key(name, labels))
+            return (0, 0.0) if histogram is None else (histogram.count, histogram.sum)
+
+    def _maybe_flush(self) -> None:
+        if self.sinks and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        self._last_flush = time.monotonic()
+        for sink in self.sinks:
+            sink.flush(self)
+
+    def to_prometheus(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted(
+                (k, (list(h.counts), h.count, h.sum))
+                for k, h in self._histograms.items()
+            )
+        lines: list[str] = []
+        typed: set[str] = set()
+
+        def header(name: str, kind: str) -> None:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        for (name, labels), value in gauges:
+            header(name, "gauge")
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        for (name, labels), (counts, count, total) in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = (("le", _number(bound)),)
+                lines.append(f"{name}_bucket{_labels(labels + le)} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
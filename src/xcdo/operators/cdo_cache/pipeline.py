@@ -0,0 +1,176 @@
+import functools
+import inspect
+import os
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass
+from typing import Any
+
+from .argv_parser import Node
+from .catalog import Operator, get_operator, is_operator, load_catalog
+from .cdo_cache import CdoCache
+from .exceptions import CdoError
+from .types import argvType
+
+
+class Pipeline:
+    """
+    Builder of lazy cdo expressions, with a method for every operator of
+    the operator catalog
+
+        cdo = Pipeline(CdoCache(CdoHandler(), CacheHandler()))
+        expr = cdo.timmean(cdo.selyear(cdo.mergetime(files), "2000/2020"))
+        expr.compute()
+
+    Positional arguments of an operator method are its inputs when they are
+    expressions, `os.PathLike` paths, strings naming existing files while
+    the operator takes more inputs, or lists of these, and its parameters
+    otherwise; keyword arguments are `key=value` parameters. Files that
+    don't exist yet, or are named like a parameter, are passed as
+    `pathlib.Path`. The methods have signatures from the catalog arity,
+    inputs first, see `operator_signature`. Building an expression only
+    checks the operator arity, nothing runs until `compute`.
+    """
+
+    def __init__(self, cdo_cache: CdoCache, options: argvType = ()) -> None:
+        """
+        Params:
+            cdo_cache: cache the expressions are computed with
+            options: global cdo options, e.g. ("-f", "nc4")
+        """
+        self.cdo_cache = cdo_cache
+        self.options = tuple(options)
+
+    def __getattr__(self, name: str) -> Callable[..., "Expr"]:
+        if name.startswith("_") or not is_operator(name):
+            raise AttributeError(f"'{type(self).__name__}' has no operator '{name}'")
+        operator = get_operator(name)
+
+        def apply(*args: Any, **kwargs: Any) -> Expr:
+            return Expr(self, _node(operator, args, kwargs))
+
+        apply.__name__ = name
+        apply.__doc__ = operator.description
+        apply.__signature__ = operator_signature(operator)  # type: ignore[attr-defined]
+        return apply
+
+    def __dir__(self) -> list[str]:
+        return [*super().__dir__(), *load_catalog()]
+
+
+@dataclass(frozen=True)
+class Expr:
+    """
+    A lazy cdo expression
+
+    Operator methods apply an operator to this expression as its first
+    input, e.g. `expr.selyear("2000/2020").timmean()`.
+    """
+
+    pipeline: Pipeline
+    node: Node
+
+    def __getattr__(self, name: str) -> Callable[..., "Expr"]:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return functools.partial(getattr(self.pipeline, name), self)
+
+    @property
+    def argv(self) -> list[str]:
+        """The expression fused into a single chained cdo command"""
+        return [*self.pipeline.options, *self.node.to_argv()]
+
+    def compute(
+        self,
+        n_outputs: int | None = None,
+        suffixes: argvType = (),
+        intermediates: bool | Callable[[Node], bool] = False,
+    ) -> tuple[str, ...]:
+        """
+        Look up the fused command in the cache, running it on a miss
+
+        Returns: the cache files, see `CdoCache.get_cache`
+        """
+        return self.pipeline.cdo_cache.get_cache(
+            self.argv, n_outputs, suffixes, intermediates
+        )
+
+
+_INPUT_ANNOTATION = "Expr | os.PathLike[str] | str"
+
+
+def operator_signature(operator: Operator) -> inspect.Signature:
+    """
+    Signature of the Pipeline method of an operator: its inputs, a list
+    for variadic operators, then its parameters
+    """
+    kind = inspect.Parameter.POSITIONAL_ONLY
+    if operator.variadic:
+        inputs = [
+            inspect.Parameter("inputs", kind, annotation=f"list[{_INPUT_ANNOTATION}]")
+        ]
+    else:
+        names = (
+            ["input"]
+            if operator.n_inputs == 1
+            else [f"input{i}" for i in range(1, operator.n_inputs + 1)]
+        )
+        inputs = [
+            inspect.Parameter(n, kind, annotation=_INPUT_ANNOTATION) for n in names
+        ]
+    return inspect.Signature(
+        [
+            *inputs,
+            inspect.Parameter("params", inspect.Parameter.VAR_POSITIONAL),
+            inspect.Parameter("kwargs", inspect.Parameter.VAR_KEYWORD),
+        ],
+        return_annotation="Expr",
+    )
+
+
+def _node(operator: Operator, args: tuple[Any, ...], kwargs: Mapping[str, Any]) -> Node:
+    # Strings only fill the inputs that expressions and paths leave
+    room = len(args)
+    if not operator.variadic:
+        given = [a for a in args if isinstance(a, (list, tuple, Expr, os.PathLike))]
+        room = operator.n_inputs - sum(
+            len(a) if isinstance(a, (list, tuple)) else 1 for a in given
+        )
+    inputs: list[Node | str] = []
+    params: list[str] = []
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            inputs.extend(_input(operator, a) for a in arg)
+        elif isinstance(arg, (Expr, os.PathLike)):
+            inputs.append(_input(operator, arg))
+        elif isinstance(arg, str) and room > 0 and os.path.isfile(arg):
+            inputs.append(arg)
+            room -= 1
+        else:
+            params.append(str(arg))
+    params.extend(f"{k}={v}" for k, v in kwargs.items())
+
+    n_inputs = operator.n_inputs
+    if operator.variadic and not inputs:
+        raise CdoError(f"cdo operator '{operator.name}' needs at least one input")
+    if not operator.variadic and len(inputs) != n_inputs:
+        hint = ""
+        if len(inputs) < n_inputs and params:
+            hint = ", pass files that don't exist yet as pathlib.Path"
+        raise CdoError(
+            f"cdo operator '{operator.name}' takes {n_inputs} inputs, "
+            f"got {len(inputs)}{hint}"
+        )
+    return Node(operator, tuple(params), tuple(inputs))
+
+
+def _input(operator: Operator, arg: Any) -> Node | str:
+    if isinstance(arg, Expr):
+        if arg.node.operator.n_outputs != 1:
+            raise CdoError(
+                f"cdo operator '{arg.node.operator.name}' cannot be an input "
+                f"of '{operator.name}', it does not write a single output"
+            )
+        return arg.node
+    if isinstance(arg, (str, os.PathLike)):
+        return os.fspath(arg)
+    raise TypeError(f"invalid input for cdo operator '{operator.name}': {arg!r}")
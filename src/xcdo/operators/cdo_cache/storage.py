@@ -0,0 +1,193 @@
+import importlib
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, Any, Literal
+
+from .argv_parser import OPTIONS_WITH_VALUE, parse
+from .exceptions import CdoError
+from .types import argvType
+
+if TYPE_CHECKING:
+    import xarray as xr
+
+storageLayout = Literal["map", "timeseries"]
+
+# Cache outputs converted to Zarr are zip files with this suffix, preceded
+# by the layout, e.g. "<hash>_0.map.zarr.zip"
+ZARR_SUFFIX = ".zarr.zip"
+
+# Grid points per chunk along each non-time dimension of time-series chunks
+TIMESERIES_TILE = 64
+
+_LAYOUTS: tuple[storageLayout, ...] = ("map", "timeseries")
+
+# cdo chunk type of netCDF4 outputs for each layout
+_CDO_CHUNK_TYPES = {"map": "grid", "timeseries": "lines"}
+
+_FORMAT_OPTIONS = frozenset(("-f", "--format"))
+
+_TIME_DIMS = frozenset(("time", "t"))
+
+
+@dataclass(frozen=True)
+class StorageFormat:
+    """
+    How cdo writes cache outputs
+
+    The options are added to the cdo command unless it sets them itself:
+    a command choosing its own format with -f keeps the format cdo writes
+    for it. Being part of the command, they are part of the cache key.
+
+    `layout` chunks outputs for the way they are read: "map" one
+    horizontal field per chunk, "timeseries" few grid points over many time
+    steps. netCDF4 outputs use the nearest cdo chunk type, `-k grid` and
+    `-k lines` (one grid row per time step).
+
+    With `zarr`, cdo writes netCDF that is converted to a zipped Zarr store
+    for xarray consumers, chunked by layout; a time-series chunk spans all
+    time steps. This needs the zarr package, and an xarray netCDF backend
+    for the file type.
+    """
+
+    # cdo -f file type, e.g. "nc4", "nc4c"; None keeps cdo's default
+    file_type: str | None = "nc4"
+    # deflate level 1-9 of netCDF4 outputs (cdo -z zip_N); None is no
+    # compression
+    zip_level: int | None = 1
+    layout: storageLayout | None = None
+    zarr: bool = False
+
+    def __post_init__(self) -> None:
+        if self.zip_level is not None and not 1 <= self.zip_level <= 9:
+            raise ValueError("zip_level should be between 1 and 9")
+        if self.layout is not None and self.layout not in _CDO_CHUNK_TYPES:
+            raise ValueError(f"unknown storage layout: {self.layout}")
+        netcdf4 = self.file_type is None or self.file_type.startswith("nc4")
+        if self.zarr:
+            if self.file_type is not None and not self.file_type.startswith("nc"):
+                raise ValueError("zarr storage needs a netCDF file type")
+        elif not netcdf4 and (self.zip_level is not None or self.layout is not None):
+            raise ValueError("compression and chunking need netCDF4 (nc4, nc4c)")
+
+    def options(self) -> tuple[str, ...]:
+        """cdo options of the format"""
+        if self.zarr:
+            # Only read once by the conversion, which compresses and chunks
+            return ("-f", self.file_type or "nc4")
+        options: list[str] = []
+        if self.file_type is not None:
+            options += ["-f", self.file_type]
+        if self.zip_level is not None:
+            options += ["-z", f"zip_{self.zip_level}"]
+        if self.layout is not None:
+            options += ["-k", _CDO_CHUNK_TYPES[self.layout]]
+        return tuple(options)
+
+    def apply(self, argv: argvType) -> list[str]:
+        """
+        Add the options to a cdo command, except those it sets itself
+
+        Commands that can't be parsed are returned as given.
+        """
+        try:
+            given = _option_names(parse(argv).options)
+        except CdoError:
+            return list(argv)
+        if given & _FORMAT_OPTIONS:
+            return list(argv)
+        options = self.options()
+        added = [
+            o
+            for name, value in zip(options[::2], options[1::2])
+            if name not in given
+            for o in (name, value)
+        ]
+        return [*added, *argv]
+
+    def suffixes(self, suffixes: argvType, n_outputs: int) -> tuple[str, ...]:
+        """Suffixes of the cache files, marking Zarr outputs"""
+        if not self.zarr:
+            return tuple(suffixes)
+        zarr_suffix = f".{self.layout}{ZARR_SUFFIX}" if self.layout else ZARR_SUFFIX
+        return tuple(s + zarr_suffix for s in suffixes or ("",) * n_outputs)
+
+    def key(self) -> tuple[str, ...]:
+        """Cache key tokens of what the cdo options don't cover"""
+        return ("--xcdo-zarr", self.layout or "") if self.zarr else ()
+
+    def for_cdo(self) -> "StorageFormat":
+        """The format of outputs that cdo reads again, e.g. intermediates"""
+        return replace(self, zarr=False) if self.zarr else self
+
+
+def zarr_storage(path: str) -> StorageFormat | None:
+    """The storage of a cache file converted to Zarr, from its suffix"""
+    if not path.endswith(ZARR_SUFFIX):
+        return None
+    for layout in _LAYOUTS:
+        if path.endswith(f".{layout}{ZARR_SUFFIX}"):
+            return StorageFormat(layout=layout, zarr=True)
+    return StorageFormat(zarr=True)
+
+
+def zarr_chunks(
+    dims: tuple[str, ...], shape: tuple[int, ...], layout: storageLayout | None
+) -> tuple[int, ...] | None:
+    """Chunk shape of a variable for the layout, None leaves it to zarr"""
+    if layout is None:
+        return None
+    chunks: list[int] = []
+    for dim, size in zip(dims, shape):
+        if dim in _TIME_DIMS:
+            chunks.append(1 if layout == "map" else size)
+        else:
+            chunks.append(size if layout == "map" else min(size, TIMESERIES_TILE))
+    return tuple(max(1, c) for c in chunks)
+
+
+def to_zarr(src: str, dst: str, layout: storageLayout | None = None) -> None:
+    """
+    Convert a netCDF file to a zipped Zarr store
+
+    Raises:
+        ImportError: if zarr is not installed
+    """
+    import xarray as xr
+
+    zarr = importlib.import_module("zarr")
+    with xr.open_dataset(src) as ds:
+        encoding: dict[str, dict[str, Any]] = {}
+        for name, var in ds.variables.items():
+            chunks = zarr_chunks(tuple(map(str, var.dims)), var.shape, layout)
+            if chunks is not None:
+                encoding[str(name)] = {"chunks": chunks}
+        store = zarr.storage.ZipStore(dst, mode="w")
+        try:
+            ds.to_zarr(store, mode="w-", encoding=encoding)
+        finally:
+            store.close()
+
+
+def open_zarr(path: str, **kwargs: Any) -> "xr.Dataset":
+    """Open a zipped Zarr store, the store is closed with the dataset"""
+    import xarray as xr
+
+    zarr = importlib.import_module("zarr")
+    store = zarr.storage.ZipStore(path, mode="r")
+    try:
+        ds = xr.open_dataset(store, engine="zarr", **kwargs)
+    except BaseException:
+        store.close()
+        raise
+    ds.set_close(store.close)
+    return ds
+
+
+def _option_names(options: argvType) -> set[str]:
+    names: set[str] = set()
+    options = list(options)
+    while options:
+        option = options.pop(0)
+        names.add(option)
+        if option in OPTIONS_WITH_VALUE and options:
+            options.pop(0)
+    return names
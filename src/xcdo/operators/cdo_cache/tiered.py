@@ -0,0 +1,304 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from collections.abc import Callable
+from contextlib import AbstractAsyncContextManager, AbstractContextManager
+from typing import Any
+
+from .cache_handler import CacheHandler
+from .exceptions import CacheError
+from .interfaces import ICacheHandler
+from .types import LineageEntry, RunStats, argvType
+
+# Fast tier size and the largest entry promoted to it
+DEFAULT_FAST_BYTES = 1024**3
+DEFAULT_PROMOTE_MAX_BYTES = 64 * 1024**2
+
+
+def default_fast_root() -> str:
+    """A per-user directory in /dev/shm, else in the temp directory"""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, f"xcdo-{os.getuid()}", "cdo_cache")
+
+
+class TieredCacheHandler(ICacheHandler):
+    """
+    A size-capped fast tier, e.g. tmpfs, in front of a persistent tier
+
+    New entries are written to the fast tier while it is under
+    `max_bytes`, else to the persistent tier. When it is over, its least
+    recently used entries are demoted in a background thread: copied into
+    the persistent tier, then removed from the fast tier. A valid entry hit
+    in the persistent tier is promoted back in the background if it is at
+    most `promote_max_bytes` and fits in the fast tier.
+
+    Entries accessed within `evict_grace` are not demoted, as they may
+    still be being read; a burst of new entries is therefore capped by
+    writing past the budget to the persistent tier, not by demotion.
+
+    Lookups check the tiers in order, an entry being in a tier when all of
+    its files are there. Files only appear in a tier by rename once they
+    are complete, and an entry leaves the fast tier only after it was
+    committed to the persistent tier, so an entry is never seen half-moved.
+
+    The cache paths of an entry depend on the tier it is in. Entries
+    produced from another entry's cache files, e.g. intermediates, are
+    recorded with the paths they were read from; once that entry has
+    moved, they are only marked stale through the inputs it was produced
+    from, not by a rewrite of it in its new tier.
+    """
+
+    def __init__(
+        self,
+        slow: CacheHandler,
+        fast_root: str | None = None,
+        max_bytes: int = DEFAULT_FAST_BYTES,
+        promote_max_bytes: int = DEFAULT_PROMOTE_MAX_BYTES,
+        evict_grace: float = 60.0,
+    ) -> None:
+        """
+        Params:
+            slow: the persistent tier
+            fast_root: root of the fast tier, see `default_fast_root`; it
+                needs room for the largest output on top of max_bytes
+            max_bytes: size of the fast tier
+            evict_grace: entries of the fast tier accessed within this many
+                seconds are not demoted
+        """
+        self.slow = slow
+        self.max_bytes = max_bytes
+        self.promote_max_bytes = promote_max_bytes
+        self.fast = CacheHandler(
+            fast_root or default_fast_root(),
+            max_bytes=max_bytes,
+            evict_grace=evict_grace,
+            fingerprint=slow.fingerprint,
+            evict_on_commit=False,
+            before_evict=self._demote,
+        )
+        self._queue: queue.Queue[Callable[[], None] | None] = queue.Queue()
+        self._pending: set[tuple[str, ...]] = set()
+        self._pending_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._work, daemon=True)
+        self._worker.start()
+
+    def _tier(self, paths: argvType) -> CacheHandler:
+        if not paths:
+            raise CacheError("no cache files provided")
+        root = os.path.join(self.fast.root, "")
+        return self.fast if paths[0].startswith(root) else self.slow
+
+    @staticmethod
+    def _move(paths: argvType, src: CacheHandler, dst: CacheHandler) -> tuple[str, ...]:
+        """Paths of the same entry in another tier"""
+        return tuple(
+            os.path.join(dst.root, os.path.relpath(p, src.root)) for p in paths
+        )
+
+    def generate_cache_paths(
+        self,
+        noutputs: int,
+        hash_code: str,
+        suffixes: argvType = (),
+    ) -> tuple[str, ...]:
+        fast_paths = self.fast.generate_cache_paths(noutputs, hash_code, suffixes)
+        if all(os.path.isfile(p) for p in fast_paths):
+            return fast_paths
+        slow_paths = self._move(fast_paths, self.fast, self.slow)
+        if all(os.path.isfile(p) for p in slow_paths):
+            return slow_paths
+        # New entries start in the fast tier, if it has room
+        return fast_paths if self._fast_room() > 0 else slow_paths
+
+    def cache_exists(self, cache_files: argvType) -> bool:
+        return self._tier(cache_files).cache_exists(cache_files)
+
+    def is_cache_valid(self, cache_files: argvType, input_files: argvType) -> bool:
+        tier = self._tier(cache_files)
+        if not tier.is_cache_valid(cache_files, input_files):
+            return False
+        if tier is self.slow:
+            entry = self.slow.lookup(cache_files)
+            size = sum(entry.sizes) if entry is not None else self.promote_max_bytes
+            if size <= self.promote_max_bytes:
+                files, inputs = tuple(cache_files), tuple(input_files)
+                self._submit(files, lambda: self._promote(files, inputs))
+        return True
+
+    def lock(self, cache_files: argvType) -> AbstractContextManager[Any]:
+        return self._tier(cache_files).lock(cache_files)
+
+    def alock(self, cache_files: argvType) -> AbstractAsyncContextManager[Any]:
+        return self._tier(cache_files).alock(cache_files)
+
+    def generate_temp_paths(self, cache_files: argvType) -> tuple[str, ...]:
+        return self._tier(cache_files).generate_temp_paths(cache_files)
+
+    def commit(
+        self,
+        temp_files: argvType,
+        cache_files: argvType,
+        input_files: argvType,
+        run_stats: RunStats | None = None,
+        argv: argvType | None = None,
+        always_admit: bool = False,
+    ) -> tuple[str, ...]:
+        tier = self._tier(cache_files)
+        files = tier.commit(
+            temp_files, cache_files, input_files, run_stats, argv, always_admit
+        )
+        if tier is self.fast:
+            self._submit((), self._demote_over_budget)
+        return files
+
+    def discard(self, temp_files: argvType) -> None:
+        if temp_files:
+            self._tier(temp_files).discard(temp_files)
+
+    def register(self, cache_files: argvType, input_files: argvType) -> None:
+        self._tier(cache_files).register(cache_files, input_files)
+
+    def invalidate(self, paths: argvType) -> int:
+        paths = tuple(paths)
+        return self.fast.invalidate(paths) + self.slow.invalidate(paths)
+
+    def stale_entries(self) -> list[LineageEntry]:
+        return self.fast.stale_entries() + self.slow.stale_entries()
+
+    def subscribe(self, callback: Callable[[tuple[str, ...]], None]) -> None:
+        self.fast.subscribe(callback)
+        self.slow.subscribe(callback)
+
+    def restamp(
+        self, cache_files: argvType, input_files: argvType, keyed_files: argvType
+    ) -> bool:
+        return self._tier(cache_files).restamp(cache_files, input_files, keyed_files)
+
+    def fingerprints(self, input_files: argvType) -> tuple[str, ...] | None:
+        return self.slow.fingerprints(input_files)
+
+    def memoize(self, path: str, kind: str, compute: Callable[[], str]) -> str:
+        return self.slow.memoize(path, kind, compute)
+
+    def generate_hash(self, argv: argvType) -> str:
+        return self.slow.generate_hash(argv)
+
+    def _submit(self, key: tuple[str, ...], task: Callable[[], None]) -> None:
+        """
+        Queue a task for the background thread, unless one with the same
+        key is queued; () is the key of demoting the fast tier
+        """
+        with self._pending_lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+
+        def run() -> None:
+            with self._pending_lock:
+                self._pending.discard(key)
+            task()
+
+        self._queue.put(run)
+
+    def _work(self) -> None:
+        while (task := self._queue.get()) is not None:
+            try:
+                task()
+            except (OSError, CacheError):
+                # Moves are best effort, the entry stays where it was
+                pass
+            finally:
+                self._queue.task_done()
+        self._queue.task_done()
+
+    def _demote_over_budget(self) -> None:
+        self.fast.evict()
+
+    def _demote(self, cache_files: tuple[str, ...]) -> bool:
+        """
+        Copy an entry of the fast tier to the persistent tier, before it is
+        removed from the fast tier
+
+        Returns: False if the entry could not be copied and is kept
+        """
+        entry = self.fast.lookup(cache_files)
+        if entry is None or entry.stale or entry.inputs is None:
+            # Not worth keeping, or it can't be validated on disk
+            return True
+        inputs = tuple(p for p, _, _ in entry.inputs)
+        slow_files = self._move(cache_files, self.fast, self.slow)
+        try:
+            self._copy(
+                self.fast,
+                cache_files,
+                self.slow,
+                slow_files,
+                inputs,
+                entry.run_stats,
+                entry.argv,
+            )
+        except OSError:
+            return False
+        except CacheError:
+            # An input is gone, the entry can't be registered
+            return True
+        return True
+
+    def _fast_room(self) -> int:
+        """Bytes the fast tier has left"""
+        return self.max_bytes - self.fast.totals()[1]
+
+    def _promote(self, slow_files: tuple[str, ...], input_files: argvType) -> None:
+        fast_files = self._move(slow_files, self.slow, self.fast)
+        entry = self.slow.lookup(slow_files)
+        if entry is not None and sum(entry.sizes) > self._fast_room():
+            # Entries in use are not demoted to make room for it
+            return
+        self._copy(
+            self.slow,
+            slow_files,
+            self.fast,
+            fast_files,
+            input_files,
+            entry.run_stats if entry is not None else None,
+            entry.argv if entry is not None else None,
+        )
+        self._demote_over_budget()
+
+    @staticmethod
+    def _copy(
+        src: CacheHandler,
+        src_files: argvType,
+        dst: CacheHandler,
+        dst_files: tuple[str, ...],
+        input_files: argvType,
+        run_stats: RunStats | None,
+        argv: argvType | None,
+    ) -> None:
+        """Commit a copy of an entry to another tier, unless it is there"""
+        with dst.lock(dst_files):
+            if dst.is_cache_valid(dst_files, input_files):
+                return
+            temp_files = dst.generate_temp_paths(dst_files)
+            try:
+                for s, t in zip(src_files, temp_files):
+                    shutil.copyfile(s, t)
+                files = dst.commit(temp_files, dst_files, input_files, run_stats, argv)
+                if files != dst_files:
+                    # Not admitted by the other tier
+                    dst.discard(files)
+            except BaseException:
+                dst.discard(temp_files)
+                raise
+
+    def wait(self) -> None:
+        """Wait for the queued demotions and promotions"""
+        self._queue.join()
+
+    def close(self) -> None:
+        """Finish the queued moves and close the fast tier"""
+        self._queue.put(None)
+        self._worker.join()
+        self.fast.close()
@@ -1 +1,34 @@
+from dataclasses import dataclass
+from typing import Literal
+
 argvType = tuple[str, ...] | list[str]
+evictionPolicy = Literal["lru", "lfu", "size", "gds"]
+fingerprintPolicy = Literal["sample", "full"]
+
+
+@dataclass(frozen=True)
+class RunStats:
+    """Resource usage of a cdo run"""
+
+    wall_time: float = 0.0
+    # user + system CPU seconds of the child process
+    cpu_time: float = 0.0
+    # peak resident set size of the child process in bytes
+    max_rss: int = 0
+    # blocks read from and written to disk by the child process
+    read_blocks: int = 0
+    write_blocks: int = 0
+    major_faults: int = 0
+
+
+@dataclass(frozen=True)
+class LineageEntry:
+    """A cache entry in the lineage graph"""
+
+    outputs: tuple[str, ...]
+    # cdo command without the outputs, None if unknown, e.g. for entries
+    # recorded by register
+    argv: tuple[str, ...] | None
+    inputs: tuple[str, ...]
+    # Outputs of the entries that produced some of the inputs
+    parents: tuple[tuple[str, ...], ...]
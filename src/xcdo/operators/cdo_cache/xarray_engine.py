@@ -0,0 +1,318 @@
+import asyncio
+import time
+from collections.abc import Callable, Iterator
+from typing import TYPE_CHECKING, Any
+
+from .argv_parser import Command, Node, parse
+from .cdo_handler import CdoHandler
+from .datasets import default_chunks
+from .exceptions import CdoError
+from .interfaces import ICdoHandler
+from .types import RunStats, argvType
+
+if TYPE_CHECKING:
+    import xarray as xr
+
+# Options that do not change the result of the supported operators
+_NEUTRAL_OPTIONS = frozenset(("-O", "-s", "-Q"))
+
+_LAT_NAMES = ("lat", "latitude")
+_LON_NAMES = ("lon", "longitude")
+
+operatorFunc = Callable[["xr.Dataset", tuple[str, ...], int], "xr.Dataset"]
+
+# cdo operator name -> in-process implementation taking the input
+# dataset, the operator parameters and the number of time steps per block
+OPERATORS: dict[str, operatorFunc] = {}
+
+
+class Unsupported(Exception):
+    """The input can't be handled in-process, cdo has to run"""
+
+
+def _operator(*names: str) -> Callable[[operatorFunc], operatorFunc]:
+    def register(func: operatorFunc) -> operatorFunc:
+        for name in names:
+            OPERATORS[name] = func
+        return func
+
+    return register
+
+
+def _map(ds: "xr.Dataset", func: Callable[[Any], Any]) -> "xr.Dataset":
+    return ds.map(func, keep_attrs=True)
+
+
+def _constant(name: str, params: tuple[str, ...]) -> float:
+    if len(params) != 1:
+        raise CdoError(f"cdo operator '{name}' takes one constant")
+    try:
+        return float(params[0])
+    except ValueError:
+        raise CdoError(f"invalid constant for cdo operator '{name}': {params[0]}")
+
+
+@_operator("abs")
+def _abs(ds: "xr.Dataset", params: tuple[str, ...], block: int) -> "xr.Dataset":
+    return _map(ds, abs)
+
+
+@_operator("sqr")
+def _sqr(ds: "xr.Dataset", params: tuple[str, ...], block: int) -> "xr.Dataset":
+    return _map(ds, lambda da: da * da)
+
+
+@_operator("sqrt")
+def _sqrt(ds: "xr.Dataset", params: tuple[str, ...], block: int) -> "xr.Dataset":
+    return _map(ds, lambda da: da**0.5)
+
+
+@_operator("addc")
+def _addc(ds: "xr.Dataset", params: tuple[str, ...], block: int) -> "xr.Dataset":
+    c = _constant("addc", params)
+    return _map(ds, lambda da: da + c)
+
+
+@_operator("subc")
+def _subc(ds: "xr.Dataset", params: tuple[str, ...], block: int) -> "xr.Dataset":
+    c = _constant("subc", params)
+    return _map(ds, lambda da: da - c)
+
+
+@_operator("mulc")
+def _mulc(ds: "xr.Dataset", params: tuple[str, ...], block: int) -> "xr.Dataset":
+    c = _constant("mulc", params)
+    return _map(ds, lambda da: da * c)
+
+
+@_operator("divc")
+def _divc(ds: "xr.Dataset", params: tuple[str, ...], block: int) -> "xr.Dataset":
+    c = _constant("divc", params)
+    if c == 0:
+        raise CdoError("cdo operator 'divc': division by zero")
+    return _map(ds, lambda da: da / c)
+
+
+@_operator("selname")
+def _selname(ds: "xr.Dataset", params: tuple[str, ...], block: int) -> "xr.Dataset":
+    missing = [p for p in params if p not in ds.data_vars]
+    if not params or missing:
+        raise CdoError(f"cdo operator 'selname': variables not found: {missing}")
+    return ds[list(params)]
+
+
+def _time_blocks(ds: "xr.Dataset", block: int) -> Iterator["xr.Dataset"]:
+    for start in range(0, ds.sizes["time"], block):
+        yield ds.isel(time=slice(start, start + block))
+
+
+def _time_reduce(ds: "xr.Dataset", how: str, block: int) -> "xr.Dataset":
+    """
+    Reduce over time a block of time steps at a time, so only one block
+    and the running result are in memory
+    """
+    import numpy as np
+    import xarray as xr
+
+    if "time" not in ds.dims:
+        raise Unsupported("no time dimension")
+    data = ds[[v for v in ds.data_vars if "time" in ds[v].dims]]
+    result: xr.Dataset | None = None
+    count: xr.Dataset | None = None
+    for part in _time_blocks(data, block):
+        if how == "mean":
+            value, n = part.sum("time"), part.count("time")
+            if result is None or count is None:
+                result, count = value, n
+            else:
+                result, count = result + value, count + n
+        else:
+            value = getattr(part, how)("time")
+            if result is None:
+                result = value
+            else:
+                fold = np.fmin if how == "min" else np.fmax
+                result = xr.apply_ufunc(fold, result, value, dask="allowed")
+    assert result is not None
+    if how == "mean":
+        assert count is not None
+        result = result / count.where(count > 0)
+    # The middle time step, cdo's default target timestamp
+    times = ds["time"].values
+    result = result.expand_dims(time=times[[len(times) // 2]])
+    result["time"].attrs = ds["time"].attrs
+    return result.assign(
+        {name: da.assign_attrs(ds[name].attrs) for name, da in result.data_vars.items()}
+    )
+
+
+@_operator("timmean")
+def _timmean(ds: "xr.Dataset", params: tuple[str, ...], block: int) -> "xr.Dataset":
+    return _time_reduce(ds, "mean", block)
+
+
+@_operator("timmin")
+def _timmin(ds: "xr.Dataset", params: tuple[str, ...], block: int) -> "xr.Dataset":
+    return _time_reduce(ds, "min", block)
+
+
+@_operator("timmax")
+def _timmax(ds: "xr.Dataset", params: tuple[str, ...], block: int) -> "xr.Dataset":
+    return _time_reduce(ds, "max", block)
+
+
+def _find_dim(ds: "xr.Dataset", names: tuple[str, ...]) -> str:
+    for name in names:
+        if name in ds.dims and name in ds.coords and ds[name].ndim == 1:
+            return name
+    raise Unsupported(f"no regular {names[0]} dimension")
+
+
+def _lat_weights(ds: "xr.Dataset", lat: str) -> "xr.DataArray":
+    """Relative cell areas of a regular lon/lat grid"""
+    import numpy as np
+    import xarray as xr
+
+    bounds_name = ds[lat].attrs.get("bounds")
+    if bounds_name in ds.variables:
+        bounds = np.deg2rad(ds[bounds_name].values)
+    else:
+        # Cell edges halfway between the centres, as cdo generates them
+        centres = ds[lat].values
+        edges = np.concatenate(
+            [
+                [centres[0] - (centres[1] - centres[0]) / 2],
+                (centres[:-1] + centres[1:]) / 2,
+                [centres[-1] + (centres[-1] - centres[-2]) / 2],
+            ]
+            if len(centres) > 1
+            else [[-90.0], [90.0]]
+        )
+        edges = np.deg2rad(np.clip(edges, -90, 90))
+        bounds = np.stack([edges[:-1], edges[1:]], axis=-1)
+    weights = np.abs(np.sin(bounds[:, 1]) - np.sin(bounds[:, 0]))
+    return xr.DataArray(weights, dims=(lat,), coords={lat: ds[lat]})
+
+
+@_operator("fldmean")
+def _fldmean(ds: "xr.Dataset", params: tuple[str, ...], block: int) -> "xr.Dataset":
+    lat, lon = _find_dim(ds, _LAT_NAMES), _find_dim(ds, _LON_NAMES)
+    data = ds[[v for v in ds.data_vars if {lat, lon} <= set(ds[v].dims)]]
+    result = data.weighted(_lat_weights(ds, lat)).mean((lat, lon), keep_attrs=True)
+    # cdo writes field statistics on a single point grid at 0/0
+    return result.expand_dims({lat: [0.0], lon: [0.0]}).transpose(..., lat, lon)
+
+
+class XarrayEngine(ICdoHandler):
+    """
+    Runs cdo commands made only of cheap operators in-process with xarray,
+    and everything else with cdo
+
+    Avoiding a cdo process per command pays off for cheap elementwise and
+    reduction operators, see `OPERATORS`. Time reductions are computed a
+    block of `time_block` time steps at a time; with dask installed, the
+    inputs are also opened in chunks of that many time steps, bounding the
+    memory of the other operators.
+
+    The cdo version of the fallback is reported as the version, so the
+    results are stored under the same cache keys as cdo's.
+    """
+
+    def __init__(self, fallback: ICdoHandler | None = None, time_block: int = 64):
+        self.fallback = fallback if fallback is not None else CdoHandler()
+        self.time_block = time_block
+
+    def supports(self, argv: argvType) -> bool:
+        """
+        Whether argv, with its output files, may be run in-process
+        """
+        try:
+            command = parse(argv, with_outputs=True)
+        except CdoError:
+            return False
+        return self._supports(command)
+
+    def _supports(self, command: Command) -> bool:
+        if len(command.outputs) != 1 or not _NEUTRAL_OPTIONS >= set(command.options):
+            return False
+        return all(n.operator.name in OPERATORS for n in command.root.walk())
+
+    def run(self, argv: argvType) -> RunStats:
+        try:
+            command = parse(argv, with_outputs=True)
+        except CdoError:
+            return self.fallback.run(argv)
+        if not self._supports(command):
+            return self.fallback.run(argv)
+
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            result = self.evaluate(command.root)
+        except Unsupported:
+            return self.fallback.run(argv)
+        _write(result, command.outputs[0])
+        return RunStats(
+            wall_time=time.perf_counter() - start,
+            cpu_time=time.process_time() - cpu_start,
+        )
+
+    async def arun(self, argv: argvType) -> RunStats:
+        if self.supports(argv):
+            return await asyncio.to_thread(self.run, argv)
+        return await self.fallback.arun(argv)
+
+    def evaluate(
+        self,
+        node: Node,
+        open_dataset: Callable[[str], "xr.Dataset"] | None = None,
+    ) -> "xr.Dataset":
+        """
+        Evaluate an operator tree of supported operators
+
+        Raises:
+            Unsupported: if an input can't be handled in-process
+            CdoError: if an operator is not supported or its parameters
+                are invalid
+        """
+        open_dataset = open_dataset or self._open
+        func = OPERATORS.get(node.operator.name)
+        if func is None:
+            raise CdoError(f"cdo operator '{node.operator.name}' is not supported")
+        (child,) = node.children
+        if isinstance(child, Node):
+            ds = self.evaluate(child, open_dataset)
+        else:
+            ds = open_dataset(child)
+        return func(ds, node.params, self.time_block)
+
+    def _open(self, path: str) -> "xr.Dataset":
+        import xarray as xr
+
+        ds = xr.open_dataset(path, chunks=default_chunks(), decode_coords="all")
+        if ds.chunks and "time" in ds.dims:
+            ds = ds.chunk(time=self.time_block)
+        return ds
+
+    def get_input_files(self, argv: argvType) -> tuple[str, ...]:
+        return self.fallback.get_input_files(argv)
+
+    def get_n_outputs(self, argv: argvType) -> int:
+        return self.fallback.get_n_outputs(argv)
+
+    def captured_run(self, argv: argvType) -> tuple[str, str]:
+        return self.fallback.captured_run(argv)
+
+    def get_time_fingerprints(self, path: str) -> tuple[tuple[str, str], ...]:
+        return self.fallback.get_time_fingerprints(path)
+
+    def version(self) -> str:
+        return self.fallback.version()
+
+
+def _write(ds: "xr.Dataset", path: str) -> None:
+    for name in ds.data_vars:
+        # Packing and chunking of the inputs don't fit computed values
+        ds[name].encoding = {
+            k: v for k, v in ds[name].encoding.items() if k in ("_FillValue",)
+        }
+    ds.to_netcdf(path)
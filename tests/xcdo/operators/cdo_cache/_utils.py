@@ -1,6 +1,7 @@
 from pathlib import Path
 import random
 import string
+import sys
 
 
 def randomword(
@@ -24,3 +25,58 @@ def create_randomfile(tmp_path: Path) -> str:
     file_path = tmp_path / randomword()
     file_path.write_text(" ")
     return str(file_path)
+
+
+FAKE_CDO_VERSION = "2.4.0"
+
+_FAKE_CDO = """#!{python}
+import os
+import sys
+import time
+
+argv = sys.argv[1:]
+with open({log!r}, "a") as f:
+    f.write(" ".join(argv) + "\\n")
+if argv == ["-V"]:
+    print("Climate Data Operators version {version} (https://mpimet.mpg.de/cdo)")
+    sys.exit(0)
+if "-info" in argv:
+    # Fake inputs list their time steps as "<timestamp>[=<value>]"
+    steps = [s.partition("=") for s in open(argv[-1]).read().split()]
+    print("    -1 :       Date     Time   Level Gridsize    Miss :     Mean")
+    for i, (stamp, _, value) in enumerate(steps, 1):
+        date, _, hms = stamp.partition("T")
+        print(f"{{i:6d}} : {{date}} {{hms}}       0        1       0 : {{value or 0}}")
+    sys.exit(0)
+time.sleep(float(os.environ.get("FAKE_CDO_SLEEP", "0")))
+nout = int(os.environ.get("FAKE_CDO_NOUT", "1"))
+if nout == 0:
+    # Information operators print instead of writing files
+    print(" ".join(argv))
+    print("cdo: processed", file=sys.stderr)
+for out in argv[len(argv) - nout :] if nout else []:
+    with open(out, "w") as f:
+        f.write(" ".join(argv[: len(argv) - nout]))
+"""
+
+
+def fake_cdo(tmp_path: Path) -> tuple[str, Path]:
+    """
+    Write a fake cdo executable that logs every invocation
+
+    Returns:
+        - path of the executable
+        - path of the invocation log
+    """
+    log = tmp_path / "fake_cdo.log"
+    log.write_text("")
+    exe = tmp_path / "cdo"
+    exe.write_text(
+        _FAKE_CDO.format(python=sys.executable, log=str(log), version=FAKE_CDO_VERSION)
+    )
+    exe.chmod(0o755)
+    return str(exe), log
+
+
+def cdo_calls(log: Path) -> list[str]:
+    return log.read_text().splitlines()
@@ -0,0 +1,172 @@
+import pytest
+
+from xcdo.operators.cdo_cache.argv_parser import Node, parse
+from xcdo.operators.cdo_cache.exceptions import CdoError
+
+
+class TestParse:
+    def test_chain(self):
+        command = parse(["-fldmean", "-selname,tas", "in.nc"])
+
+        assert [n.operator.name for n in command.root.walk()] == [
+            "fldmean",
+            "selname",
+        ]
+        assert command.root.walk()[1].params == ("tas",)
+        assert command.input_files() == ("in.nc",)
+
+    def test_fixed_arity(self):
+        command = parse(["-sub", "-fldmean", "a.nc", "b.nc"])
+
+        first, second = command.root.children
+        assert isinstance(first, Node)
+        assert first.children == ("a.nc",)
+        assert second == "b.nc"
+
+    def test_variadic_takes_the_rest(self):
+        command = parse(["-fldmean", "-mergetime", "a.nc", "b.nc", "c.nc"])
+
+        merge = command.root.children[0]
+        assert isinstance(merge, Node)
+        assert merge.children == ("a.nc", "b.nc", "c.nc")
+
+    def test_brackets(self):
+        argv = ["-sub", "-ensmean", "[", "a.nc", "b.nc", "]", "c.nc"]
+
+        command = parse(argv)
+
+        ens, other = command.root.children
+        assert isinstance(ens, Node)
+        assert ens.children == ("a.nc", "b.nc")
+        assert other == "c.nc"
+
+    def test_options(self):
+        argv = ["-O", "-f", "nc4", "-z", "zip_1", "-fldmean", "in.nc"]
+
+        command = parse(argv)
+
+        assert command.options == ("-O", "-f", "nc4", "-z", "zip_1")
+        assert command.root.operator.name == "fldmean"
+
+    def test_outputs(self):
+        command = parse(["-add", "a.nc", "b.nc", "out.nc"], with_outputs=True)
+
+        assert command.outputs == ("out.nc",)
+        assert command.input_files() == ("a.nc", "b.nc")
+
+    def test_output_prefix(self):
+        command = parse(["-splityear", "in.nc", "out_"], with_outputs=True)
+
+        assert command.outputs == ("out_",)
+
+    @pytest.mark.parametrize(
+        "argv",
+        [
+            ["-mergetime", "a.nc", "b.nc"],
+            ["-sub", "-ensmean", "[", "a.nc", "b.nc", "]", "c.nc"],
+            ["-O", "-P", "4", "-remapbil,grid.txt", "in.nc"],
+        ],
+    )
+    def test_round_trip(self, argv: list[str]):
+        command = parse(argv)
+
+        assert command.to_argv() == argv
+        assert parse(command.to_argv()) == command
+
+    @pytest.mark.parametrize(
+        "argv, expected",
+        [
+            (
+                ["-merge", "a.nc", "-fldmean", "b.nc"],
+                ["-merge", "[", "a.nc", "-fldmean", "b.nc", "]"],
+            ),
+            (
+                ["-fldmean", "-ensmean", "a.nc", "b.nc"],
+                ["-fldmean", "-ensmean", "[", "a.nc", "b.nc", "]"],
+            ),
+        ],
+    )
+    def test_brackets_added_for_variadic_chains(
+        self, argv: list[str], expected: list[str]
+    ):
+        command = parse(argv)
+
+        assert command.to_argv() == expected
+        assert parse(expected) == command
+
+    @pytest.mark.parametrize(
+        "argv",
+        [
+            [],
+            ["-O"],
+            ["-f"],
+            ["-nosuchoperator", "in.nc"],
+            ["-add", "a.nc"],
+            ["-fldmean", "a.nc", "b.nc"],
+            ["-fldmean", "]"],
+        ],
+    )
+    def test_invalid(self, argv: list[str]):
+        with pytest.raises(CdoError):
+            parse(argv)
+
+    @pytest.mark.parametrize(
+        "argv",
+        [
+            ["-nosuchop,a,b", "in.nc"],
+            ["-O", "-nosuchop", "in.nc"],
+            ["-fldmean", "-nosuchop", "in.nc"],
+        ],
+    )
+    def test_unknown_operator_named(self, argv: list[str]):
+        with pytest.raises(CdoError, match="'nosuchop'"):
+            parse(argv)
+
+    @pytest.mark.parametrize(
+        "argv",
+        [
+            ["-setgatt,title,x", "in.nc"],
+            ["-setgatts,./atts.txt", "in.nc"],
+            ["-apply,-daymean", "a.nc", "b.nc"],
+        ],
+    )
+    def test_attribute_and_apply_operators(self, argv: list[str]):
+        assert parse(argv).to_argv() == argv
+
+    def test_missing_outputs(self):
+        with pytest.raises(CdoError):
+            parse(["-info"], with_outputs=True)
+
+
+class TestInputFiles:
+    def test_param_files(self):
+        command = parse(["-remapbil,/grids/r360x180.txt", "-setgrid,./g.nc", "in.nc"])
+
+        assert command.input_files() == ("./g.nc", "/grids/r360x180.txt", "in.nc")
+
+    def test_kwarg_files(self):
+        command = parse(["-setgridarea,area=grid.nc", "in.nc"])
+
+        assert command.input_files() == ("grid.nc", "in.nc")
+
+    def test_plain_params_are_not_files(self):
+        command = parse(["-sellonlatbox,0,10,-5,5", "-selname,tas,pr", "in.nc"])
+
+        assert command.input_files() == ("in.nc",)
+
+
+class TestNOutputs:
+    @pytest.mark.parametrize(
+        "argv, expected",
+        [
+            (["-fldmean", "in.nc"], 1),
+            (["-sinfo", "in.nc"], 0),
+            (["-add", "-fldmean", "a.nc", "b.nc"], 1),
+        ],
+    )
+    def test_from_outermost_operator(self, argv: list[str], expected: int):
+        assert parse(argv).n_outputs == expected
+
+    def test_output_prefix_is_unknown(self):
+        with pytest.raises(CdoError):
+            _ = parse(["-splitsel,1", "in.nc"]).n_outputs
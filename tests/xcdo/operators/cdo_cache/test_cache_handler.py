@@ -1,18 +1,22 @@
 from pathlib import Path
 import pytest
+from pytest_mock import MockerFixture
 import typing as t
 import os
+import time
 
 from xcdo.operators.cdo_cache.exceptions import CacheError
 from xcdo.operators.cdo_cache.interfaces import ICacheHandler
+from xcdo.operators.cdo_cache.types import RunStats
+from xcdo.operators.cdo_cache import cache_handler as cache_handler_module
 from xcdo.operators.cdo_cache.cache_handler import CacheHandler
 
 from ._utils import randomcmd, randomfile, randomword, create_randomfile
 
 
 @pytest.fixture
-def cache_handler():
-    return CacheHandler()
+def cache_handler(tmp_path: Path):
+    return CacheHandler(str(tmp_path / "cache"))
 
 
 def file_with_mtime(tmp_path: Path, epoch_time: int):
@@ -26,6 +30,35 @@ def test_correct_instance(cache_handler: ICacheHandler):
     assert isinstance(cache_handler, ICacheHandler)
 
 
+class TestStatMany:
+    def test_missing_is_none(self, tmp_path: Path):
+        present = create_randomfile(tmp_path)
+        stats = cache_handler_module.stat_many((present, str(tmp_path / "missing")))
+
+        assert stats[0] is not None and stats[1] is None
+
+    def test_executor_shared(self, tmp_path: Path, mocker: MockerFixture):
+        paths = [create_randomfile(tmp_path) for _ in range(4)]
+        executor = mocker.spy(cache_handler_module, "ThreadPoolExecutor")
+
+        cache_handler_module.stat_many(paths, threshold=2)
+        cache_handler_module.stat_many(paths, threshold=2)
+
+        assert executor.call_count <= 1
+
+    def test_threshold_from_env(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch, mocker: MockerFixture
+    ):
+        monkeypatch.setenv(cache_handler_module.PARALLEL_STAT_ENV, "2")
+        executor = mocker.patch.object(cache_handler_module, "_stat_executor")
+        paths = [create_randomfile(tmp_path) for _ in range(2)]
+
+        cache_handler_module.stat_many(paths[:1])
+        assert not executor.called
+        cache_handler_module.stat_many(paths)
+        assert executor.called
+
+
 class TestGenerateHash:
     def test_invalid_inputs(self, cache_handler: t.Any):
         with pytest.raises(CacheError) as e:
@@ -99,3 +132,645 @@ class TestCacheExists:
         with pytest.raises(CacheError) as e:
             cache_handler.cache_exists(())
         assert str(e.value) == "no cache files provided"
+
+
+class TestIndex:
+    @pytest.fixture
+    def indexed(self, tmp_path: Path):
+        return CacheHandler(str(tmp_path / "cache"))
+
+    def write_entry(self, handler: CacheHandler, n: int = 2) -> tuple[str, ...]:
+        cache_files = handler.generate_cache_paths(n, handler.generate_hash(["-x"]))
+        handler.ensure_directories_exist(cache_files)
+        for f in cache_files:
+            Path(f).write_text("data")
+        return cache_files
+
+    def test_registered_entry_is_valid(self, indexed: CacheHandler, tmp_path: Path):
+        input_files = [file_with_mtime(tmp_path, 10) for _ in range(3)]
+        cache_files = self.write_entry(indexed)
+        indexed.register(cache_files, input_files)
+
+        assert indexed.is_cache_valid(cache_files, input_files) is True
+
+    def test_register_missing_files(self, indexed: CacheHandler, tmp_path: Path):
+        with pytest.raises(CacheError):
+            indexed.register(("missing",), ())
+
+    def test_input_changed(self, indexed: CacheHandler, tmp_path: Path):
+        input_files = [file_with_mtime(tmp_path, 10) for _ in range(3)]
+        cache_files = self.write_entry(indexed)
+        indexed.register(cache_files, input_files)
+        # An older mtime is still a change, e.g. after a restore
+        os.utime(input_files[1], (5, 5))
+
+        assert indexed.is_cache_valid(cache_files, input_files) is False
+
+    def test_output_truncated(self, indexed: CacheHandler, tmp_path: Path):
+        cache_files = self.write_entry(indexed)
+        indexed.register(cache_files, ())
+        Path(cache_files[0]).write_text("")
+
+        assert indexed.is_cache_valid(cache_files, ()) is False
+
+    def test_output_removed(self, indexed: CacheHandler, tmp_path: Path):
+        cache_files = self.write_entry(indexed)
+        indexed.register(cache_files, ())
+        os.remove(cache_files[1])
+
+        assert indexed.is_cache_valid(cache_files, ()) is False
+
+    def test_restamp(self, indexed: CacheHandler, tmp_path: Path):
+        input_files = [file_with_mtime(tmp_path, 10) for _ in range(2)]
+        keyed = input_files[:1]
+        cache_files = self.write_entry(indexed)
+        indexed.register(cache_files, input_files)
+        os.utime(input_files[0], (20, 20))
+
+        assert indexed.restamp(cache_files, input_files, keyed) is True
+        assert indexed.is_cache_valid(cache_files, input_files) is True
+        assert indexed.restamp(cache_files, (), ()) is False
+
+        os.utime(input_files[1], (20, 20))
+        assert indexed.restamp(cache_files, input_files, keyed) is False
+        assert indexed.is_cache_valid(cache_files, input_files) is False
+        assert indexed.restamp(cache_files, input_files, input_files) is False
+
+    def test_memoize(self, indexed: CacheHandler, tmp_path: Path):
+        path = file_with_mtime(tmp_path, 10)
+        compute = iter(("a", "b", "c")).__next__
+
+        assert indexed.memoize(path, "steps", compute) == "a"
+        # Kept in the index, for other processes too
+        assert CacheHandler(indexed.root).memoize(path, "steps", compute) == "a"
+        assert indexed.memoize(path, "other", compute) == "b"
+        os.utime(path, (20, 20))
+        assert indexed.memoize(path, "steps", compute) == "c"
+
+    def test_single_stat_per_file(
+        self,
+        indexed: CacheHandler,
+        tmp_path: Path,
+        mocker: MockerFixture,
+    ):
+        input_files = [file_with_mtime(tmp_path, 10) for _ in range(50)]
+        cache_files = self.write_entry(indexed)
+        indexed.register(cache_files, input_files)
+        stat = mocker.spy(cache_handler_module, "_stat")
+
+        assert indexed.is_cache_valid(cache_files, input_files) is True
+        assert sorted(c.args[0] for c in stat.call_args_list) == sorted(
+            (*cache_files, *input_files)
+        )
+
+    def test_rebuild_from_scan(self, tmp_path: Path):
+        root = str(tmp_path / "cache")
+        cache_files = self.write_entry(CacheHandler(root, use_index=False))
+        shard = Path(cache_files[0]).parent
+        (shard / f"{'a' * 64}_1").write_text("orphan")
+        (shard / f".tmp.host.1.abcd.{'b' * 64}_0").write_text("partial")
+        input_files = [file_with_mtime(tmp_path, 10)]
+
+        handler = CacheHandler(root)
+
+        assert handler.rebuild_index() == 1
+        assert handler.is_cache_valid(cache_files, input_files) is True
+        os.utime(input_files[0], (5, 5))
+        assert handler.is_cache_valid(cache_files, input_files) is False
+
+    def test_corrupt_index(self, tmp_path: Path):
+        root = tmp_path / "cache"
+        cache_files = self.write_entry(CacheHandler(str(root), use_index=False))
+        (root / "index.sqlite").write_text("not a database")
+
+        handler = CacheHandler(str(root))
+
+        assert handler.is_cache_valid(cache_files, ()) is True
+        assert (root / "index.sqlite.corrupt").exists()
+
+
+class TestLayout:
+    hash_code = "0123456789abcdef" * 4
+
+    def test_sharded_paths(self, tmp_path: Path):
+        handler = CacheHandler(str(tmp_path), use_index=False)
+
+        result = handler.generate_cache_paths(2, self.hash_code)
+
+        shard = tmp_path / "01" / "23"
+        assert result == (
+            str(shard / f"{self.hash_code}_0"),
+            str(shard / f"{self.hash_code}_1"),
+        )
+        assert not shard.exists(), "directories are created lazily"
+
+    def test_suffixes(self, cache_handler: ICacheHandler):
+        result = cache_handler.generate_cache_paths(2, self.hash_code, (".nc", ".grb2"))
+        assert result[0].endswith("_0.nc")
+        assert result[1].endswith("_1.grb2")
+
+        with pytest.raises(CacheError):
+            cache_handler.generate_cache_paths(2, self.hash_code, (".nc",))
+
+    def test_root_from_env(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setenv("XCDO_CACHE_DIR", str(tmp_path / "env"))
+
+        handler = CacheHandler()
+
+        assert handler.root == str(tmp_path / "env")
+        assert (tmp_path / "env" / "index.sqlite").exists()
+
+    def test_lock_creates_directories(self, cache_handler: ICacheHandler):
+        cache_files = cache_handler.generate_cache_paths(1, self.hash_code)
+
+        with cache_handler.lock(cache_files):
+            assert os.path.isdir(os.path.dirname(cache_files[0]))
+            temp_files = cache_handler.generate_temp_paths(cache_files)
+            assert os.path.dirname(temp_files[0]) == os.path.dirname(cache_files[0])
+
+
+def add_entry(
+    handler: CacheHandler,
+    name: str,
+    size: int = 10,
+    run_stats: RunStats | None = None,
+) -> tuple[str, ...]:
+    cache_files = handler.generate_cache_paths(1, handler.generate_hash([name]))
+    with handler.lock(cache_files):
+        temp_files = handler.generate_temp_paths(cache_files)
+        Path(temp_files[0]).write_text("x" * size)
+        handler.commit(temp_files, cache_files, (), run_stats)
+    return cache_files
+
+
+class TestEviction:
+    def handler(self, tmp_path: Path, **kwargs: t.Any) -> CacheHandler:
+        return CacheHandler(str(tmp_path / "cache"), evict_grace=0, **kwargs)
+
+    def test_budget_needs_index(self, tmp_path: Path):
+        with pytest.raises(CacheError):
+            CacheHandler(str(tmp_path), use_index=False, max_bytes=10)
+
+    def test_lru(self, tmp_path: Path):
+        handler = self.handler(tmp_path, max_entries=2)
+        a = add_entry(handler, "a")
+        b = add_entry(handler, "b")
+        assert handler.is_cache_valid(a, ())
+
+        c = add_entry(handler, "c")
+
+        assert handler.cache_exists(a)
+        assert not handler.cache_exists(b)
+        assert handler.cache_exists(c)
+
+    def test_lfu(self, tmp_path: Path):
+        handler = self.handler(tmp_path, max_entries=2, policy="lfu")
+        a = add_entry(handler, "a")
+        b = add_entry(handler, "b")
+        for _ in range(3):
+            handler.is_cache_valid(a, ())
+        handler.is_cache_valid(b, ())
+
+        add_entry(handler, "c")
+
+        assert handler.cache_exists(a)
+        assert not handler.cache_exists(b)
+
+    def test_size(self, tmp_path: Path):
+        handler = self.handler(tmp_path, max_bytes=250, policy="size")
+        small = add_entry(handler, "small", 50)
+        large = add_entry(handler, "large", 150)
+
+        new = add_entry(handler, "new", 100)
+
+        assert handler.cache_exists(small)
+        assert not handler.cache_exists(large)
+        assert handler.cache_exists(new)
+
+    def test_subscribers_notified(self, tmp_path: Path):
+        handler = self.handler(tmp_path, max_entries=1)
+        notified: list[tuple[str, ...]] = []
+        handler.subscribe(notified.append)
+        a = add_entry(handler, "a")
+        add_entry(handler, "a")
+
+        b = add_entry(handler, "b")
+
+        # Written, rewritten, then b written and a evicted
+        assert notified == [a, a, b, a]
+
+    def test_new_entry_kept(self, tmp_path: Path):
+        handler = self.handler(tmp_path, max_bytes=50)
+        old = add_entry(handler, "old", 10)
+
+        new = add_entry(handler, "new", 100)
+
+        assert not handler.cache_exists(old)
+        assert handler.cache_exists(new)
+
+    def test_grace(self, tmp_path: Path):
+        handler = CacheHandler(str(tmp_path / "cache"), max_entries=1)
+        a = add_entry(handler, "a")
+        b = add_entry(handler, "b")
+
+        assert handler.cache_exists(a) and handler.cache_exists(b)
+        assert handler.stats().reclaimable_bytes == 0
+
+    def test_hit_seen_by_other_processes_within_grace(self, tmp_path: Path):
+        handler = CacheHandler(str(tmp_path / "cache"), evict_grace=0.2)
+        a = add_entry(handler, "a")
+        other = CacheHandler(str(tmp_path / "cache"), evict_grace=0.2)
+        recorded = other.lookup(a)
+        assert recorded is not None
+
+        handler.is_cache_valid(a, ())  # buffered
+        time.sleep(0.15)
+        handler.is_cache_valid(a, ())  # written, grace period half over
+
+        entry = other.lookup(a)
+        assert entry is not None and entry.last_access > recorded.last_access
+
+    def test_locked_entry_skipped(self, tmp_path: Path):
+        handler = self.handler(tmp_path)
+        a = add_entry(handler, "a")
+        b = add_entry(handler, "b")
+        handler.max_entries = 1
+
+        with handler.lock(a):
+            assert handler.evict() == (1, 10)
+
+        assert handler.cache_exists(a)
+        assert not handler.cache_exists(b)
+
+    def test_stats_and_gc(self, tmp_path: Path):
+        handler = self.handler(tmp_path)
+        for name in "abc":
+            add_entry(handler, name, 100)
+        orphan = Path(handler.generate_temp_paths(add_entry(handler, "d", 100))[0])
+        orphan.write_text("x" * 30)
+        os.utime(orphan, (0, 0))
+        handler.max_bytes = 250
+
+        stats = handler.stats()
+
+        assert (stats.entries, stats.bytes) == (4, 400)
+        assert stats.reclaimable_bytes == 200
+        assert stats.orphaned_bytes == 30
+        assert handler.gc() == (2, 230)
+        assert not orphan.exists()
+        assert handler.stats().bytes == 200
+
+
+class TestCostAware:
+    def handler(self, tmp_path: Path, **kwargs: t.Any) -> CacheHandler:
+        return CacheHandler(str(tmp_path / "cache"), evict_grace=0, **kwargs)
+
+    def test_gds_keeps_expensive_bytes(self, tmp_path: Path):
+        handler = self.handler(tmp_path, max_bytes=200, policy="gds")
+        # 10 s per 100 bytes is worth more than 1 s per 50 bytes
+        expensive = add_entry(handler, "expensive", 100, RunStats(wall_time=10))
+        cheap = add_entry(handler, "cheap", 50, RunStats(wall_time=1))
+
+        new = add_entry(handler, "new", 100, RunStats(wall_time=5))
+
+        assert handler.cache_exists(expensive)
+        assert not handler.cache_exists(cheap)
+        assert handler.cache_exists(new)
+
+    def test_gds_ages_entries(self, tmp_path: Path):
+        handler = self.handler(tmp_path, max_entries=1, policy="gds")
+        add_entry(handler, "a", 100, RunStats(wall_time=2))
+        b = add_entry(handler, "b", 100, RunStats(wall_time=1))
+        assert handler.cache_exists(b), "evicted the new entry"
+
+        # The inflation value lets a new, cheaper entry replace an old one
+        c = add_entry(handler, "c", 100, RunStats(wall_time=0.5))
+
+        assert not handler.cache_exists(b)
+        assert handler.cache_exists(c)
+
+    def test_cheap_entries_not_admitted(self, tmp_path: Path):
+        handler = self.handler(tmp_path, admit_min_cost=1.0)
+        cache_files = handler.generate_cache_paths(1, handler.generate_hash(["c"]))
+        temp_files = handler.generate_temp_paths(cache_files)
+        Path(temp_files[0]).write_text("x")
+
+        files = handler.commit(temp_files, cache_files, (), RunStats(wall_time=0.1))
+
+        assert Path(files[0]).read_text() == "x"
+        assert not handler.cache_exists(cache_files)
+        assert not Path(temp_files[0]).exists()
+        # The next run replaces them
+        temp_files = handler.generate_temp_paths(cache_files)
+        Path(temp_files[0]).write_text("y")
+        assert handler.commit(temp_files, cache_files, ()) != files
+        Path(temp_files[0]).write_text("y")
+        assert (
+            handler.commit(temp_files, cache_files, (), RunStats(wall_time=0.1))
+            == files
+        )
+        assert Path(files[0]).read_text() == "y"
+
+    def test_always_admit(self, tmp_path: Path):
+        handler = self.handler(tmp_path, admit_min_cost=1.0)
+        cache_files = handler.generate_cache_paths(1, handler.generate_hash(["c"]))
+        temp_files = handler.generate_temp_paths(cache_files)
+        Path(temp_files[0]).write_text("x")
+
+        files = handler.commit(
+            temp_files, cache_files, (), RunStats(wall_time=0.1), always_admit=True
+        )
+
+        assert files == cache_files
+        assert handler.is_cache_valid(cache_files, ())
+
+    def test_gc_removes_unadmitted_outputs(self, tmp_path: Path):
+        handler = self.handler(tmp_path, admit_min_cost=1.0)
+        cache_files = handler.generate_cache_paths(1, handler.generate_hash(["c"]))
+        temp_files = handler.generate_temp_paths(cache_files)
+        Path(temp_files[0]).write_text("x")
+        (uncached,) = handler.commit(
+            temp_files, cache_files, (), RunStats(wall_time=0.1)
+        )
+
+        assert handler.gc() == (0, 1)
+        assert not Path(uncached).exists()
+        assert handler.stats().entries == 0
+
+    def test_costly_entries_admitted(self, tmp_path: Path):
+        handler = self.handler(tmp_path, admit_min_cost=1.0)
+        costly = add_entry(handler, "costly", run_stats=RunStats(wall_time=2.0))
+
+        assert handler.is_cache_valid(costly, ())
+        assert handler.evict() == (0, 0)
+
+
+class TestLineage:
+    @pytest.fixture
+    def handler(self, tmp_path: Path):
+        return CacheHandler(str(tmp_path / "cache"))
+
+    def chain(
+        self, handler: CacheHandler, source: str
+    ) -> tuple[tuple[str, ...], tuple[str, ...]]:
+        parent = handler.generate_cache_paths(1, handler.generate_hash(["-parent"]))
+        child = handler.generate_cache_paths(1, handler.generate_hash(["-child"]))
+        for cache_files, inputs, argv in (
+            (parent, (source,), ("-parent", source)),
+            (child, parent, ("-child", *parent)),
+        ):
+            temp_files = handler.generate_temp_paths(cache_files)
+            Path(temp_files[0]).write_text("x")
+            handler.commit(temp_files, cache_files, inputs, argv=argv)
+        return parent, child
+
+    def test_rewrite_marks_descendants_stale(
+        self, handler: CacheHandler, tmp_path: Path
+    ):
+        source = create_randomfile(tmp_path)
+        parent, child = self.chain(handler, source)
+        assert handler.is_cache_valid(child, parent)
+
+        temp_files = handler.generate_temp_paths(parent)
+        Path(temp_files[0]).write_text("y")
+        handler.commit(temp_files, parent, (source,))
+
+        assert handler.is_cache_valid(parent, (source,))
+        assert not handler.is_cache_valid(child, parent)
+        assert [e.outputs for e in handler.stale_entries()] == [child]
+
+    def test_changed_source_propagates(self, handler: CacheHandler, tmp_path: Path):
+        source = create_randomfile(tmp_path)
+        parent, child = self.chain(handler, source)
+        Path(source).write_text("changed")
+
+        stale = {e.outputs: e for e in handler.stale_entries()}
+
+        assert set(stale) == {parent, child}
+        assert stale[child].parents == (parent,)
+        assert stale[child].argv == ("-child", *parent)
+        assert stale[parent].inputs == (source,)
+
+    def test_invalidate(self, handler: CacheHandler, tmp_path: Path):
+        source = create_randomfile(tmp_path)
+        _, child = self.chain(handler, source)
+
+        assert handler.invalidate((source,)) == 2
+        assert handler.invalidate((source,)) == 0
+        assert not handler.is_cache_valid(child, ())
+
+    def test_parents_not_statted(
+        self, handler: CacheHandler, tmp_path: Path, mocker: MockerFixture
+    ):
+        source = create_randomfile(tmp_path)
+        parent, child = self.chain(handler, source)
+        stat = mocker.spy(cache_handler_module, "_stat")
+
+        assert handler.is_cache_valid(child, parent)
+        assert [c.args[0] for c in stat.call_args_list] == list(child)
+
+    def evicted_parent(
+        self, tmp_path: Path
+    ) -> tuple[CacheHandler, str, tuple[str, ...], tuple[str, ...]]:
+        handler = CacheHandler(str(tmp_path / "cache"), evict_grace=0)
+        source = create_randomfile(tmp_path)
+        parent, child = self.chain(handler, source)
+        handler.max_entries = 1
+        handler.evict(keep=child)
+        handler.max_entries = None
+        assert not handler.cache_exists(parent)
+        return handler, source, parent, child
+
+    def recommit(self, handler: CacheHandler, parent: tuple[str, ...], source: str):
+        temp_files = handler.generate_temp_paths(parent)
+        Path(temp_files[0]).write_text("x")
+        handler.commit(temp_files, parent, (source,))
+
+    def test_evicted_parent_keeps_children_valid(self, tmp_path: Path):
+        handler, _, parent, child = self.evicted_parent(tmp_path)
+
+        assert handler.is_cache_valid(child, parent)
+        assert handler.stale_entries() == []
+
+    def test_evicted_parent_source_change_reaches_children(self, tmp_path: Path):
+        handler, source, parent, child = self.evicted_parent(tmp_path)
+        Path(source).write_text("changed")
+
+        (stale,) = handler.stale_entries()
+
+        assert stale.outputs == child
+        # Its input is gone, the next lookup recomputes it
+        assert stale.argv is None
+        assert not handler.is_cache_valid(child, parent)
+
+    def test_recomputed_parent_keeps_children_valid(self, tmp_path: Path):
+        handler, source, parent, child = self.evicted_parent(tmp_path)
+
+        self.recommit(handler, parent, source)
+
+        assert handler.is_cache_valid(child, parent)
+
+    def test_recomputed_parent_from_changed_source(self, tmp_path: Path):
+        handler, source, parent, child = self.evicted_parent(tmp_path)
+        Path(source).write_text("changed")
+
+        self.recommit(handler, parent, source)
+
+        assert not handler.is_cache_valid(child, parent)
+
+    def test_gc_drops_unused_evicted_lineage(self, tmp_path: Path):
+        handler, _, parent, child = self.evicted_parent(tmp_path)
+        assert handler._index is not None
+        assert handler._index.evicted_inputs(parent) is not None
+        handler.max_entries = 0
+
+        handler.gc()
+
+        assert not handler.cache_exists(child)
+        assert handler._index.evicted_inputs(parent) is None
+
+
+class TestFingerprint:
+    @pytest.fixture
+    def handler(self, tmp_path: Path):
+        return CacheHandler(str(tmp_path / "cache"), fingerprint="full")
+
+    def entry(self, handler: CacheHandler, input_files: list[str]) -> tuple[str, ...]:
+        cache_files = handler.generate_cache_paths(1, handler.generate_hash(["-x"]))
+        temp_files = handler.generate_temp_paths(cache_files)
+        Path(temp_files[0]).write_text("x")
+        handler.commit(temp_files, cache_files, input_files)
+        return cache_files
+
+    def test_needs_index(self, tmp_path: Path):
+        with pytest.raises(CacheError):
+            CacheHandler(str(tmp_path), use_index=False, fingerprint="sample")
+
+    def test_off_by_default(self, cache_handler: CacheHandler):
+        assert cache_handler.fingerprints(()) is None
+
+    def test_new_mtime_same_content_is_valid(
+        self, handler: CacheHandler, tmp_path: Path
+    ):
+        source = file_with_mtime(tmp_path, 10)
+        cache_files = self.entry(handler, [source])
+        os.utime(source, (20, 20))
+
+        assert handler.is_cache_valid(cache_files, (source,))
+        assert handler.stale_entries() == []
+
+    def test_changed_content_is_invalid(self, handler: CacheHandler, tmp_path: Path):
+        source = file_with_mtime(tmp_path, 10)
+        cache_files = self.entry(handler, [source])
+        Path(source).write_text("changed")
+        os.utime(source, (10, 10))
+
+        assert not handler.is_cache_valid(cache_files, (source,))
+
+    def test_copy_elsewhere_is_valid(self, handler: CacheHandler, tmp_path: Path):
+        source = file_with_mtime(tmp_path, 10)
+        cache_files = self.entry(handler, [source])
+        copy = tmp_path / "copy"
+        copy.write_bytes(Path(source).read_bytes())
+
+        assert handler.fingerprints((source,)) == handler.fingerprints((str(copy),))
+        assert handler.is_cache_valid(cache_files, (str(copy),))
+
+    def test_memoized(
+        self, handler: CacheHandler, tmp_path: Path, mocker: MockerFixture
+    ):
+        source = file_with_mtime(tmp_path, 10)
+        cache_files = self.entry(handler, [source])
+        spy = mocker.spy(cache_handler_module, "file_fingerprint")
+
+        for _ in range(3):
+            assert handler.is_cache_valid(cache_files, (source,))
+        assert spy.call_count == 0
+        # Persisted in the index
+        reopened = CacheHandler(handler.root, fingerprint="full")
+        reopened.fingerprints((source,))
+        assert spy.call_count == 0
+
+
+def test_hash_splits_do_not_collide(cache_handler: ICacheHandler):
+    assert cache_handler.generate_hash(["-a b", "c"]) != cache_handler.generate_hash(
+        ["-a", "b c"]
+    )
+
+
+class TestDedup:
+    def handler(self, tmp_path: Path, **kwargs: t.Any) -> CacheHandler:
+        return CacheHandler(
+            str(tmp_path / "cache"), dedup=True, evict_grace=0, **kwargs
+        )
+
+    def entry(self, handler: CacheHandler, name: str, content: str) -> tuple[str, ...]:
+        cache_files = handler.generate_cache_paths(1, handler.generate_hash([name]))
+        temp_files = handler.generate_temp_paths(cache_files)
+        Path(temp_files[0]).write_text(content)
+        handler.commit(temp_files, cache_files, ())
+        return cache_files
+
+    @staticmethod
+    def blobs(handler: CacheHandler) -> list[Path]:
+        return sorted(Path(handler.blob_root).glob("*/*"))
+
+    def test_needs_index(self, tmp_path: Path):
+        with pytest.raises(CacheError):
+            CacheHandler(str(tmp_path), use_index=False, dedup=True)
+
+    def test_identical_outputs_stored_once(self, tmp_path: Path):
+        handler = self.handler(tmp_path)
+
+        (a,) = self.entry(handler, "-a", "x" * 100)
+        (b,) = self.entry(handler, "-b", "x" * 100)
+        (c,) = self.entry(handler, "-c", "y" * 100)
+
+        assert os.path.samefile(a, b) and not os.path.samefile(a, c)
+        assert len(self.blobs(handler)) == 2
+        assert os.stat(a).st_nlink == 3
+        assert handler.stats().entries == 3
+        assert handler.stats().bytes == 200
+        assert handler.is_cache_valid((a,), ()) and handler.is_cache_valid((b,), ())
+
+    def test_blob_dropped_with_last_link(self, tmp_path: Path):
+        handler = self.handler(tmp_path)
+        a = self.entry(handler, "-a", "x" * 100)
+        b = self.entry(handler, "-b", "x" * 100)
+
+        handler._remove_entry(a)
+        assert len(self.blobs(handler)) == 1
+        assert handler.is_cache_valid(b, ())
+        handler._remove_entry(b)
+        assert self.blobs(handler) == []
+
+    def test_rewritten_entry_drops_old_blob(self, tmp_path: Path):
+        handler = self.handler(tmp_path)
+        self.entry(handler, "-a", "old")
+
+        (a,) = self.entry(handler, "-a", "new")
+
+        assert [b.read_text() for b in self.blobs(handler)] == ["new"]
+        assert Path(a).read_text() == "new"
+
+    def test_eviction_counts_shared_blobs_once(self, tmp_path: Path):
+        handler = self.handler(tmp_path)
+        shared = self.entry(handler, "-a", "x" * 100)
+        time.sleep(0.01)
+        self.entry(handler, "-b", "x" * 100)
+        self.entry(handler, "-c", "y" * 100)
+        handler.max_bytes = 150
+
+        # Evicting -a frees nothing, its blob is kept by -b
+        assert handler.evict() == (2, 100)
+        assert not os.path.exists(shared[0])
+        assert handler.stats().bytes == 100
+
+    def test_gc_removes_unlinked_blobs(self, tmp_path: Path):
+        handler = self.handler(tmp_path, lock_stale_after=0)
+        (a,) = self.entry(handler, "-a", "x" * 100)
+        handler.rebuild_index()
+
+        assert handler.gc() == (0, 0)
+        assert self.blobs(handler) == []
+        assert Path(a).read_text() == "x" * 100
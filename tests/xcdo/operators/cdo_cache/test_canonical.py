@@ -0,0 +1,195 @@
+import os
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from xcdo.operators.cdo_cache.canonical import (
+    canonical_number,
+    canonical_path,
+    canonicalize,
+)
+
+# Spellings of the same commands as they turn up in scripts and notebooks;
+# each group gives the same outputs
+CORPUS = [
+    [
+        ["-fldmean", "in.nc"],
+        ["-fldmean", "./in.nc"],
+        ["-fldmean", "{tmp}/in.nc"],
+        ["-fldmean", "sub/../in.nc"],
+        ["-fldmean", "link.nc"],
+        ["-s", "-fldmean", "in.nc"],
+        ["-O", "-s", "-fldmean", "in.nc"],
+    ],
+    [
+        ["-f", "nc4", "-O", "-timmean", "in.nc"],
+        ["-O", "-f", "nc4", "-timmean", "in.nc"],
+        ["-P", "8", "-f", "nc4", "-timmean", "./in.nc"],
+        ["-f", "nc4", "-v", "-timmean", "link.nc"],
+    ],
+    [
+        ["-z", "zip_5", "-f", "nc4", "-timmean", "in.nc"],
+        ["-f", "nc4", "-z", "zip_5", "-timmean", "in.nc"],
+    ],
+    [
+        ["-mulc,2", "in.nc"],
+        ["-mulc,2.0", "in.nc"],
+        ["-mulc,2e0", "in.nc"],
+        ["-mulc,+2.000", "./in.nc"],
+    ],
+    [
+        ["-sellevel,850,500", "in.nc"],
+        ["-sellevel,850.0,500.", "in.nc"],
+    ],
+    [
+        ["-remapbil,grid.txt", "in.nc"],
+        ["-remapbil,./grid.txt", "./in.nc"],
+        ["-remapbil,{tmp}/grid.txt", "link.nc"],
+    ],
+    [
+        ["-chname,tas,t2m", "in.nc"],
+        ["-chvar,tas,t2m", "in.nc"],
+    ],
+    [
+        ["-fldmean", "-ensmean", "a.nc", "b.nc"],
+        ["-fldmean", "-ensmean", "[", "./a.nc", "b.nc", "]"],
+    ],
+    [["-selparam,1.10", "in.nc"]],
+    [["-selparam,1.1", "in.nc"]],
+    [["-selname,1e3", "in.nc"]],
+    [["-selname,1000", "in.nc"]],
+    [["-f", "nc", "-timmean", "in.nc"]],
+    [["-fldmean", "other.nc"]],
+    [["-f", "nc", "-f", "nc4", "-timmean", "in.nc"]],
+    [["-f", "nc4", "-f", "nc", "-timmean", "in.nc"]],
+]
+
+
+@pytest.fixture
+def workdir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    for name in ("in.nc", "other.nc", "a.nc", "b.nc", "grid.txt"):
+        (tmp_path / name).write_text(" ")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "link.nc").symlink_to(tmp_path / "in.nc")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def corpus(tmp: Path) -> list[list[tuple[str, ...]]]:
+    return [
+        [tuple(a.format(tmp=tmp) for a in argv) for argv in group] for group in CORPUS
+    ]
+
+
+class TestCorpus:
+    def test_groups_share_a_key(self, workdir: Path):
+        for group in corpus(workdir):
+            assert len({canonicalize(argv) for argv in group}) == 1, group
+
+    def test_groups_keep_distinct_keys(self, workdir: Path):
+        keys = [canonicalize(group[0]) for group in corpus(workdir)]
+
+        assert len(set(keys)) == len(keys)
+
+    def test_hit_rate(self, workdir: Path):
+        commands = [argv for group in corpus(workdir) for argv in group]
+
+        # A command hits when an equivalent one was run before it
+        def hit_rate(keys: list[tuple[str, ...]]) -> float:
+            return 1 - len(set(keys)) / len(keys)
+
+        raw = hit_rate(commands)
+        canonical = hit_rate([canonicalize(argv) for argv in commands])
+
+        assert raw == 0
+        assert canonical == pytest.approx(1 - len(CORPUS) / len(commands))
+
+
+class TestCanonicalize:
+    def test_unparsable_unchanged(self):
+        assert canonicalize(["-nosuchoperator", "in.nc"]) == (
+            "-nosuchoperator",
+            "in.nc",
+        )
+
+    def test_keep_neutral(self):
+        argv = ["-s", "-P", "4", "-sinfo", "/data/in.nc"]
+
+        assert canonicalize(argv) == ("-sinfo", "/data/in.nc")
+        assert canonicalize(argv, keep_neutral=True) == (
+            "-P",
+            "4",
+            "-s",
+            "-sinfo",
+            "/data/in.nc",
+        )
+
+    def test_paths_resolved(self, workdir: Path):
+        assert canonicalize(["-fldmean", "link.nc"]) == (
+            "-fldmean",
+            os.path.realpath(workdir / "in.nc"),
+        )
+
+    def test_file_parameter_with_key(self, workdir: Path):
+        argv = canonicalize(["-setgrid,grid=./grid.txt", "in.nc"])
+
+        assert argv[0] == f"-setgrid,grid={os.path.realpath(workdir / 'grid.txt')}"
+
+    def test_resolved_paths_not_resolved_again(
+        self, workdir: Path, mocker: MockerFixture
+    ):
+        realpath = mocker.spy(os.path, "realpath")
+
+        argv = canonicalize(
+            ["-remapbil,grid.txt", "in.nc"],
+            {"grid.txt": "/data/grid.txt", "in.nc": "/data/in.nc"},
+        )
+
+        assert argv == ("-remapbil,/data/grid.txt", "/data/in.nc")
+        assert not realpath.called
+
+
+class TestCanonicalPath:
+    def test_directory_resolved_once(self, workdir: Path, mocker: MockerFixture):
+        (workdir / "dir").mkdir()
+        expected = os.path.realpath(workdir / "dir")
+        realpath = mocker.spy(os.path, "realpath")
+
+        for name in ("a.nc", "b.nc"):
+            assert canonical_path(f"dir/{name}") == os.path.join(expected, name)
+
+        assert realpath.call_count == 1
+
+    @pytest.mark.parametrize(
+        "path", ["link.nc", "./link.nc", "sub/../in.nc", "sub/", "."]
+    )
+    def test_same_as_realpath(self, workdir: Path, path: str):
+        (workdir / "sub" / "link").symlink_to(workdir / "sub")
+
+        assert canonical_path(path) == os.path.realpath(path)
+        assert canonical_path(f"sub/link/{path}") == os.path.realpath(
+            f"sub/link/{path}"
+        )
+
+
+class TestCanonicalNumber:
+    @pytest.mark.parametrize(
+        "value, expected",
+        [
+            ("2", "2"),
+            ("2.0", "2"),
+            ("+2", "2"),
+            ("1e3", "1000"),
+            ("0.50", "0.5"),
+            (".5", "0.5"),
+            ("-1.25E-2", "-0.0125"),
+            ("007", "7"),
+        ],
+    )
+    def test_numbers(self, value: str, expected: str):
+        assert canonical_number(value) == expected
+
+    @pytest.mark.parametrize("value", ["tas", "2000-01-01", "1e999", "r360x180", ""])
+    def test_not_numbers(self, value: str):
+        assert canonical_number(value) == value
@@ -0,0 +1,80 @@
+import pytest
+
+from xcdo.operators.cdo_cache.catalog import (
+    get_operator,
+    is_operator,
+    load_catalog,
+    parse_catalog,
+)
+from xcdo.operators.cdo_cache.exceptions import CdoError
+
+CATALOG = """\
+add              Add two fields                          (2|1)
+mergetime        Merge datasets sorted by date and time  (-1|1)
+splityear        Split years                             (1|-1)
+info             Dataset information (-1|0)
+infov            --> info                                (-1|0)
+not an operator line
+"""
+
+
+class TestParseCatalog:
+    def test_arity(self):
+        catalog = parse_catalog(CATALOG)
+
+        assert (catalog["add"].n_inputs, catalog["add"].n_outputs) == (2, 1)
+        assert (catalog["splityear"].n_inputs, catalog["splityear"].n_outputs) == (
+            1,
+            -1,
+        )
+
+    def test_variadic(self):
+        catalog = parse_catalog(CATALOG)
+
+        assert catalog["mergetime"].variadic
+        assert not catalog["add"].variadic
+
+    def test_description(self):
+        catalog = parse_catalog(CATALOG)
+
+        assert (
+            catalog["mergetime"].description == "Merge datasets sorted by date and time"
+        )
+        assert catalog["info"].description == "Dataset information"
+
+    def test_alias(self):
+        catalog = parse_catalog(CATALOG)
+
+        assert catalog["infov"].alias_of == "info"
+        assert catalog["info"].alias_of is None
+
+    def test_skips_other_lines(self):
+        assert set(parse_catalog(CATALOG)) == {
+            "add",
+            "mergetime",
+            "splityear",
+            "info",
+            "infov",
+        }
+
+
+class TestShippedCatalog:
+    def test_loaded_once(self):
+        assert load_catalog() is load_catalog()
+
+    def test_known_operators(self):
+        assert len(load_catalog()) > 500
+        assert get_operator("fldmean").n_inputs == 1
+        assert get_operator("ensmean").variadic
+        assert is_operator("remapbil")
+
+    def test_time_local(self):
+        assert get_operator("daymean").time_local
+        assert get_operator("chvar").time_local
+        assert not get_operator("timmean").time_local
+
+    def test_unknown_operator(self):
+        assert not is_operator("nosuchoperator")
+        with pytest.raises(CdoError) as e:
+            get_operator("nosuchoperator")
+        assert "nosuchoperator" in str(e.value)
@@ -1,10 +1,24 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
 import typing as t
+from pathlib import Path
 
 import pytest
+import xarray as xr
 from pytest_mock import MockerFixture, MockType
 
 from xcdo.operators.cdo_cache import CdoCache
+from xcdo.operators.cdo_cache.cache_handler import CacheHandler
+from xcdo.operators.cdo_cache.cdo_handler import CdoHandler
+from xcdo.operators.cdo_cache.datasets import DatasetCache
+from xcdo.operators.cdo_cache.exceptions import CacheError, CdoError
 from xcdo.operators.cdo_cache.interfaces import ICacheHandler, ICdoHandler
+from xcdo.operators.cdo_cache.types import RunStats, argvType
+
+from ._utils import cdo_calls, create_randomfile, fake_cdo
 
 
 @pytest.fixture
@@ -14,7 +28,9 @@ def cdo_mock(mocker: MockerFixture):
 
 @pytest.fixture
 def cache_mock(mocker: MockerFixture):
-    return mocker.MagicMock(spec=ICacheHandler)
+    cache_mock = mocker.MagicMock(spec=ICacheHandler)
+    cache_mock.fingerprints.return_value = None
+    return cache_mock
 
 
 @pytest.fixture
@@ -54,6 +70,9 @@ def env(
             ]
             self.cache_mock.generate_hash.return_value = self.hash_code
             self.cache_mock.generate_cache_paths.return_value = self.cache_files
+            self.temp_files = [f"tmp{f}" for f in self.cache_files]
+            self.cache_mock.generate_temp_paths.return_value = self.temp_files
+            self.cache_mock.commit.return_value = self.cache_files
             self.cache_mock.cache_exists.return_value = cache_exist
             self.cdo_mock.get_input_files.return_value = input_files
             self.cdo_mock.version.return_value = self.cdo_version
@@ -86,6 +105,28 @@ def test_n_outputs_not_positive_integer(env: t.Any, n_outputs: int):
     assert str(result.value) == "n_outputs should be a positive integer"
 
 
+def test_n_outputs_inferred(env: t.Any, mocker: MockerFixture):
+    env.arrange(argv=("-somecommand",), cache_valid=True)
+    env.cdo_mock.get_n_outputs.return_value = 2
+
+    env.cdo_cache.get_cache(env.argv)
+
+    assert env.cdo_mock.get_n_outputs.call_args == mocker.call(env.argv)
+    assert env.cache_mock.generate_cache_paths.call_args == mocker.call(
+        2, env.hash_code, ()
+    )
+
+
+def test_n_outputs_not_inferable(env: t.Any):
+    env.arrange(argv=("-somecommand",))
+    env.cdo_mock.get_n_outputs.side_effect = CdoError("unknown")
+
+    with pytest.raises(CdoError):
+        env.cdo_cache.get_cache(env.argv)
+
+    env.cache_mock.generate_cache_paths.assert_not_called()
+
+
 class MixinTestReturn:
     @pytest.mark.parametrize("argv", [("-somecommand",), ("-some", "-command")])
     @pytest.mark.parametrize("n_outputs", [1, 2, 3])
@@ -105,13 +146,22 @@ class MixinTestReturn:
 
 
 class CaseValidInputs:
+    input_files: t.ClassVar[list[str]] = []
+
+    @property
+    def canonical_inputs(self) -> tuple[str, ...]:
+        return tuple(os.path.realpath(f) for f in self.input_files)
+
     def add_assert_calls(self, env: t.Any, mocker: MockerFixture):
         env.cache_calls += [
-            mocker.call.generate_hash((*env.argv, env.cdo_version, *env.input_files)),
+            mocker.call.fingerprints(self.canonical_inputs),
+            mocker.call.generate_hash(
+                (*env.argv, env.cdo_version, *self.canonical_inputs)
+            ),
             mocker.call.generate_cache_paths(
-                env.n_outputs if env.n_outputs is not None else 1, env.hash_code
+                env.n_outputs if env.n_outputs is not None else 1, env.hash_code, ()
             ),
-            mocker.call.cache_exists(env.cache_files),
+            mocker.call.is_cache_valid(env.cache_files, self.canonical_inputs),
         ]
         env.cdo_calls += [
             mocker.call.version(),
@@ -119,87 +169,742 @@ class CaseValidInputs:
         ]
 
 
-class TestCacheDoesNotExists(CaseValidInputs, MixinTestReturn):
-    def arrange(self, env: t.Any, **kwargs: t.Dict[str, t.Any]):
-        env.arrange(cache_exist=False, **kwargs)
+class CaseCacheValid(CaseValidInputs):
+    def arrange(self, env: t.Any, **kwargs: t.Any):
+        env.arrange(input_files=self.input_files, cache_valid=True, **kwargs)
 
-    def add_assert_calls(self, env: t.Any, mocker: MockerFixture):
-        super().add_assert_calls(env, mocker)
-        env.cdo_calls.append(mocker.call.run((*env.argv, *env.cache_files)))
 
+class CaseCacheNotValid(CaseValidInputs):
+    def arrange(self, env: t.Any, **kwargs: t.Any):
+        env.arrange(input_files=self.input_files, cache_valid=False, **kwargs)
 
-class CaseCacheExists(CaseValidInputs):
     def add_assert_calls(self, env: t.Any, mocker: MockerFixture):
         super().add_assert_calls(env, mocker)
+        env.cdo_calls.append(mocker.call.run((*env.argv, *env.temp_files)))
+        env.cache_calls += [
+            mocker.call.lock(env.cache_files),
+            mocker.call.is_cache_valid(env.cache_files, self.canonical_inputs),
+            mocker.call.generate_temp_paths(env.cache_files),
+            mocker.call.commit(
+                env.temp_files,
+                env.cache_files,
+                self.canonical_inputs,
+                env.cdo_mock.run.return_value,
+                env.argv,
+                False,
+            ),
+        ]
 
 
-class TestNoInputFiles(CaseCacheExists, MixinTestReturn):
-    def arrange(self, env: t.Any, **kwargs: t.Any):
-        env.arrange(cache_exist=True, **kwargs)
+class TestCacheValidNoInputFiles(CaseCacheValid, MixinTestReturn):
+    pass
 
 
-class CaseWithInputFiles(CaseCacheExists):
-    def add_assert_calls(self, env: t.Any, mocker: MockerFixture):
-        super().add_assert_calls(env, mocker)
-        env.cache_calls.append(
-            mocker.call.is_cache_valid(
-                env.cache_files,
-                self.input_files,  # type: ignore
+class TestCacheNotValidNoInputFiles(CaseCacheNotValid, MixinTestReturn):
+    pass
+
+
+class TestCacheValidSingleInputFile(CaseCacheValid, MixinTestReturn):
+    input_files: t.ClassVar[list[str]] = ["someinputfiles"]
+
+
+class TestCacheNotValidSingleInputFile(CaseCacheNotValid, MixinTestReturn):
+    input_files: t.ClassVar[list[str]] = ["someinputfiles"]
+
+
+class TestCacheValidMultipleInputFile(CaseCacheValid, MixinTestReturn):
+    input_files: t.ClassVar[list[str]] = ["some", "input", "files"]
+
+
+class Test_invalid_cache_multiple_input_files(CaseCacheNotValid, MixinTestReturn):
+    input_files: t.ClassVar[list[str]] = ["some", "input", "files"]
+
+
+class TestGetCacheMany:
+    @pytest.fixture
+    def many(self, cdo_mock: MockType, cache_mock: MockType, cdo_cache: CdoCache):
+        cdo_mock.version.return_value = "x.x.x"
+        cdo_mock.get_input_files.return_value = ()
+        cache_mock.generate_hash.side_effect = lambda argv: "_".join(argv)
+        cache_mock.generate_cache_paths.side_effect = lambda n, h, s: tuple(
+            f"{h}{i}" for i in range(n)
+        )
+        cache_mock.generate_temp_paths.side_effect = lambda files: tuple(
+            f"tmp{f}" for f in files
+        )
+        cache_mock.is_cache_valid.return_value = False
+        return cdo_cache
+
+    def test_empty(self, many: CdoCache):
+        assert many.get_cache_many([]) == []
+
+    def test_results_in_order(self, many: CdoCache):
+        requests = [(["-a"], 1), (["-b"], 2), (["-c"], 1)]
+
+        result = many.get_cache_many(requests, max_workers=2)
+
+        assert result == [
+            ("-a_x.x.x0",),
+            ("-b_x.x.x0", "-b_x.x.x1"),
+            ("-c_x.x.x0",),
+        ]
+
+    def test_duplicates_run_once(self, many: CdoCache, cdo_mock: MockType):
+        result = many.get_cache_many([(["-a"], 1)] * 5)
+
+        assert result == [("-a_x.x.x0",)] * 5
+        cdo_mock.version.assert_called_once()
+        cdo_mock.run.assert_called_once_with(("-a", "tmp-a_x.x.x0"))
+
+    def test_only_misses_run(
+        self, many: CdoCache, cdo_mock: MockType, cache_mock: MockType
+    ):
+        cache_mock.is_cache_valid.side_effect = lambda files, _: files[0] == "-a_x.x.x0"
+
+        many.get_cache_many([(["-a"], 1), (["-b"], 1)])
+
+        cdo_mock.run.assert_called_once_with(("-b", "tmp-b_x.x.x0"))
+
+    def test_errors_per_item(self, many: CdoCache, cdo_mock: MockType):
+        def run(argv: tuple[str, ...]):
+            if argv[0] == "-bad":
+                raise CdoError(returncode=2)
+
+        cdo_mock.run.side_effect = run
+
+        result = many.get_cache_many([(["-bad"], 1), ([], 1), (["-a"], 1)])
+
+        assert isinstance(result[0], CdoError)
+        assert isinstance(result[1], ValueError)
+        assert result[2] == ("-a_x.x.x0",)
+
+
+class TestPopulation:
+    @pytest.fixture
+    def fake(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setenv("FAKE_CDO_SLEEP", "0.3")
+        return fake_cdo(tmp_path)
+
+    @staticmethod
+    def get_cache(cdo: str, tmp_path: Path, argv: list[str]) -> tuple[str, ...]:
+        cdo_cache = CdoCache(
+            CdoHandler(cdo, version_cache=str(tmp_path / "versions.json")),
+            CacheHandler(str(tmp_path / "cache")),
+        )
+        return cdo_cache.get_cache(argv, 1)
+
+    def test_single_flight(self, fake: tuple[str, Path], tmp_path: Path):
+        cdo, log = fake
+        input_file = create_randomfile(tmp_path)
+        os.utime(input_file, (10, 10))
+        CacheHandler(str(tmp_path / "cache"))
+        argvs = [["-timmean", input_file], ["-fldmean", input_file]]
+
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(8) as pool:
+            results = pool.starmap(
+                self.get_cache, [(cdo, tmp_path, argvs[i % 2]) for i in range(16)]
             )
+
+        runs = [c for c in cdo_calls(log) if c != "-V"]
+        assert sorted(c.split()[0] for c in runs) == ["-fldmean", "-timmean"]
+        assert len(set(results)) == 2
+        for (f,) in set(results):
+            assert Path(f).read_text().split()[0] in ("-timmean", "-fldmean")
+        assert not list(tmp_path.glob("cache/*/*/.tmp.*"))
+        assert not list(tmp_path.glob("cache/*/*/*.lock"))
+
+    def test_failed_run_leaves_nothing(
+        self,
+        fake: tuple[str, Path],
+        tmp_path: Path,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        cdo, _ = fake
+        monkeypatch.setenv("FAKE_CDO_NOUT", "0")
+        input_file = create_randomfile(tmp_path)
+
+        with pytest.raises(CacheError):
+            self.get_cache(cdo, tmp_path, ["-timmean", input_file])
+
+        assert not list(tmp_path.glob("cache/*/*/*"))
+
+    def test_cheap_run_not_cached(self, tmp_path: Path):
+        cdo, log = fake_cdo(tmp_path)
+        cdo_cache = CdoCache(
+            CdoHandler(cdo, version_cache=str(tmp_path / "versions.json")),
+            CacheHandler(str(tmp_path / "cache"), admit_min_cost=60.0),
+        )
+        input_file = create_randomfile(tmp_path)
+
+        (first,) = cdo_cache.get_cache(["-timmean", input_file], 1)
+        (second,) = cdo_cache.get_cache(["-timmean", input_file], 1)
+
+        assert Path(first).read_text() == f"-timmean {input_file}"
+        # Rerun into the same file, nothing is left behind
+        assert first == second
+        assert len([c for c in cdo_calls(log) if c != "-V"]) == 2
+        assert cdo_cache._cache.stats().entries == 0
+        assert len([p for p in tmp_path.rglob("cache/*/*/*") if p.is_file()]) == 1
+
+    def test_cheap_intermediates_cached(self, tmp_path: Path):
+        cdo, log = fake_cdo(tmp_path)
+        cdo_cache = CdoCache(
+            CdoHandler(cdo, version_cache=str(tmp_path / "versions.json")),
+            CacheHandler(str(tmp_path / "cache"), admit_min_cost=60.0),
         )
+        inputs = [create_randomfile(tmp_path) for _ in range(2)]
+        argv = ["-fldmean", "-mergetime", *inputs]
 
+        first = cdo_cache.get_cache(argv, intermediates=True)
+        second = cdo_cache.get_cache(argv, intermediates=True)
 
-class TestCacheValidSingleInputFile(CaseWithInputFiles, MixinTestReturn):
-    input_files = ["someinputfiles"]
+        assert first == second
+        # The intermediate once, the outer command every time
+        assert len([c for c in cdo_calls(log) if c != "-V"]) == 3
+        assert cdo_cache._cache.stats().entries == 1
 
-    def arrange(self, env: t.Any, **kwargs: t.Any):
-        env.arrange(
-            cache_exist=True,
-            input_files=self.input_files,
-            cache_valid=True,
-            **kwargs,
+
+class TestIntermediates:
+    @pytest.fixture
+    def setup(self, tmp_path: Path):
+        cdo, log = fake_cdo(tmp_path)
+        cdo_cache = CdoCache(
+            CdoHandler(cdo, version_cache=str(tmp_path / "versions.json")),
+            CacheHandler(str(tmp_path / "cache")),
         )
+        inputs = [create_randomfile(tmp_path) for _ in range(2)]
+        return cdo_cache, log, inputs
 
+    @staticmethod
+    def runs(log: Path) -> list[list[str]]:
+        return [c.split() for c in cdo_calls(log) if c != "-V"]
 
-class TestCacheNotValidSingleInputFile(CaseWithInputFiles, MixinTestReturn):
-    input_files = ["someinputfiles"]
+    def test_off_by_default(self, setup: t.Any):
+        cdo_cache, log, inputs = setup
 
-    def arrange(self, env: t.Any, **kwargs: t.Any):
-        env.arrange(
-            cache_exist=True,
-            input_files=self.input_files,
-            cache_valid=False,
-            **kwargs,
+        cdo_cache.get_cache(["-fldmean", "-mergetime", *inputs])
+
+        assert len(self.runs(log)) == 1
+
+    def test_shared_core_runs_once(self, setup: t.Any):
+        cdo_cache, log, inputs = setup
+        core = ["-selyear,2000/2020", "-mergetime", *inputs]
+
+        mean = cdo_cache.get_cache(["-fldmean", *core], intermediates=True)
+        sum_ = cdo_cache.get_cache(["-fldsum", *core], intermediates=True)
+
+        runs = self.runs(log)
+        assert [r[0] for r in runs] == ["-mergetime", "-fldmean", "-fldsum"]
+        (merged,) = cdo_cache.get_cache(["-mergetime", *inputs])
+        assert runs[1][:3] == ["-fldmean", "-selyear,2000/2020", merged]
+        assert mean != sum_
+
+    def test_hit_reuses_intermediates(self, setup: t.Any):
+        cdo_cache, log, inputs = setup
+        argv = ["-fldmean", "-mergetime", *inputs]
+
+        first = cdo_cache.get_cache(argv, intermediates=True)
+        second = cdo_cache.get_cache(argv, intermediates=True)
+
+        assert first == second
+        assert len(self.runs(log)) == 2
+
+    def test_explicit_markers(self, setup: t.Any):
+        cdo_cache, log, inputs = setup
+        argv = ["-fldmean", "-selyear,2000", "-mergetime", *inputs]
+
+        cdo_cache.get_cache(
+            argv, intermediates=lambda node: node.operator.name == "selyear"
         )
 
-    def add_assert_calls(self, env: t.Any, mocker: MockerFixture):
-        super().add_assert_calls(env, mocker)
-        env.cdo_calls.append(mocker.call.run((*env.argv, *env.cache_files)))
+        runs = self.runs(log)
+        assert [r[0] for r in runs] == ["-selyear,2000", "-fldmean"]
+        assert runs[0][1:6] == ["-mergetime", "[", *inputs, "]"]
+
+    def test_options_apply_to_intermediates(self, setup: t.Any):
+        cdo_cache, log, inputs = setup
 
+        cdo_cache.get_cache(
+            ["-f", "nc4", "-fldmean", "-mergetime", *inputs], intermediates=True
+        )
 
-class TestCacheValidMultipleInputFile(CaseWithInputFiles, MixinTestReturn):
-    input_files = ["some", "input", "files"]
+        assert [r[:3] for r in self.runs(log)] == [
+            ["-f", "nc4", "-mergetime"],
+            ["-f", "nc4", "-fldmean"],
+        ]
 
-    def arrange(self, env: t.Any, **kwargs: t.Any):
-        env.arrange(
-            cache_exist=True,
-            input_files=self.input_files,
-            cache_valid=True,
-            **kwargs,
+
+class TestGetDataset:
+    @pytest.fixture
+    def setup(self, tmp_path: Path):
+        cdo, _ = fake_cdo(tmp_path)
+        opened: list[str] = []
+
+        def open_dataset(path: str, **kwargs: t.Any) -> xr.Dataset:
+            opened.append(path)
+            return xr.Dataset({"x": ("t", [1, 2])})
+
+        cdo_cache = CdoCache(
+            CdoHandler(cdo, version_cache=str(tmp_path / "versions.json")),
+            CacheHandler(str(tmp_path / "cache"), max_entries=1, evict_grace=0),
+            datasets=DatasetCache(open_dataset=open_dataset),
         )
+        return cdo_cache, opened, create_randomfile(tmp_path)
 
+    def test_opened_once(self, setup: t.Any):
+        cdo_cache, opened, input_file = setup
 
-class Test_invalid_cache_multiple_input_files(CaseWithInputFiles, MixinTestReturn):
-    input_files = ["some", "input", "files"]
+        (first,) = cdo_cache.get_dataset(["-timmean", input_file])
+        (second,) = cdo_cache.get_dataset(["-timmean", input_file])
 
-    def arrange(self, env: t.Any, **kwargs: t.Any):
-        env.arrange(
-            cache_exist=True,
-            input_files=self.input_files,
-            cache_valid=False,
-            **kwargs,
+        assert first.identical(second)
+        assert opened == list(cdo_cache.get_cache(["-timmean", input_file]))
+
+    def test_dropped_on_eviction(self, setup: t.Any):
+        cdo_cache, opened, input_file = setup
+        cdo_cache.get_dataset(["-timmean", input_file])
+
+        cdo_cache.get_dataset(["-fldmean", input_file])
+
+        assert len(cdo_cache.datasets) == 1
+        assert len(opened) == 2
+
+
+class CountingCdoHandler(CdoHandler):
+    """Records the peak number of concurrent async runs"""
+
+    running = 0
+    peak = 0
+
+    async def arun(self, argv: argvType) -> RunStats:
+        type(self).running += 1
+        type(self).peak = max(self.peak, self.running)
+        try:
+            return await super().arun(argv)
+        finally:
+            type(self).running -= 1
+
+
+class TestAsync:
+    @pytest.fixture
+    def setup(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setenv("FAKE_CDO_SLEEP", "0.2")
+        monkeypatch.setattr(CountingCdoHandler, "peak", 0)
+        cdo, log = fake_cdo(tmp_path)
+        cdo_cache = CdoCache(
+            CountingCdoHandler(cdo, version_cache=str(tmp_path / "versions.json")),
+            CacheHandler(str(tmp_path / "cache")),
+            max_workers=2,
         )
+        return cdo_cache, log, create_randomfile(tmp_path)
 
-    def add_assert_calls(self, env: t.Any, mocker: MockerFixture):
-        super().add_assert_calls(env, mocker)
-        env.cdo_calls.append(mocker.call.run((*env.argv, *env.cache_files)))
+    @staticmethod
+    def runs(log: Path) -> list[str]:
+        return [c for c in cdo_calls(log) if c != "-V"]
+
+    def test_single_flight(self, setup: t.Any):
+        cdo_cache, log, input_file = setup
+
+        async def main():
+            argv = ["-timmean", input_file]
+            return await asyncio.gather(
+                *(cdo_cache.aget_cache(argv) for _ in range(50))
+            )
+
+        results = asyncio.run(main())
+
+        assert len(set(results)) == 1
+        assert len(self.runs(log)) == 1
+        assert results[0] == cdo_cache.get_cache(["-timmean", input_file])
+
+    def test_concurrency_limit(self, setup: t.Any):
+        cdo_cache, log, input_file = setup
+        operators = ["-timmean", "-timmin", "-timmax", "-fldmean", "-fldmin"]
+
+        async def main():
+            await asyncio.gather(
+                *(cdo_cache.aget_cache([op, input_file]) for op in operators)
+            )
+
+        asyncio.run(main())
+
+        assert len(self.runs(log)) == len(operators)
+        assert CountingCdoHandler.peak == 2
+
+    def test_cancel(
+        self, setup: t.Any, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        cdo_cache, _, input_file = setup
+        monkeypatch.setenv("FAKE_CDO_SLEEP", "5")
+
+        async def main():
+            task = asyncio.create_task(cdo_cache.aget_cache(["-timmean", input_file]))
+            await asyncio.sleep(0.3)
+            task.cancel()
+            await task
+
+        start = time.monotonic()
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(main())
+
+        assert time.monotonic() - start < 2
+        assert not list(tmp_path.glob("cache/*/*/*"))
+
+    def test_lookup_off_the_event_loop(self, setup: t.Any, mocker: MockerFixture):
+        cdo_cache, _, input_file = setup
+        threads: set[int] = set()
+
+        def recording(method: t.Callable[..., t.Any]) -> t.Callable[..., t.Any]:
+            def wrapper(*args: t.Any) -> t.Any:
+                threads.add(threading.get_ident())
+                return method(*args)
+
+            return wrapper
+
+        for name in ("is_cache_valid", "commit"):
+            method = getattr(cdo_cache._cache, name)
+            mocker.patch.object(cdo_cache._cache, name, side_effect=recording(method))
+
+        asyncio.run(cdo_cache.aget_cache(["-timmean", input_file]))
+
+        assert threads and threading.get_ident() not in threads
+
+
+class TestChunked:
+    @pytest.fixture
+    def setup(self, tmp_path: Path):
+        cdo, log = fake_cdo(tmp_path)
+        cdo_cache = CdoCache(
+            CdoHandler(cdo, version_cache=str(tmp_path / "versions.json")),
+            CacheHandler(str(tmp_path / "cache")),
+        )
+        input_file = tmp_path / "in.nc"
+        input_file.write_text(
+            "2000-01-01T00:00:00 2000-07-01T00:00:00 2001-01-01T00:00:00"
+        )
+        return cdo_cache, log, input_file
+
+    @staticmethod
+    def runs(log: Path) -> list[str]:
+        return [
+            " ".join(a for a in c.split() if not a.startswith("/"))
+            for c in cdo_calls(log)
+            if c != "-V" and "-info" not in c
+        ]
+
+    def test_chunks_concatenated(self, setup: t.Any):
+        cdo_cache, log, input_file = setup
+
+        (result,) = cdo_cache.get_cache_chunked(["-daymean", str(input_file)])
+
+        assert self.runs(log) == [
+            "-daymean -selyear,2000/2000",
+            "-daymean -selyear,2001/2001",
+            "-mergetime",
+        ]
+        assert Path(result).exists()
+
+    def test_hit(self, setup: t.Any):
+        cdo_cache, log, input_file = setup
+        argv = ["-fldmean", "-daymean", str(input_file)]
+
+        first = cdo_cache.get_cache_chunked(argv)
+        second = cdo_cache.get_cache_chunked(argv)
+
+        assert first == second
+        assert len(self.runs(log)) == 3
+
+    def test_append_recomputes_changed_chunks(self, setup: t.Any):
+        cdo_cache, log, input_file = setup
+        cdo_cache.get_cache_chunked(["-daymean", str(input_file)])
+        log.write_text("")
+        input_file.write_text(
+            input_file.read_text() + " 2001-07-01T00:00:00 2002-01-01T00:00:00"
+        )
+
+        cdo_cache.get_cache_chunked(["-daymean", str(input_file)])
+
+        assert self.runs(log) == [
+            "-daymean -selyear,2001/2001",
+            "-daymean -selyear,2002/2002",
+            "-mergetime",
+        ]
+
+    def test_rewrite_recomputes_changed_chunks(self, setup: t.Any):
+        cdo_cache, log, input_file = setup
+        cdo_cache.get_cache_chunked(["-daymean", str(input_file)])
+        log.write_text("")
+        input_file.write_text(
+            "2000-01-01T00:00:00 2000-07-01T00:00:00 2001-01-01T00:00:00=1"
+        )
+
+        cdo_cache.get_cache_chunked(["-daymean", str(input_file)])
+        cdo_cache.get_cache_chunked(["-daymean", str(input_file)])
+
+        assert self.runs(log) == ["-daymean -selyear,2001/2001", "-mergetime"]
+
+    def test_time_fingerprints_kept_in_the_index(self, setup: t.Any, tmp_path: Path):
+        cdo_cache, log, input_file = setup
+        argv = ["-daymean", str(input_file)]
+        cdo_cache.get_cache_chunked(argv)
+        log.write_text("")
+        # A new process reads nothing of an unmodified input
+        other = CdoCache(
+            CdoHandler(
+                str(tmp_path / "cdo"), version_cache=str(tmp_path / "versions.json")
+            ),
+            CacheHandler(str(tmp_path / "cache")),
+        )
+
+        other.get_cache_chunked(argv)
+
+        assert [c for c in cdo_calls(log) if c != "-V"] == []
+
+    def test_changed_param_file_recomputes_chunks(self, setup: t.Any, tmp_path: Path):
+        cdo_cache, log, input_file = setup
+        grid = tmp_path / "grid.txt"
+        grid.write_text("gridtype = lonlat")
+        argv = [f"-remapbil,{grid}", str(input_file)]
+        cdo_cache.get_cache_chunked(argv)
+        log.write_text("")
+        grid.write_text("gridtype = gaussian")
+        os.utime(grid, ns=(0, grid.stat().st_mtime_ns + 10**9))
+
+        cdo_cache.get_cache_chunked(argv)
+
+        assert [r.split()[-1] for r in self.runs(log)] == [
+            "-selyear,2000/2000",
+            "-selyear,2001/2001",
+            "-mergetime",
+        ]
+
+    def test_input_of_every_chunk(self, setup: t.Any):
+        cdo_cache, log, input_file = setup
+        cdo_cache.get_cache_chunked(["-daymean", str(input_file)])
+        log.write_text("")
+
+        # Both chunks and the merged result
+        assert cdo_cache._cache.invalidate([str(input_file)]) == 3
+        cdo_cache.get_cache_chunked(["-daymean", str(input_file)])
+
+        assert self.runs(log) == [
+            "-daymean -selyear,2000/2000",
+            "-daymean -selyear,2001/2001",
+            "-mergetime",
+        ]
+
+    def test_chunk_years(self, setup: t.Any):
+        cdo_cache, log, input_file = setup
+
+        cdo_cache.get_cache_chunked(["-daymean", str(input_file)], chunk_years=2)
+
+        assert self.runs(log) == ["-daymean -selyear,2000/2001", "-mergetime"]
+
+    @pytest.mark.parametrize(
+        "argv",
+        [
+            ["-timmean", "IN"],
+            ["-daymean", "-mergetime", "IN", "IN2"],
+        ],
+    )
+    def test_fallback(self, setup: t.Any, tmp_path: Path, argv: list[str]):
+        cdo_cache, log, input_file = setup
+        other = tmp_path / "in2.nc"
+        other.write_text("2000-01-01T00:00:00")
+        files = {"IN": str(input_file), "IN2": str(other)}
+
+        cdo_cache.get_cache_chunked([files.get(a, a) for a in argv])
+
+        assert self.runs(log) == [" ".join(a for a in argv if a not in files)]
+
+
+class TestRebuild:
+    @pytest.fixture
+    def setup(self, tmp_path: Path):
+        cdo, log = fake_cdo(tmp_path)
+        cdo_cache = CdoCache(
+            CdoHandler(cdo, version_cache=str(tmp_path / "versions.json")),
+            CacheHandler(str(tmp_path / "cache")),
+        )
+        inputs = [create_randomfile(tmp_path) for _ in range(2)]
+        return cdo_cache, log, inputs
+
+    @staticmethod
+    def runs(log: Path) -> list[str]:
+        return [c.split()[0] for c in cdo_calls(log) if c != "-V"]
+
+    def test_nothing_stale(self, setup: t.Any):
+        cdo_cache, _, inputs = setup
+        cdo_cache.get_cache(["-fldmean", "-mergetime", *inputs], intermediates=True)
+
+        assert cdo_cache.rebuild() == []
+
+    def test_changed_input_rebuilds_descendants_in_order(self, setup: t.Any):
+        cdo_cache, log, inputs = setup
+        core = ["-mergetime", *inputs]
+        mean = cdo_cache.get_cache(["-fldmean", *core], intermediates=True)
+        sum_ = cdo_cache.get_cache(["-fldsum", *core], intermediates=True)
+        merged = cdo_cache.get_cache(core)
+        log.write_text("")
+        Path(inputs[0]).write_text("changed")
+
+        rebuilt = cdo_cache.rebuild()
+
+        assert rebuilt[0] == merged
+        assert sorted(rebuilt[1:]) == sorted([mean, sum_])
+        runs = self.runs(log)
+        assert runs[0] == "-mergetime"
+        assert sorted(runs[1:]) == ["-fldmean", "-fldsum"]
+        assert cdo_cache.rebuild() == []
+
+    def test_rewritten_entry_rebuilds_children_only(self, setup: t.Any):
+        cdo_cache, log, inputs = setup
+        core = ["-mergetime", *inputs]
+        mean = cdo_cache.get_cache(["-fldmean", *core], intermediates=True)
+        merged = cdo_cache.get_cache(core)
+        cache = t.cast(CacheHandler, cdo_cache._cache)  # type: ignore
+        with cache.lock(merged):
+            temp_files = cache.generate_temp_paths(merged)
+            Path(temp_files[0]).write_text("rewritten")
+            cache.commit(temp_files, merged, inputs, argv=core)
+        log.write_text("")
+
+        assert cdo_cache.rebuild() == [mean]
+        assert self.runs(log) == ["-fldmean"]
+
+    def test_relative_inputs_rebuilt_from_any_directory(
+        self, setup: t.Any, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        cdo_cache, _, inputs = setup
+        monkeypatch.chdir(tmp_path)
+        name = os.path.basename(inputs[0])
+        (cache_file,) = cdo_cache.get_cache(["-timmean", name], 1)
+        other = tmp_path / "other"
+        other.mkdir()
+        (other / name).write_text("other")
+        Path(inputs[0]).write_text("changed")
+        monkeypatch.chdir(other)
+
+        assert cdo_cache.rebuild() == [(cache_file,)]
+        assert Path(cache_file).read_text() == f"-timmean {inputs[0]}"
+
+    def test_unknown_command_left_stale(self, setup: t.Any, tmp_path: Path):
+        cdo_cache, log, inputs = setup
+        cache = t.cast(CacheHandler, cdo_cache._cache)  # type: ignore
+        registered = cache.generate_cache_paths(1, cache.generate_hash(["-x"]))
+        cache.ensure_directories_exist(registered)
+        Path(registered[0]).write_text("data")
+        cache.register(registered, inputs)
+        child = cdo_cache.get_cache(["-fldmean", registered[0]])
+        Path(inputs[0]).write_text("changed")
+        log.write_text("")
+
+        assert cdo_cache.rebuild() == []
+        assert self.runs(log) == []
+        assert not cache.is_cache_valid(child, registered)
+
+
+def test_fingerprints_share_entries_across_paths(tmp_path: Path):
+    cdo, log = fake_cdo(tmp_path)
+    cdo_cache = CdoCache(
+        CdoHandler(cdo, version_cache=str(tmp_path / "versions.json")),
+        CacheHandler(str(tmp_path / "cache"), fingerprint="sample"),
+    )
+    original = create_randomfile(tmp_path)
+    copy = tmp_path / "copy"
+    copy.write_bytes(Path(original).read_bytes())
+
+    first = cdo_cache.get_cache(["-fldmean", original])
+    second = cdo_cache.get_cache(["-fldmean", str(copy)])
+
+    assert first == second
+    assert len([c for c in cdo_calls(log) if c != "-V"]) == 1
+
+
+class TestGetInfo:
+    @pytest.fixture
+    def setup(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setenv("FAKE_CDO_NOUT", "0")
+        cdo, log = fake_cdo(tmp_path)
+
+        def make() -> CdoCache:
+            return CdoCache(
+                CdoHandler(cdo, version_cache=str(tmp_path / "versions.json")),
+                CacheHandler(str(tmp_path / "cache")),
+            )
+
+        return make, log, create_randomfile(tmp_path)
+
+    @staticmethod
+    def runs(log: Path) -> list[str]:
+        return [c for c in cdo_calls(log) if c != "-V"]
+
+    def test_output_captured(self, setup: t.Any):
+        make, log, input_file = setup
+
+        stdout, stderr = make().get_info(["-sinfo", input_file])
+
+        assert stdout == f"-sinfo {input_file}\n"
+        assert stderr == "cdo: processed\n"
+        assert self.runs(log) == [f"-sinfo {input_file}"]
+
+    def test_memory_tier(self, setup: t.Any, mocker: MockerFixture):
+        make, log, input_file = setup
+        cdo_cache = make()
+        first = cdo_cache.get_info(["-showname", input_file])
+        is_cache_valid = mocker.spy(cdo_cache._cache, "is_cache_valid")
+
+        assert cdo_cache.get_info(["-showname", input_file]) == first
+        is_cache_valid.assert_not_called()
+        assert len(self.runs(log)) == 1
+
+    def test_disk_tier(self, setup: t.Any):
+        make, log, input_file = setup
+        first = make().get_info(["-ntime", input_file])
+
+        assert make().get_info(["-ntime", input_file]) == first
+        assert len(self.runs(log)) == 1
+
+    def test_output_options_part_of_key(self, setup: t.Any):
+        make, log, input_file = setup
+        cdo_cache = make()
+
+        outputs = {
+            cdo_cache.get_info([*options, "-sinfo", input_file])
+            for options in ([], ["-v"], ["-s"], ["-w"], ["-s"])
+        }
+
+        assert len(outputs) == 4
+        assert len(self.runs(log)) == 4
+
+    def test_changed_input_reruns(self, setup: t.Any):
+        make, log, input_file = setup
+        cdo_cache = make()
+        cdo_cache.get_info(["-griddes", input_file])
+        Path(input_file).write_text("changed")
+
+        cdo_cache.get_info(["-griddes", input_file])
+
+        assert len(self.runs(log)) == 2
+
+    def test_failed_run_not_cached(
+        self, setup: t.Any, tmp_path: Path, mocker: MockerFixture
+    ):
+        make, _, input_file = setup
+        cdo_cache = make()
+        captured_run = mocker.patch.object(
+            cdo_cache._cdo, "captured_run", side_effect=CdoError(returncode=1)
+        )
+
+        for _ in range(2):
+            with pytest.raises(CdoError):
+                cdo_cache.get_info(["-sinfo", input_file])
+        assert captured_run.call_count == 2
+        assert list((tmp_path / "cache").rglob("*.std*")) == []
+
+    def test_writing_command_rejected(self, setup: t.Any):
+        make, _, input_file = setup
+
+        with pytest.raises(ValueError):
+            make().get_info(["-timmean", input_file])
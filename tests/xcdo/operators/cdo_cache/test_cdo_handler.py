@@ -1,12 +1,23 @@
+import asyncio
+import os
+import time
 from pathlib import Path
 import pytest
 import typing as t
+from pytest_mock import MockerFixture
 
 from xcdo.operators.cdo_cache.exceptions import CdoError
 from xcdo.operators.cdo_cache.interfaces import ICdoHandler
+from xcdo.operators.cdo_cache import cdo_handler as cdo_handler_module
 from xcdo.operators.cdo_cache.cdo_handler import CdoHandler
 
-from ._utils import randomcmd, randomfile, randomword
+from ._utils import (
+    FAKE_CDO_VERSION,
+    cdo_calls,
+    fake_cdo,
+    randomcmd,
+    randomfile,
+)
 
 
 @pytest.fixture
@@ -39,164 +50,218 @@ class Test_get_input_files:
 
         assert result == (), "result should be empty"
 
-    def test_no_file_like(self, cdo_handler: ICdoHandler):
-        command = [randomcmd(), randomcmd()]
+    def test_no_inputs(self, cdo_handler: ICdoHandler):
+        result = cdo_handler.get_input_files(["-const,0,r90x45"])
+
+        assert result == (), "result should be empty"
+
+    def test_unknown_operator(self, cdo_handler: ICdoHandler):
+        with pytest.raises(CdoError, match="'nosuchop'"):
+            cdo_handler.get_input_files(["-nosuchop,a", "in.nc"])
+
+    def test_files_need_not_exist(self, cdo_handler: ICdoHandler, tmp_path: t.Any):
+        fi = [randomfile(tmp_path) for _ in range(2)]
+        command = ["-fldmean", "-mergetime", *fi]
 
         result = cdo_handler.get_input_files(command)
 
-        assert result == (), "result should be empty"
+        assert result == tuple(sorted(fi))
+
+    def test_no_filesystem_calls(
+        self, cdo_handler: ICdoHandler, monkeypatch: pytest.MonkeyPatch
+    ):
+        def fail(*args: t.Any) -> t.NoReturn:
+            raise AssertionError("filesystem call")
+
+        monkeypatch.setattr(os, "stat", fail)
+        monkeypatch.setattr(os.path, "isfile", fail)
+        command = ["-sub", "-fldmean", "a.nc", "-fldmean", "b.nc"]
+
+        assert cdo_handler.get_input_files(command) == ("a.nc", "b.nc")
+
+    def test_file_as_parameter(self, cdo_handler: ICdoHandler, tmp_path: t.Any):
+        grid = randomfile(tmp_path)
+        command = [f"-remapbil,{grid}", "in.nc"]
+
+        result = cdo_handler.get_input_files(command)
 
-    class Test_with_input_files:
-        def arrange(self, tmp_path: t.Any) -> t.Any:
-            class Env:
-                def __init__(self) -> None:
-                    self.input_files = tuple(
-                        [
-                            randomfile(tmp_path),
-                        ]
-                    )
-                    self.command = [
-                        f"{randomcmd()},{randomword(n=4)}",
-                        randomcmd(),
-                        str(self.input_files[0]),
-                    ]
-
-            return Env()
-
-        def test_file_does_not_exist(
-            self,
-            cdo_handler: ICdoHandler,
-            tmp_path: t.Any,
-        ):
-            env = self.arrange(tmp_path=tmp_path)
-            result = cdo_handler.get_input_files(env.command)
-            assert result == (), "result should be empty"
-
-        def test_file_exist(self, cdo_handler: ICdoHandler, tmp_path: t.Any):
-            env = self.arrange(tmp_path=tmp_path)
-            [Path(f).write_text(" ") for f in env.input_files]
-            result = cdo_handler.get_input_files(env.command)
-            expected = tuple(sorted(env.input_files))
-            assert result == expected, env.input_files
-
-    class Test_file_as_parameter(Test_with_input_files):
-        def arrange(self, tmp_path: t.Any) -> t.Any:
-            class Env:
-                def __init__(self) -> None:
-                    self.input_files = tuple((randomfile(tmp_path),))
-                    self.command = [
-                        f"{randomcmd()},{randomword(n=4)}",
-                        f"{randomcmd()},{self.input_files[0]}",
-                    ]
-
-            return Env()
-
-    class Test_file_as_kwarg(Test_with_input_files):
-        def arrange(self, tmp_path: t.Any) -> t.Any:
-            class Env:
-                def __init__(self) -> None:
-                    self.input_files = (randomfile(tmp_path),)
-                    fi = self.input_files
-                    self.command = [
-                        f"{randomcmd()},{randomword(n=4)}={fi[0]}",
-                    ]
-
-            return Env()
-
-    class Test_file_as_parameter_and_input(Test_with_input_files):
-        def arrange(self, tmp_path: t.Any) -> t.Any:
-            class Env:
-                def __init__(self) -> None:
-                    self.input_files = tuple([randomfile(tmp_path) for _ in range(2)])
-                    fi = self.input_files
-                    self.command = [
-                        f"{randomcmd()},{fi[0]}",
-                        randomcmd(),
-                        str(fi[1]),
-                    ]
-
-            return Env()
-
-    class Test_multiple_files_as_input(Test_with_input_files):
-        def arrange(self, tmp_path: t.Any) -> t.Any:
-            class Env:
-                def __init__(self) -> None:
-                    self.input_files = (
-                        randomfile(tmp_path),
-                        randomfile(tmp_path),
-                    )
-                    self.command = [
-                        randomcmd(),
-                        str(self.input_files[0]),
-                        randomcmd(),
-                        str(self.input_files[1]),
-                    ]
-
-            return Env()
-
-    class Test_multiple_files_as_parameter(Test_with_input_files):
-        def arrange(self, tmp_path: t.Any) -> t.Any:
-            class Env:
-                def __init__(self) -> None:
-                    self.input_files = (
-                        randomfile(tmp_path),
-                        randomfile(tmp_path),
-                    )
-                    fi = self.input_files
-                    self.command = [
-                        f"{randomcmd()},{fi[0]},{fi[1]}",
-                        randomcmd(),
-                    ]
-
-            return Env()
-
-    class Test_multiple_files_as_kwarg(Test_with_input_files):
-        def arrange(self, tmp_path: t.Any) -> t.Any:
-            class Env:
-                def __init__(self) -> None:
-                    self.input_files = (
-                        randomfile(tmp_path),
-                        randomfile(tmp_path),
-                    )
-                    fi = self.input_files
-                    self.command = [
-                        f"{randomcmd()},{randomword(n=4)}={fi[0]},{randomword(n=4)}={fi[1]}",
-                        randomcmd(),
-                    ]
-
-            return Env()
-
-    class Test_multiple_files_as_parm_and_input(Test_with_input_files):
-        def arrange(self, tmp_path: t.Any) -> t.Any:
-            class Env:
-                def __init__(self) -> None:
-                    self.input_files = tuple(randomfile(tmp_path) for _ in range(4))
-                    fi = self.input_files
-                    self.command = [
-                        f"{randomcmd()},{fi[0]},{fi[1]}",
-                        f"{fi[3]}",
-                        f"{randomcmd()}",
-                        f"{fi[2]}",
-                    ]
-
-            return Env()
-
-    class Test_return_unique_files(Test_with_input_files):
-        def arrange(self, tmp_path: t.Any) -> t.Any:
-            class Env:
-                def __init__(self) -> None:
-                    self.input_files = tuple(randomfile(tmp_path) for _ in range(2))
-                    fi = self.input_files
-                    self.command = [
-                        f"{randomcmd()},{fi[0]},{fi[1]}",
-                        f"{fi[0]}",
-                        f"{randomcmd()}",
-                        f"{fi[1]}",
-                    ]
-
-            return Env()
+        assert result == tuple(sorted((grid, "in.nc")))
+
+    def test_file_as_kwarg(self, cdo_handler: ICdoHandler):
+        command = ["-setattribute,tas@units=K", "-setgridarea,area=grid.nc", "in.nc"]
+
+        result = cdo_handler.get_input_files(command)
+
+        assert result == ("grid.nc", "in.nc")
+
+    def test_parameter_is_not_a_file(
+        self,
+        cdo_handler: ICdoHandler,
+        tmp_path: t.Any,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # A parameter naming an existing file is still a parameter
+        (tmp_path / "tas").write_text(" ")
+        monkeypatch.chdir(tmp_path)
+        command = ["-selname,tas", "in.nc"]
+
+        assert cdo_handler.get_input_files(command) == ("in.nc",)
+
+    def test_return_unique_files(self, cdo_handler: ICdoHandler):
+        command = ["-add", "-selname,tas", "in.nc", "-selname,pr", "in.nc"]
+
+        assert cdo_handler.get_input_files(command) == ("in.nc",)
+
+
+class Test_get_n_outputs:
+    @pytest.mark.parametrize(
+        "command, expected",
+        [
+            (["-fldmean", "in.nc"], 1),
+            (["-info", "in.nc"], 0),
+            (["-f", "nc4", "-ensmean", "-selname,tas", "a.nc", "b.nc"], 1),
+        ],
+    )
+    def test_inferred(
+        self, cdo_handler: ICdoHandler, command: list[str], expected: int
+    ):
+        assert cdo_handler.get_n_outputs(command) == expected
+
+    def test_output_prefix(self, cdo_handler: ICdoHandler):
+        with pytest.raises(CdoError):
+            cdo_handler.get_n_outputs(["-splityear", "in.nc"])
 
 
 def test_version(cdo_handler: ICdoHandler):
     result = cdo_handler.version()
     assert isinstance(result, str)
+
+
+class Test_lazy_cdo:
+    def test_construction_does_not_run_cdo(self, tmp_path: Path):
+        cdo, log = fake_cdo(tmp_path)
+        CdoHandler(cdo, version_cache=str(tmp_path / "versions.json"))
+        assert cdo_calls(log) == []
+
+    def test_cdo_not_found(self, tmp_path: Path):
+        handler = CdoHandler(str(tmp_path / "nocdo"))
+        with pytest.raises(CdoError) as e:
+            handler.version()
+        assert "not found" in str(e.value)
+
+    def test_version_memoized(self, tmp_path: Path):
+        cdo, log = fake_cdo(tmp_path)
+        version_cache = str(tmp_path / "versions.json")
+        handler = CdoHandler(cdo, version_cache=version_cache)
+
+        assert handler.version() == FAKE_CDO_VERSION
+        assert handler.version() == FAKE_CDO_VERSION
+        assert CdoHandler(cdo, version_cache=version_cache).version() == (
+            FAKE_CDO_VERSION
+        )
+        assert cdo_calls(log) == ["-V"]
+
+    def test_version_on_disk_cache(self, tmp_path: Path):
+        cdo, log = fake_cdo(tmp_path)
+        version_cache = str(tmp_path / "versions.json")
+        CdoHandler(cdo, version_cache=version_cache).version()
+        cdo_handler_module._version_cache.clear()
+
+        result = CdoHandler(cdo, version_cache=version_cache).version()
+
+        assert result == FAKE_CDO_VERSION
+        assert cdo_calls(log) == ["-V"]
+
+    def test_version_reprobed_after_binary_changes(self, tmp_path: Path):
+        cdo, log = fake_cdo(tmp_path)
+        handler = CdoHandler(cdo, version_cache=str(tmp_path / "versions.json"))
+        handler.version()
+        os.utime(cdo, ns=(0, 0))
+
+        handler.version()
+
+        assert cdo_calls(log) == ["-V", "-V"]
+
+
+def test_run_stats(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    cdo, _ = fake_cdo(tmp_path)
+    monkeypatch.setenv("FAKE_CDO_SLEEP", "0.2")
+    output = tmp_path / "out"
+
+    result = CdoHandler(cdo).run(("-timmean", "in", str(output)))
+
+    assert output.exists()
+    assert result.wall_time >= 0.2
+    assert result.cpu_time > 0
+    assert result.max_rss > 0
+
+
+def test_run_fails(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    cdo, _ = fake_cdo(tmp_path)
+    monkeypatch.setenv("FAKE_CDO_NOUT", "1")
+
+    with pytest.raises(CdoError):
+        CdoHandler(cdo).run((str(tmp_path / "missing" / "out"),))
+
+
+class Test_arun:
+    def test_run(self, tmp_path: Path):
+        cdo, _ = fake_cdo(tmp_path)
+        output = tmp_path / "out"
+
+        result = asyncio.run(CdoHandler(cdo).arun(("-timmean", "in", str(output))))
+
+        assert output.exists()
+        assert result.wall_time > 0
+        assert result.cpu_time > 0
+        assert result.max_rss > 0
+
+    def test_run_without_pidfd(self, tmp_path: Path, mocker: MockerFixture):
+        cdo, _ = fake_cdo(tmp_path)
+        mocker.patch("os.pidfd_open", side_effect=OSError, create=True)
+        output = tmp_path / "out"
+
+        result = asyncio.run(CdoHandler(cdo).arun(("-timmean", "in", str(output))))
+
+        assert output.exists()
+        assert result.max_rss > 0
+
+    def test_fails(self, tmp_path: Path):
+        cdo, _ = fake_cdo(tmp_path)
+
+        with pytest.raises(CdoError):
+            asyncio.run(CdoHandler(cdo).arun((str(tmp_path / "missing" / "out"),)))
+
+    def test_cancel_kills_cdo(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        cdo, _ = fake_cdo(tmp_path)
+        monkeypatch.setenv("FAKE_CDO_SLEEP", "5")
+        output = tmp_path / "out"
+
+        async def main():
+            task = asyncio.create_task(CdoHandler(cdo).arun(("-timmean", str(output))))
+            await asyncio.sleep(0.3)
+            task.cancel()
+            await task
+
+        start = time.monotonic()
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(main())
+        assert time.monotonic() - start < 2
+        time.sleep(0.2)
+        assert not output.exists()
+
+
+def test_get_time_fingerprints(tmp_path: Path):
+    cdo, log = fake_cdo(tmp_path)
+    data = tmp_path / "in.nc"
+    data.write_text("2000-01-01T00:00:00 2000-02-01T00:00:00")
+    handler = CdoHandler(cdo)
+
+    steps = handler.get_time_fingerprints(str(data))
+    handler.get_time_fingerprints(str(data))
+
+    assert [s for s, _ in steps] == ["2000-01-01T00:00:00", "2000-02-01T00:00:00"]
+    assert len(cdo_calls(log)) == 1
+    data.write_text("2000-01-01T00:00:00 2000-02-01T00:00:00=1")
+    changed = handler.get_time_fingerprints(str(data))
+    assert changed[0] == steps[0] and changed[1] != steps[1]
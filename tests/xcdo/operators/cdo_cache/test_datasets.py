@@ -0,0 +1,117 @@
+import os
+import typing as t
+from pathlib import Path
+
+import pytest
+import xarray as xr
+
+from xcdo.operators.cdo_cache.datasets import DatasetCache
+
+from ._utils import create_randomfile
+
+
+class FakeOpener:
+    """Opens an in-memory dataset per call and records opens and closes"""
+
+    def __init__(self) -> None:
+        self.opened: list[tuple[str, dict[str, t.Any]]] = []
+        self.closed: list[str] = []
+
+    def __call__(self, path: str, **kwargs: t.Any) -> xr.Dataset:
+        self.opened.append((path, kwargs))
+        ds = xr.Dataset({"x": ("t", [1, 2])}, coords={"t": [0, 1]})
+        ds.set_close(lambda: self.closed.append(path))
+        return ds
+
+
+@pytest.fixture
+def opener():
+    return FakeOpener()
+
+
+@pytest.fixture
+def datasets(opener: FakeOpener):
+    return DatasetCache(maxsize=2, open_dataset=opener)
+
+
+class TestDatasetCache:
+    def test_reuses_open_dataset(
+        self, datasets: DatasetCache, opener: FakeOpener, tmp_path: Path
+    ):
+        path = create_randomfile(tmp_path)
+
+        first = datasets.get(path, chunks=None)
+        second = datasets.get(path, chunks=None)
+
+        assert len(opener.opened) == 1
+        assert first.identical(second)
+
+    def test_returns_copies(self, datasets: DatasetCache, tmp_path: Path):
+        path = create_randomfile(tmp_path)
+
+        datasets.get(path)["y"] = ("t", [3, 4])
+
+        assert "y" not in datasets.get(path)
+
+    def test_open_kwargs_are_part_of_the_key(
+        self, datasets: DatasetCache, opener: FakeOpener, tmp_path: Path
+    ):
+        path = create_randomfile(tmp_path)
+
+        datasets.get(path, decode_times=True)
+        datasets.get(path, decode_times=False)
+
+        assert [kw for _, kw in opener.opened] == [
+            {"decode_times": True},
+            {"decode_times": False},
+        ]
+
+    def test_reopens_replaced_file(
+        self, datasets: DatasetCache, opener: FakeOpener, tmp_path: Path
+    ):
+        path = create_randomfile(tmp_path)
+        datasets.get(path)
+        new = create_randomfile(tmp_path)
+        os.replace(new, path)
+
+        datasets.get(path)
+
+        assert len(opener.opened) == 2
+        assert opener.closed == [path]
+
+    def test_missing_file(self, datasets: DatasetCache, tmp_path: Path):
+        with pytest.raises(FileNotFoundError):
+            datasets.get(str(tmp_path / "missing.nc"))
+
+    def test_lru(self, datasets: DatasetCache, opener: FakeOpener, tmp_path: Path):
+        a, b, c = (create_randomfile(tmp_path) for _ in range(3))
+        datasets.get(a)
+        datasets.get(b)
+        datasets.get(a)
+
+        datasets.get(c)
+
+        assert len(datasets) == 2
+        assert opener.closed == [b]
+
+    def test_invalidate(
+        self, datasets: DatasetCache, opener: FakeOpener, tmp_path: Path
+    ):
+        a, b = (create_randomfile(tmp_path) for _ in range(2))
+        datasets.get(a)
+        datasets.get(b)
+
+        datasets.invalidate([a])
+        datasets.get(a)
+
+        assert opener.closed == [a]
+        assert len(opener.opened) == 3
+
+    def test_clear(self, datasets: DatasetCache, opener: FakeOpener, tmp_path: Path):
+        a = create_randomfile(tmp_path)
+        datasets.get(a)
+
+        datasets.clear()
+
+        assert len(datasets) == 0
+        assert opener.closed == [a]
@@ -0,0 +1,67 @@
+from pathlib import Path
+
+import pytest
+
+from xcdo.operators.cdo_cache.exceptions import CacheError
+from xcdo.operators.cdo_cache.fingerprint import file_fingerprint
+
+
+def write(path: Path, data: bytes) -> str:
+    path.write_bytes(data)
+    return str(path)
+
+
+class TestFileFingerprint:
+    def test_same_content_same_fingerprint(self, tmp_path: Path):
+        a = write(tmp_path / "a", b"x" * 1000)
+        b = write(tmp_path / "b", b"x" * 1000)
+
+        assert file_fingerprint(a) == file_fingerprint(b)
+
+    @pytest.mark.parametrize("policy", ["sample", "full"])
+    def test_change_detected(self, tmp_path: Path, policy: str):
+        path = tmp_path / "a"
+        before = file_fingerprint(write(path, b"x" * 1000), policy)  # type: ignore
+
+        after = file_fingerprint(write(path, b"x" * 999 + b"y"), policy)  # type: ignore
+
+        assert before != after
+
+    def test_policy_in_fingerprint(self, tmp_path: Path):
+        path = write(tmp_path / "a", b"data")
+
+        assert file_fingerprint(path, "sample") != file_fingerprint(path, "full")
+        assert file_fingerprint(path, "full").split(":")[1] == "f"
+
+    def test_sampled_reads_windows(self, tmp_path: Path):
+        data = bytearray(100_000)
+        path = tmp_path / "big"
+        write(path, bytes(data))
+        sampled, full = file_fingerprint(str(path), sample_size=10, n_samples=4), (
+            file_fingerprint(str(path), "full")
+        )
+
+        # Between two windows: only the full hash sees it
+        data[50] = 1
+        write(path, bytes(data))
+        assert file_fingerprint(str(path), sample_size=10, n_samples=4) == sampled
+        assert file_fingerprint(str(path), "full") != full
+
+        # The last window is always sampled
+        data[-1] = 1
+        write(path, bytes(data))
+        assert file_fingerprint(str(path), sample_size=10, n_samples=4) != sampled
+
+    def test_size_is_hashed(self, tmp_path: Path):
+        a = file_fingerprint(write(tmp_path / "a", b"\0" * 200), sample_size=10)
+        b = file_fingerprint(write(tmp_path / "b", b"\0" * 300), sample_size=10)
+
+        assert a != b
+
+    def test_unknown_policy(self, tmp_path: Path):
+        with pytest.raises(CacheError):
+            file_fingerprint(write(tmp_path / "a", b""), "fast")  # type: ignore
+
+    def test_missing_file(self, tmp_path: Path):
+        with pytest.raises(FileNotFoundError):
+            file_fingerprint(str(tmp_path / "missing"))
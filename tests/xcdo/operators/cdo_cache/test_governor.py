@@ -0,0 +1,183 @@
+import asyncio
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from xcdo.operators.cdo_cache.cdo_handler import CdoHandler
+from xcdo.operators.cdo_cache.governor import Grant, ResourceGovernor, operator_key
+
+from ._utils import cdo_calls, fake_cdo
+
+ARGV = ("-fldmean", "-mergetime", "a.nc", "b.nc", "out.nc")
+
+
+def acquire_in_thread(
+    governor: ResourceGovernor, priority: int, granted: list[tuple[int, Grant]]
+) -> threading.Thread:
+    def acquire():
+        granted.append((priority, governor.acquire(ARGV, priority)))
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    return thread
+
+
+def wait_queued(governor: ResourceGovernor, n: int) -> None:
+    deadline = time.monotonic() + 5
+    while len(governor._queue) != n:  # type: ignore
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class TestGrants:
+    def test_whole_node_for_a_single_job(self):
+        governor = ResourceGovernor(cores=8, memory=10**9)
+
+        grant = governor.acquire(ARGV)
+
+        assert grant.threads == 8
+        assert governor.used == (8, grant.memory)
+        governor.release(grant)
+        assert governor.used == (0, 0)
+
+    def test_max_threads(self):
+        governor = ResourceGovernor(cores=8, memory=10**9, max_threads=2)
+
+        assert governor.acquire(ARGV).threads == 2
+
+    def test_queue_when_saturated(self):
+        governor = ResourceGovernor(cores=2, memory=10**9, max_threads=1)
+        first, second = governor.acquire(ARGV), governor.acquire(ARGV)
+        granted: list[tuple[int, Grant]] = []
+
+        thread = acquire_in_thread(governor, 0, granted)
+        wait_queued(governor, 1)
+        assert granted == []
+
+        governor.release(first)
+        thread.join()
+        assert len(granted) == 1
+        governor.release(second)
+
+    def test_priority(self):
+        governor = ResourceGovernor(cores=1, memory=10**9)
+        running = governor.acquire(ARGV)
+        granted: list[tuple[int, Grant]] = []
+        threads = []
+        for priority in (0, 10, 5):
+            threads.append(acquire_in_thread(governor, priority, granted))
+            wait_queued(governor, len(threads))
+
+        for n in range(1, 4):
+            governor.release(running)
+            deadline = time.monotonic() + 5
+            while len(granted) < n:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            running = granted[-1][1]
+        for thread in threads:
+            thread.join()
+
+        assert [p for p, _ in granted] == [10, 5, 0]
+
+    def test_memory_bounds_concurrency(self):
+        governor = ResourceGovernor(cores=8, memory=1000, default_memory=600)
+        first = governor.acquire(ARGV)
+        granted: list[tuple[int, Grant]] = []
+
+        thread = acquire_in_thread(governor, 0, granted)
+        wait_queued(governor, 1)
+        assert granted == []
+
+        governor.release(first)
+        thread.join()
+        assert len(granted) == 1
+
+    def test_oversized_job_runs_on_idle_node(self):
+        governor = ResourceGovernor(cores=2, memory=100, default_memory=1000)
+
+        assert governor.acquire(ARGV).memory == 1000
+
+    def test_async_cancel_leaves_queue(self):
+        governor = ResourceGovernor(cores=1, memory=10**9)
+        running = governor.acquire(ARGV)
+
+        async def main():
+            task = asyncio.create_task(governor.aacquire(ARGV))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(main())
+
+        assert governor._queue == []  # type: ignore
+        governor.release(running)
+        assert governor.used == (0, 0)
+
+
+class TestEstimates:
+    def test_default(self):
+        governor = ResourceGovernor(cores=1, memory=10**9, default_memory=123)
+
+        assert governor.estimate(ARGV) == 123
+
+    def test_learned_per_operator_chain(self):
+        governor = ResourceGovernor(cores=1, memory=10**9)
+
+        governor.observe(ARGV, 5000)
+
+        assert governor.estimate(("-fldmean", "-mergetime", "c.nc", "x.nc")) == 5000
+        assert governor.estimate(("-fldmean", "a.nc", "out.nc")) != 5000
+
+    def test_peaks_decay_slowly(self):
+        governor = ResourceGovernor(cores=1, memory=10**9)
+        governor.observe(ARGV, 1000)
+
+        governor.observe(ARGV, 0)
+        assert governor.estimate(ARGV) == 1000
+        governor.observe(ARGV, 100)
+        assert 100 < governor.estimate(ARGV) < 1000
+        governor.observe(ARGV, 2000)
+        assert governor.estimate(ARGV) == 2000
+
+    def test_operator_key(self):
+        assert operator_key(ARGV) == "fldmean-mergetime"
+        assert operator_key(("-nosuchoperator",)) == ""
+
+
+class TestCdoHandler:
+    def test_threads_and_learning(self, tmp_path: Path):
+        cdo, log = fake_cdo(tmp_path)
+        governor = ResourceGovernor(cores=4, memory=10**10)
+        handler = CdoHandler(cdo, governor=governor)
+        argv = ("-timmean", "in.nc", str(tmp_path / "out.nc"))
+
+        handler.run(argv)
+
+        assert cdo_calls(log) == [" ".join(("-P", "4", *argv))]
+        assert governor.estimate(argv) != governor.default_memory
+        assert governor.used == (0, 0)
+
+    def test_explicit_threads_kept(self, tmp_path: Path):
+        cdo, log = fake_cdo(tmp_path)
+        handler = CdoHandler(cdo, governor=ResourceGovernor(cores=4, memory=10**10))
+        argv = ("-P", "2", "-timmean", "in.nc", str(tmp_path / "out.nc"))
+
+        handler.run(argv)
+
+        assert cdo_calls(log) == [" ".join(argv)]
+
+    def test_async(self, tmp_path: Path):
+        cdo, log = fake_cdo(tmp_path)
+        governor = ResourceGovernor(cores=2, memory=10**10)
+        handler = CdoHandler(cdo, governor=governor)
+        argv = ("-timmean", "in.nc", str(tmp_path / "out.nc"))
+
+        asyncio.run(handler.arun(argv))
+
+        assert cdo_calls(log) == [" ".join(("-P", "2", *argv))]
+        assert governor.estimate(argv) != governor.default_memory
+        assert governor.used == (0, 0)
@@ -0,0 +1,34 @@
+from xcdo.operators.cdo_cache.info_cache import InfoCache
+
+FILES = ("a.stdout", "a.stderr")
+STAMPS = (("in.nc", 10, 100),)
+
+
+def test_hit():
+    cache = InfoCache()
+    cache.put(FILES, STAMPS, ("out", "err"))
+
+    assert cache.get(FILES, STAMPS) == ("out", "err")
+
+
+def test_changed_stamps_miss():
+    cache = InfoCache()
+    cache.put(FILES, STAMPS, ("out", "err"))
+
+    assert cache.get(FILES, (("in.nc", 10, 200),)) is None
+    cache.put(FILES, (("in.nc", 10, 200),), ("new", ""))
+    assert len(cache) == 1
+
+
+def test_lru():
+    cache = InfoCache(maxsize=2)
+    for name in ("a", "b"):
+        cache.put((name,), (), (name, ""))
+    cache.get(("a",), ())
+
+    cache.put(("c",), (), ("c", ""))
+
+    assert cache.get(("a",), ()) == ("a", "")
+    assert cache.get(("b",), ()) is None
+    cache.clear()
+    assert len(cache) == 0
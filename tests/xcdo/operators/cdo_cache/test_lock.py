@@ -0,0 +1,110 @@
+import asyncio
+import os
+import socket
+import time
+from pathlib import Path
+
+import pytest
+
+from xcdo.operators.cdo_cache.exceptions import CacheError
+from xcdo.operators.cdo_cache.lock import FileLock, read_owner
+
+
+@pytest.fixture
+def lock_path(tmp_path: Path) -> str:
+    return str(tmp_path / "entry.lock")
+
+
+def dead_pid() -> int:
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+    os.waitpid(pid, 0)
+    return pid
+
+
+def test_acquire_release(lock_path: str):
+    with FileLock(lock_path) as lock:
+        assert lock.locked
+        assert read_owner(lock_path) is not None
+    assert not os.path.exists(lock_path)
+
+
+def test_exclusive(lock_path: str):
+    with FileLock(lock_path):
+        assert FileLock(lock_path).try_acquire() is False
+
+
+def test_timeout(lock_path: str):
+    with FileLock(lock_path), pytest.raises(CacheError) as e:
+        FileLock(lock_path, timeout=0.1).acquire()
+    assert "timed out" in str(e.value)
+
+
+def test_live_lock_not_stale(lock_path: str):
+    with FileLock(lock_path):
+        assert FileLock(lock_path).break_if_stale() is False
+
+
+def test_dead_owner_is_stale(lock_path: str):
+    Path(lock_path).write_text(f"{socket.gethostname()} {dead_pid()} token")
+
+    with FileLock(lock_path, timeout=5):
+        pass
+
+    assert not os.path.exists(lock_path)
+
+
+def test_old_lock_is_stale(lock_path: str):
+    Path(lock_path).write_text(f"otherhost {os.getpid()} token")
+    lock = FileLock(lock_path, stale_after=60)
+    assert lock.is_stale() is False
+
+    os.utime(lock_path, (0, 0))
+
+    assert lock.is_stale() is True
+    assert lock.break_if_stale() is True
+    assert not os.path.exists(lock_path)
+
+
+def test_release_keeps_foreign_lock(lock_path: str):
+    lock = FileLock(lock_path)
+    lock.acquire()
+    Path(lock_path).write_text("otherhost 1 token")
+
+    lock.release()
+
+    assert os.path.exists(lock_path)
+
+
+def test_async_wait_does_not_block(lock_path: str):
+    async def main() -> list[str]:
+        events: list[str] = []
+        holder = FileLock(lock_path)
+        holder.try_acquire()
+
+        async def release_later():
+            await asyncio.sleep(0.2)
+            events.append("released")
+            holder.release()
+
+        async def wait():
+            async with FileLock(lock_path, poll_interval=0.01):
+                events.append("acquired")
+
+        await asyncio.gather(wait(), release_later())
+        return events
+
+    assert asyncio.run(main()) == ["released", "acquired"]
+    assert not os.path.exists(lock_path)
+
+
+def test_async_timeout(lock_path: str):
+    async def main():
+        await FileLock(lock_path, timeout=0.1).aacquire()
+
+    with FileLock(lock_path):
+        start = time.monotonic()
+        with pytest.raises(CacheError):
+            asyncio.run(main())
+    assert time.monotonic() - start < 2
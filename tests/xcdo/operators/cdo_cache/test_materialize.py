@@ -0,0 +1,71 @@
+import errno
+import os
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from xcdo.operators.cdo_cache.materialize import materialize
+
+
+@pytest.fixture
+def src(tmp_path: Path) -> str:
+    path = tmp_path / "cache_file"
+    path.write_text("data")
+    return str(path)
+
+
+def leftovers(tmp_path: Path) -> list[str]:
+    return [p.name for p in tmp_path.iterdir() if p.name.endswith(".tmp")]
+
+
+def test_own_inode(src: str, tmp_path: Path):
+    dst = tmp_path / "out.nc"
+
+    method = materialize(src, str(dst))
+
+    assert method in ("reflink", "copy")
+    assert dst.read_text() == "data"
+    assert not os.path.samefile(src, dst)
+
+
+def test_hardlink_replaced_by_default(src: str, tmp_path: Path):
+    dst = tmp_path / "out.nc"
+    materialize(src, str(dst), ("hardlink",))
+
+    materialize(src, str(dst))
+
+    assert not os.path.samefile(src, dst)
+
+
+def test_hardlink(src: str, tmp_path: Path):
+    dst = tmp_path / "out.nc"
+
+    assert materialize(src, str(dst), ("hardlink", "copy")) == "hardlink"
+    assert os.path.samefile(src, dst)
+
+
+def test_copy_across_filesystems(src: str, tmp_path: Path, mocker: MockerFixture):
+    mocker.patch("os.link", side_effect=OSError(errno.EXDEV, "cross-device link"))
+    dst = tmp_path / "out.nc"
+
+    assert materialize(src, str(dst), ("hardlink", "copy")) == "copy"
+    assert dst.read_text() == "data"
+    assert not os.path.samefile(src, dst)
+    assert leftovers(tmp_path) == []
+
+
+def test_replaces_existing(src: str, tmp_path: Path):
+    dst = tmp_path / "out.nc"
+    dst.write_text("old")
+
+    materialize(src, str(dst), ("hardlink",))
+    materialize(src, str(dst), ("hardlink",))
+
+    assert dst.read_text() == "data"
+    assert leftovers(tmp_path) == []
+
+
+def test_all_methods_fail(src: str, tmp_path: Path):
+    with pytest.raises(OSError):
+        materialize(src, str(tmp_path / "missing_dir" / "out.nc"))
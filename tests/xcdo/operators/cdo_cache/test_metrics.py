@@ -0,0 +1,159 @@
+import json
+import os
+import typing as t
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from xcdo.operators.cdo_cache import CdoCache
+from xcdo.operators.cdo_cache.cache_handler import CacheHandler
+from xcdo.operators.cdo_cache.cdo_handler import CdoHandler
+from xcdo.operators.cdo_cache.interfaces import ICacheHandler, ICdoHandler
+from xcdo.operators.cdo_cache.metrics import (
+    JsonlTrace,
+    Metrics,
+    PrometheusFile,
+    SlowProfiler,
+    operator_label,
+)
+from xcdo.operators.cdo_cache.types import RunStats
+
+from ._utils import create_randomfile, fake_cdo
+
+
+@pytest.mark.parametrize(
+    "argv, expected",
+    [
+        (["-fldmean", "in.nc"], "fldmean"),
+        (
+            ["-O", "-P", "4", "-f", "nc4", "-sellonlatbox,0,10,0,10", "in.nc"],
+            "sellonlatbox",
+        ),
+        (["-s", "--worker", "2", "-timmean", "-selname,tas", "in.nc"], "timmean"),
+        (["-O"], "unknown"),
+    ],
+)
+def test_operator_label(argv: list[str], expected: str):
+    assert operator_label(argv) == expected
+
+
+def test_counters_and_histograms():
+    metrics = Metrics(buckets=(0.1, 1.0))
+
+    metrics.inc("lookups", operator="fldmean", outcome="hit")
+    metrics.inc("lookups", 2, outcome="hit", operator="fldmean")
+    metrics.observe("seconds", 0.05, phase="run")
+    metrics.observe("seconds", 5.0, phase="run")
+
+    assert metrics.counter("lookups", operator="fldmean", outcome="hit") == 3
+    assert metrics.counter("lookups", operator="fldmean", outcome="miss") == 0
+    assert metrics.histogram("seconds", phase="run") == (2, 5.05)
+
+
+def test_prometheus_file(tmp_path: Path):
+    path = tmp_path / "metrics" / "xcdo.prom"
+    metrics = Metrics([PrometheusFile(str(path))], buckets=(0.1, 1.0))
+    metrics.inc("xcdo_lookups_total", operator="fldmean", outcome="miss")
+    metrics.maximum("xcdo_cdo_max_rss_bytes", 2048, operator="fldmean")
+    metrics.maximum("xcdo_cdo_max_rss_bytes", 1024, operator="fldmean")
+    metrics.observe("xcdo_phase_seconds", 0.5, phase="run")
+
+    metrics.flush()
+
+    assert path.read_text().splitlines() == [
+        "# TYPE xcdo_lookups_total counter",
+        'xcdo_lookups_total{operator="fldmean",outcome="miss"} 1',
+        "# TYPE xcdo_cdo_max_rss_bytes gauge",
+        'xcdo_cdo_max_rss_bytes{operator="fldmean"} 2048',
+        "# TYPE xcdo_phase_seconds histogram",
+        'xcdo_phase_seconds_bucket{phase="run",le="0.1"} 0',
+        'xcdo_phase_seconds_bucket{phase="run",le="1"} 1',
+        'xcdo_phase_seconds_bucket{phase="run",le="+Inf"} 1',
+        'xcdo_phase_seconds_sum{phase="run"} 0.5',
+        'xcdo_phase_seconds_count{phase="run"} 1',
+    ]
+
+
+def test_slow_profiler(tmp_path: Path):
+    profiles = tmp_path / "profiles"
+    metrics = Metrics(profiler=SlowProfiler(str(profiles), threshold=0))
+
+    with metrics.timer("lookup", ["-fldmean", "in.nc"]):
+        sum(range(1000))
+    with metrics.timer("hash", ["-fldmean", "in.nc"]):
+        pass
+
+    (profile,) = profiles.iterdir()
+    assert profile.name.endswith(".fldmean.prof")
+    assert metrics.histogram("xcdo_phase_seconds", operator="fldmean", phase="hash")[0]
+
+
+def test_disabled_records_nothing(mocker: MockerFixture):
+    cdo = mocker.MagicMock(spec=ICdoHandler)
+    cache = mocker.MagicMock(spec=ICacheHandler)
+    cache.fingerprints.return_value = None
+    cache.is_cache_valid.return_value = False
+    cdo.run.return_value = RunStats()
+
+    CdoCache(cdo, cache).get_cache(["-fldmean", "in.nc"], 1)
+
+    # Telling a miss from a stale entry costs a stat, only paid with metrics
+    cache.cache_exists.assert_not_called()
+
+
+class TestCdoCache:
+    @pytest.fixture
+    def setup(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setenv("FAKE_CDO_NOUT", "1")
+        cdo, _ = fake_cdo(tmp_path)
+        trace = tmp_path / "trace.jsonl"
+        metrics = Metrics([JsonlTrace(str(trace))])
+        cdo_cache = CdoCache(
+            CdoHandler(cdo, version_cache=str(tmp_path / "versions.json")),
+            CacheHandler(str(tmp_path / "cache")),
+            metrics=metrics,
+        )
+        return cdo_cache, metrics, trace, create_randomfile(tmp_path)
+
+    @staticmethod
+    def outcomes(metrics: Metrics) -> dict[str, float]:
+        return {
+            outcome: metrics.counter(
+                "xcdo_lookups_total", operator="fldmean", outcome=outcome
+            )
+            for outcome in ("hit", "miss", "stale")
+        }
+
+    def test_outcomes(self, setup: t.Any):
+        cdo_cache, metrics, _, input_file = setup
+        argv = ["-fldmean", input_file]
+
+        cdo_cache.get_cache(argv, 1)
+        cdo_cache.get_cache(argv, 1)
+        stat = os.stat(input_file)
+        os.utime(input_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        cdo_cache.get_cache(argv, 1)
+
+        assert self.outcomes(metrics) == {"hit": 1, "miss": 1, "stale": 1}
+        for phase in ("lookup", "discover", "hash", "validate"):
+            count, _ = metrics.histogram(
+                "xcdo_phase_seconds", operator="fldmean", phase=phase
+            )
+            assert count >= 3, phase
+
+    def test_runs(self, setup: t.Any):
+        cdo_cache, metrics, trace, input_file = setup
+
+        cdo_cache.get_cache(["-fldmean", input_file], 1)
+
+        count, wall_time = metrics.histogram(
+            "xcdo_phase_seconds", operator="fldmean", phase="run"
+        )
+        assert count == 1 and wall_time > 0
+        assert metrics.counter("xcdo_cdo_cpu_seconds_total", operator="fldmean") > 0
+        events = [json.loads(line) for line in trace.read_text().splitlines()]
+        assert [e["event"] for e in events] == ["lookup", "cdo_run"]
+        assert events[0]["outcome"] == "miss"
+        assert events[1]["argv"] == ["-fldmean", input_file]
+        assert events[1]["max_rss"] > 0
@@ -0,0 +1,143 @@
+import inspect
+import typing as t
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture, MockType
+
+from xcdo.operators.cdo_cache import CdoCache, Expr, Pipeline
+from xcdo.operators.cdo_cache.cache_handler import CacheHandler
+from xcdo.operators.cdo_cache.cdo_handler import CdoHandler
+from xcdo.operators.cdo_cache.exceptions import CdoError
+
+from ._utils import cdo_calls, create_randomfile, fake_cdo
+
+
+@pytest.fixture
+def cdo_cache_mock(mocker: MockerFixture):
+    return mocker.MagicMock(spec=CdoCache)
+
+
+@pytest.fixture
+def cdo(cdo_cache_mock: MockType):
+    return Pipeline(cdo_cache_mock)
+
+
+class TestBuild:
+    def test_does_no_work(self, cdo: Pipeline, cdo_cache_mock: MockType):
+        expr = cdo.timmean(cdo.selyear(cdo.mergetime(["a.nc", "b.nc"]), "2000/2020"))
+
+        assert isinstance(expr, Expr)
+        assert cdo_cache_mock.method_calls == []
+
+    def test_fused_argv(self, cdo: Pipeline):
+        expr = cdo.timmean(cdo.selyear(cdo.mergetime(["a.nc", "b.nc"]), "2000/2020"))
+
+        assert expr.argv == [
+            "-timmean",
+            "-selyear,2000/2020",
+            "-mergetime",
+            "[",
+            "a.nc",
+            "b.nc",
+            "]",
+        ]
+
+    def test_method_chaining(self, cdo: Pipeline):
+        chained = cdo.mergetime(["a.nc", "b.nc"]).selyear("2000/2020").timmean()
+        nested = cdo.timmean(cdo.selyear(cdo.mergetime(["a.nc", "b.nc"]), "2000/2020"))
+
+        assert chained == nested
+
+    def test_params(self, cdo: Pipeline):
+        expr = cdo.sellonlatbox(Path("in.nc"), 0, 10, -5.5, 5)
+
+        assert expr.argv == ["-sellonlatbox,0,10,-5.5,5", "in.nc"]
+
+    def test_keyword_params(self, cdo: Pipeline):
+        expr = cdo.setgridarea(Path("in.nc"), area="area.nc")
+
+        assert expr.argv == ["-setgridarea,area=area.nc", "in.nc"]
+
+    def test_several_inputs(self, cdo: Pipeline):
+        expr = cdo.sub(cdo.fldmean(["a.nc"]), Path("b.nc"))
+
+        assert expr.argv == ["-sub", "-fldmean", "a.nc", "b.nc"]
+
+    def test_options(self, cdo_cache_mock: MockType):
+        cdo = Pipeline(cdo_cache_mock, ("-f", "nc4"))
+
+        assert cdo.fldmean(["in.nc"]).argv == ["-f", "nc4", "-fldmean", "in.nc"]
+
+    def test_existing_file_as_str(
+        self, cdo: Pipeline, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.chdir(tmp_path)
+        for name in ("in.nc", "tas"):
+            (tmp_path / name).write_text(" ")
+
+        assert cdo.timmean("in.nc").argv == ["-timmean", "in.nc"]
+        assert cdo.sub("in.nc", "in.nc").argv == ["-sub", "in.nc", "in.nc"]
+        # The input is given, a parameter naming a file stays a parameter
+        assert cdo.selname(Path("in.nc"), "tas").argv == ["-selname,tas", "in.nc"]
+
+    def test_signature(self, cdo: Pipeline):
+        assert list(inspect.signature(cdo.sub).parameters) == [
+            "input1",
+            "input2",
+            "params",
+            "kwargs",
+        ]
+        assert next(iter(inspect.signature(cdo.mergetime).parameters)) == "inputs"
+        chained = cdo.fldmean(["a.nc"]).sub
+        assert next(iter(inspect.signature(chained).parameters)) == "input2"
+
+    def test_operators_listed(self, cdo: Pipeline):
+        assert "mergetime" in dir(cdo)
+        assert cdo.mergetime.__doc__ == "Merge datasets sorted by date and time"
+
+    def test_unknown_operator(self, cdo: Pipeline):
+        with pytest.raises(AttributeError):
+            _ = cdo.nosuchoperator
+
+    @pytest.mark.parametrize(
+        "build",
+        [
+            lambda cdo: cdo.sub(["a.nc"]),
+            lambda cdo: cdo.fldmean("in.nc"),
+            lambda cdo: cdo.mergetime([]),
+            lambda cdo: cdo.fldmean(cdo.splityear(["in.nc"])),
+        ],
+    )
+    def test_invalid(self, cdo: Pipeline, build: t.Any):
+        with pytest.raises(CdoError):
+            build(cdo)
+
+
+class TestCompute:
+    def test_single_get_cache(self, cdo: Pipeline, cdo_cache_mock: MockType):
+        expr = cdo.fldmean(cdo.mergetime(["a.nc", "b.nc"]))
+
+        result = expr.compute()
+
+        assert result == cdo_cache_mock.get_cache.return_value
+        cdo_cache_mock.get_cache.assert_called_once_with(expr.argv, None, (), False)
+
+    def test_single_cdo_process(self, tmp_path: Path):
+        exe, log = fake_cdo(tmp_path)
+        cdo = Pipeline(
+            CdoCache(
+                CdoHandler(exe, version_cache=str(tmp_path / "versions.json")),
+                CacheHandler(str(tmp_path / "cache")),
+            )
+        )
+        files = [create_randomfile(tmp_path) for _ in range(2)]
+        expr = cdo.timmean(cdo.selyear(cdo.mergetime(files), "2000/2020"))
+
+        first = expr.compute()
+        second = expr.compute()
+
+        assert first == second
+        runs = [c for c in cdo_calls(log) if c != "-V"]
+        assert len(runs) == 1
+        assert runs[0].startswith("-timmean -selyear,2000/2020 -mergetime")
@@ -0,0 +1,216 @@
+import typing as t
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from xcdo.operators.cdo_cache import CdoCache
+from xcdo.operators.cdo_cache.cache_handler import CacheHandler
+from xcdo.operators.cdo_cache.cdo_handler import CdoHandler
+from xcdo.operators.cdo_cache.storage import (
+    ZARR_SUFFIX,
+    StorageFormat,
+    to_zarr,
+    zarr_chunks,
+    zarr_storage,
+)
+
+from ._utils import cdo_calls, create_randomfile, fake_cdo
+
+
+@pytest.mark.parametrize(
+    "storage, expected",
+    [
+        (StorageFormat(), ("-f", "nc4", "-z", "zip_1")),
+        (StorageFormat("nc4c", 5, "map"), ("-f", "nc4c", "-z", "zip_5", "-k", "grid")),
+        (StorageFormat(None, None, "timeseries"), ("-k", "lines")),
+        (StorageFormat("grb2", None), ("-f", "grb2")),
+        (StorageFormat(layout="map", zarr=True), ("-f", "nc4")),
+    ],
+)
+def test_options(storage: StorageFormat, expected: tuple[str, ...]):
+    assert storage.options() == expected
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"zip_level": 0},
+        {"zip_level": 10},
+        {"file_type": "grb2"},
+        {"file_type": "nc", "zip_level": None, "layout": "map"},
+        {"file_type": "grb2", "zarr": True},
+        {"layout": "rows"},
+    ],
+)
+def test_invalid(kwargs: dict[str, t.Any]):
+    with pytest.raises(ValueError):
+        StorageFormat(**kwargs)
+
+
+@pytest.mark.parametrize(
+    "argv, expected",
+    [
+        (["-fldmean", "in.nc"], ["-f", "nc4", "-z", "zip_1", "-fldmean", "in.nc"]),
+        (
+            ["-z", "zip_9", "-fldmean", "in.nc"],
+            ["-f", "nc4", "-z", "zip_9", "-fldmean", "in.nc"],
+        ),
+        (["-f", "grb2", "-fldmean", "in.nc"], ["-f", "grb2", "-fldmean", "in.nc"]),
+        (
+            ["--format", "nc", "-fldmean", "in.nc"],
+            ["--format", "nc", "-fldmean", "in.nc"],
+        ),
+        (["-f"], ["-f"]),
+    ],
+)
+def test_apply(argv: list[str], expected: list[str]):
+    assert StorageFormat().apply(argv) == expected
+
+
+@pytest.mark.parametrize(
+    "storage, suffixes, expected",
+    [
+        (StorageFormat(), (".nc",), (".nc",)),
+        (StorageFormat(zarr=True), (), (ZARR_SUFFIX, ZARR_SUFFIX)),
+        (
+            StorageFormat(layout="map", zarr=True),
+            (".nc", ""),
+            (".nc.map.zarr.zip", ".map.zarr.zip"),
+        ),
+    ],
+)
+def test_suffixes(
+    storage: StorageFormat, suffixes: tuple[str, ...], expected: tuple[str, ...]
+):
+    assert storage.suffixes(suffixes, 2) == expected
+
+
+@pytest.mark.parametrize(
+    "storage",
+    [
+        StorageFormat(zarr=True),
+        StorageFormat(layout="map", zarr=True),
+        StorageFormat(layout="timeseries", zarr=True),
+    ],
+)
+def test_zarr_storage(storage: StorageFormat):
+    (suffix,) = storage.suffixes((".nc",), 1)
+    assert zarr_storage(f"/cache/ab/abc_0{suffix}") == storage
+
+
+def test_zarr_storage_not_zarr():
+    assert zarr_storage("/cache/ab/abc_0.nc") is None
+
+
+@pytest.mark.parametrize(
+    "layout, expected",
+    [
+        (None, None),
+        ("map", (1, 1, 180, 360)),
+        ("timeseries", (1000, 1, 64, 64)),
+    ],
+)
+def test_zarr_chunks(layout: t.Any, expected: tuple[int, ...] | None):
+    dims = ("time", "lev", "lat", "lon")
+    assert zarr_chunks(dims, (1000, 1, 180, 360), layout) == expected
+
+
+def test_to_zarr(tmp_path: Path):
+    pytest.importorskip("zarr")
+    pytest.importorskip("scipy")
+    import numpy as np
+    import xarray as xr
+
+    from xcdo.operators.cdo_cache.storage import open_zarr
+
+    src, dst = str(tmp_path / "in.nc"), str(tmp_path / f"out{ZARR_SUFFIX}")
+    ds = xr.Dataset(
+        {"tas": (("time", "lat", "lon"), np.arange(120.0).reshape(10, 3, 4))}
+    )
+    ds.to_netcdf(src)
+
+    to_zarr(src, dst, "map")
+
+    with open_zarr(dst) as converted:
+        xr.testing.assert_identical(converted.load(), ds)
+        assert converted["tas"].encoding["chunks"] == (1, 3, 4)
+
+
+class TestCdoCache:
+    @pytest.fixture
+    def setup(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setenv("FAKE_CDO_NOUT", "1")
+        cdo, log = fake_cdo(tmp_path)
+        cdo_cache = CdoCache(
+            CdoHandler(cdo, version_cache=str(tmp_path / "versions.json")),
+            CacheHandler(str(tmp_path / "cache")),
+            storage=StorageFormat(zip_level=4),
+        )
+        return cdo_cache, log, create_randomfile(tmp_path)
+
+    def test_options_added(self, setup: t.Any):
+        cdo_cache, _, input_file = setup
+
+        (cache_file,) = cdo_cache.get_cache(["-fldmean", input_file], 1)
+
+        assert Path(cache_file).read_text() == f"-f nc4 -z zip_4 -fldmean {input_file}"
+        assert cdo_cache._cache.lookup((cache_file,)).argv == (
+            "-f",
+            "nc4",
+            "-z",
+            "zip_4",
+            "-fldmean",
+            input_file,
+        )
+
+    def test_part_of_key(self, setup: t.Any):
+        cdo_cache, log, input_file = setup
+        argv = ["-fldmean", input_file]
+
+        default = cdo_cache.get_cache(argv, 1)
+        assert cdo_cache.get_cache(argv, 1) == default
+        other = cdo_cache.get_cache(argv, 1, storage=StorageFormat(zip_level=9))
+
+        assert other != default
+        assert Path(other[0]).read_text() == f"-f nc4 -z zip_9 -fldmean {input_file}"
+        assert len([c for c in cdo_calls(log) if "-fldmean" in c]) == 2
+
+    def test_same_as_explicit_options(self, setup: t.Any):
+        cdo_cache, _, input_file = setup
+
+        implicit = cdo_cache.get_cache(["-fldmean", input_file], 1)
+        explicit = cdo_cache.get_cache(
+            ["-z", "zip_4", "-f", "nc4", "-fldmean", input_file], 1
+        )
+
+        assert implicit == explicit
+
+    def test_info_unaffected(self, setup: t.Any, monkeypatch: pytest.MonkeyPatch):
+        cdo_cache, _, input_file = setup
+        monkeypatch.setenv("FAKE_CDO_NOUT", "0")
+
+        stdout, _ = cdo_cache.get_info(["-sinfo", input_file])
+
+        assert stdout == f"-sinfo {input_file}\n"
+
+    def test_zarr_suffix(self, setup: t.Any, mocker: MockerFixture):
+        cdo_cache, _, input_file = setup
+        convert = mocker.patch(
+            "xcdo.operators.cdo_cache.cdo_cache.to_zarr",
+            side_effect=lambda src, dst, layout: Path(dst).write_text(
+                Path(src).read_text()
+            ),
+        )
+        storage = StorageFormat(layout="timeseries", zarr=True)
+
+        (cache_file,) = cdo_cache.get_cache(
+            ["-fldmean", input_file], 1, storage=storage
+        )
+
+        assert cache_file.endswith(f".timeseries{ZARR_SUFFIX}")
+        assert Path(cache_file).read_text() == f"-f nc4 -fldmean {input_file}"
+        (src, _, layout), _ = convert.call_args
+        assert layout == "timeseries"
+        assert not Path(src).exists()
+        assert not list(Path(cache_file).parent.glob(".tmp.*"))
@@ -0,0 +1,146 @@
+import os
+import typing as t
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from xcdo.operators.cdo_cache import CdoCache
+from xcdo.operators.cdo_cache.cache_handler import CacheHandler
+from xcdo.operators.cdo_cache.cdo_handler import CdoHandler
+from xcdo.operators.cdo_cache.interfaces import ICacheHandler
+from xcdo.operators.cdo_cache.tiered import TieredCacheHandler
+
+from ._utils import cdo_calls, create_randomfile, fake_cdo
+
+
+@pytest.fixture
+def tiers(tmp_path: Path):
+    handler = TieredCacheHandler(
+        CacheHandler(str(tmp_path / "disk")),
+        fast_root=str(tmp_path / "shm"),
+        max_bytes=250,
+        promote_max_bytes=150,
+        evict_grace=0,
+    )
+    yield handler
+    handler.close()
+
+
+def entry(
+    handler: TieredCacheHandler, name: str, size: int, input_file: str
+) -> tuple[str, ...]:
+    cache_files = handler.generate_cache_paths(1, handler.generate_hash([name]))
+    temp_files = handler.generate_temp_paths(cache_files)
+    Path(temp_files[0]).write_text("x" * size)
+    handler.commit(temp_files, cache_files, (input_file,))
+    return cache_files
+
+
+def test_correct_instance(tiers: TieredCacheHandler):
+    assert isinstance(tiers, ICacheHandler)
+
+
+def test_new_entries_go_to_fast_tier(tiers: TieredCacheHandler, tmp_path: Path):
+    input_file = create_randomfile(tmp_path)
+
+    cache_files = entry(tiers, "-a", 100, input_file)
+
+    assert cache_files[0].startswith(tiers.fast.root)
+    assert tiers.is_cache_valid(cache_files, (input_file,))
+
+
+def test_demoted_over_budget(tiers: TieredCacheHandler, tmp_path: Path):
+    input_file = create_randomfile(tmp_path)
+    a = entry(tiers, "-a", 100, input_file)
+    b = entry(tiers, "-b", 100, input_file)
+    entry(tiers, "-c", 100, input_file)
+    tiers.wait()
+
+    (path,) = tiers.generate_cache_paths(1, tiers.generate_hash(["-a"]))
+    assert path.startswith(tiers.slow.root)
+    assert not os.path.exists(a[0])
+    assert Path(path).read_text() == "x" * 100
+    assert tiers.is_cache_valid((path,), (input_file,))
+    assert os.path.exists(b[0])
+
+
+def test_burst_capped(tmp_path: Path):
+    tiers = TieredCacheHandler(
+        CacheHandler(str(tmp_path / "disk")),
+        fast_root=str(tmp_path / "shm"),
+        max_bytes=200,
+        evict_grace=60,
+    )
+    input_file = create_randomfile(tmp_path)
+
+    entries = [entry(tiers, f"-{i}", 30, input_file) for i in range(30)]
+    tiers.wait()
+
+    # Just written, nothing can be demoted
+    assert tiers.fast.totals() == (7, 210)
+    assert all(tiers.is_cache_valid(e, (input_file,)) for e in entries)
+    tiers.close()
+
+
+def test_demotion_failure_keeps_entry(
+    tiers: TieredCacheHandler, tmp_path: Path, mocker: MockerFixture
+):
+    input_file = create_randomfile(tmp_path)
+    a = entry(tiers, "-a", 200, input_file)
+    mocker.patch("shutil.copyfile", side_effect=OSError("disk full"))
+
+    entry(tiers, "-b", 200, input_file)
+    tiers.wait()
+
+    assert tiers.is_cache_valid(a, (input_file,))
+    assert not any(Path(tiers.slow.root).glob("??/??/*_0"))
+
+
+def test_promoted_on_hit(tiers: TieredCacheHandler, tmp_path: Path):
+    input_file = create_randomfile(tmp_path)
+    slow_files = tiers.slow.generate_cache_paths(1, tiers.generate_hash(["-a"]))
+    temp_files = tiers.slow.generate_temp_paths(slow_files)
+    Path(temp_files[0]).write_text("x" * 100)
+    tiers.slow.commit(temp_files, slow_files, (input_file,))
+
+    assert tiers.generate_cache_paths(1, tiers.generate_hash(["-a"])) == slow_files
+    assert tiers.is_cache_valid(slow_files, (input_file,))
+    tiers.wait()
+
+    (path,) = tiers.generate_cache_paths(1, tiers.generate_hash(["-a"]))
+    assert path.startswith(tiers.fast.root)
+    assert tiers.is_cache_valid((path,), (input_file,))
+
+
+def test_large_entries_not_promoted(tiers: TieredCacheHandler, tmp_path: Path):
+    input_file = create_randomfile(tmp_path)
+    slow_files = tiers.slow.generate_cache_paths(1, tiers.generate_hash(["-a"]))
+    temp_files = tiers.slow.generate_temp_paths(slow_files)
+    Path(temp_files[0]).write_text("x" * 200)
+    tiers.slow.commit(temp_files, slow_files, (input_file,))
+
+    assert tiers.is_cache_valid(slow_files, (input_file,))
+    tiers.wait()
+
+    assert tiers.generate_cache_paths(1, tiers.generate_hash(["-a"])) == slow_files
+
+
+def test_cdo_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, tiers: t.Any):
+    monkeypatch.setenv("FAKE_CDO_NOUT", "1")
+    cdo, log = fake_cdo(tmp_path)
+    cdo_cache = CdoCache(
+        CdoHandler(cdo, version_cache=str(tmp_path / "versions.json")), tiers
+    )
+    input_file = create_randomfile(tmp_path)
+
+    (first,) = cdo_cache.get_cache(["-fldmean", input_file], 1)
+    for i in range(5):
+        cdo_cache.get_cache([f"-addc,{i}", input_file], 1)
+    tiers.wait()
+    (second,) = cdo_cache.get_cache(["-fldmean", input_file], 1)
+
+    assert first.startswith(tiers.fast.root)
+    assert second.startswith(tiers.slow.root)
+    assert Path(second).read_text() == f"-fldmean {input_file}"
+    assert len([c for c in cdo_calls(log) if c.startswith("-fldmean")]) == 1
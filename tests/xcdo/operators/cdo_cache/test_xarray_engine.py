@@ -0,0 +1,197 @@
+import shutil
+import typing as t
+from pathlib import Path
+
+import numpy as np
+import pytest
+import xarray as xr
+from pytest_mock import MockerFixture, MockType
+
+from xcdo.operators.cdo_cache.argv_parser import parse
+from xcdo.operators.cdo_cache.cdo_handler import CdoHandler
+from xcdo.operators.cdo_cache.exceptions import CdoError
+from xcdo.operators.cdo_cache.interfaces import ICdoHandler
+from xcdo.operators.cdo_cache.xarray_engine import Unsupported, XarrayEngine
+
+
+def sample_dataset(nt: int = 10) -> xr.Dataset:
+    rng = np.random.default_rng(0)
+    tas = rng.normal(280, 10, (nt, 6, 8))
+    tas[1, 2, 3] = np.nan
+    return xr.Dataset(
+        {
+            "tas": (("time", "lat", "lon"), tas, {"units": "K"}),
+            "pr": (("time", "lat", "lon"), rng.random((nt, 6, 8))),
+        },
+        coords={
+            "time": np.datetime64("2000-01-01", "ns")
+            + np.arange(nt) * np.timedelta64(1, "D"),
+            "lat": np.linspace(-75, 75, 6),
+            "lon": np.arange(0, 360, 45.0),
+        },
+    )
+
+
+@pytest.fixture
+def fallback(mocker: MockerFixture):
+    return mocker.MagicMock(spec=ICdoHandler)
+
+
+@pytest.fixture
+def engine(fallback: MockType):
+    return XarrayEngine(fallback, time_block=3)
+
+
+def evaluate(engine: XarrayEngine, argv: list[str]) -> xr.Dataset:
+    ds = sample_dataset()
+    return engine.evaluate(parse(argv).root, lambda path: ds)
+
+
+def test_correct_instance(engine: XarrayEngine):
+    assert isinstance(engine, ICdoHandler)
+
+
+class TestSupports:
+    @pytest.mark.parametrize(
+        "argv",
+        [
+            ["-timmean", "-selname,tas", "in.nc", "out.nc"],
+            ["-O", "-fldmean", "-mulc,2", "in.nc", "out.nc"],
+        ],
+    )
+    def test_supported(self, engine: XarrayEngine, argv: list[str]):
+        assert engine.supports(argv)
+
+    @pytest.mark.parametrize(
+        "argv",
+        [
+            ["-remapbil,r10x10", "in.nc", "out.nc"],
+            ["-f", "nc4", "-timmean", "in.nc", "out.nc"],
+            ["-timmean", "-mergetime", "a.nc", "b.nc", "out.nc"],
+            ["-nosuchoperator", "in.nc", "out.nc"],
+        ],
+    )
+    def test_unsupported(self, engine: XarrayEngine, argv: list[str]):
+        assert not engine.supports(argv)
+
+
+class TestFallback:
+    def test_unsupported_runs_cdo(self, engine: XarrayEngine, fallback: MockType):
+        argv = ["-remapbil,r10x10", "in.nc", "out.nc"]
+
+        result = engine.run(argv)
+
+        assert result == fallback.run.return_value
+        fallback.run.assert_called_once_with(argv)
+
+    def test_same_version_and_inputs(self, engine: XarrayEngine, fallback: MockType):
+        assert engine.version() == fallback.version.return_value
+        assert engine.get_input_files(["x"]) == fallback.get_input_files.return_value
+        assert engine.get_n_outputs(["x"]) == fallback.get_n_outputs.return_value
+
+    def test_default_fallback(self):
+        assert isinstance(XarrayEngine().fallback, CdoHandler)
+
+
+class TestEvaluate:
+    @pytest.mark.parametrize(
+        "argv, expected",
+        [
+            (["-abs", "-subc,280", "in.nc"], lambda ds: abs(ds - 280)),
+            (["-addc,1.5", "in.nc"], lambda ds: ds + 1.5),
+            (["-mulc,2", "in.nc"], lambda ds: ds * 2),
+            (["-divc,4", "in.nc"], lambda ds: ds / 4),
+            (["-sqr", "in.nc"], lambda ds: ds**2),
+            (["-sqrt", "in.nc"], lambda ds: ds**0.5),
+        ],
+    )
+    def test_elementwise(self, engine: XarrayEngine, argv: list[str], expected: t.Any):
+        result = evaluate(engine, argv)
+
+        xr.testing.assert_allclose(result, expected(sample_dataset()))
+
+    def test_keeps_attrs(self, engine: XarrayEngine):
+        assert evaluate(engine, ["-mulc,2", "in.nc"])["tas"].attrs == {"units": "K"}
+
+    def test_selname(self, engine: XarrayEngine):
+        result = evaluate(engine, ["-selname,pr", "in.nc"])
+
+        assert list(result.data_vars) == ["pr"]
+
+    @pytest.mark.parametrize(
+        "argv", [["-selname,nosuchvar", "in.nc"], ["-addc", "in.nc"]]
+    )
+    def test_invalid_params(self, engine: XarrayEngine, argv: list[str]):
+        with pytest.raises(CdoError):
+            evaluate(engine, argv)
+
+    @pytest.mark.parametrize("how", ["mean", "min", "max"])
+    def test_time_reduction_in_blocks(self, engine: XarrayEngine, how: str):
+        result = evaluate(engine, [f"-tim{how}", "in.nc"])
+
+        expected = getattr(sample_dataset(), how)("time")
+        xr.testing.assert_allclose(result.isel(time=0, drop=True), expected)
+        assert result["time"].values[0] == sample_dataset()["time"].values[5]
+        assert result["tas"].attrs == {"units": "K"}
+
+    def test_fldmean(self, engine: XarrayEngine):
+        result = evaluate(engine, ["-fldmean", "in.nc"])
+
+        ds = sample_dataset()
+        weights = np.cos(np.deg2rad(ds["lat"]))
+        expected = ds.weighted(weights).mean(("lat", "lon"))
+        assert result["tas"].dims == ("time", "lat", "lon")
+        xr.testing.assert_allclose(
+            result.isel(lat=0, lon=0, drop=True), expected, rtol=1e-3
+        )
+
+    def test_fldmean_needs_regular_grid(self, engine: XarrayEngine):
+        ds = sample_dataset().rename(lat="y", lon="x")
+
+        with pytest.raises(Unsupported):
+            engine.evaluate(parse(["-fldmean", "in.nc"]).root, lambda path: ds)
+
+
+def netcdf_writable() -> bool:
+    return any(
+        e in xr.backends.list_engines() for e in ("netcdf4", "h5netcdf", "scipy")
+    )
+
+
+@pytest.mark.skipif(
+    shutil.which("cdo") is None or not netcdf_writable(),
+    reason="needs cdo and a netCDF backend",
+)
+class TestEquivalence:
+    @pytest.mark.parametrize(
+        "argv",
+        [
+            ["-abs", "-subc,280"],
+            ["-addc,1.5"],
+            ["-mulc,-2"],
+            ["-divc,3"],
+            ["-sqr"],
+            ["-selname,tas"],
+            ["-timmean"],
+            ["-timmin"],
+            ["-timmax"],
+            ["-fldmean"],
+            ["-timmean", "-fldmean", "-selname,pr"],
+        ],
+    )
+    def test_same_values_as_cdo(self, tmp_path: Path, argv: list[str]):
+        input_file = str(tmp_path / "in.nc")
+        sample_dataset().to_netcdf(input_file)
+        engine_out, cdo_out = str(tmp_path / "engine.nc"), str(tmp_path / "cdo.nc")
+
+        XarrayEngine(time_block=3).run([*argv, input_file, engine_out])
+        CdoHandler().run(["-s", *argv, input_file, cdo_out])
+
+        with xr.open_dataset(engine_out) as ours, xr.open_dataset(cdo_out) as theirs:
+            assert set(ours.data_vars) == set(theirs.data_vars)
+            for name in ours.data_vars:
+                np.testing.assert_allclose(
+                    ours[name].values.squeeze(),
+                    theirs[name].values.squeeze(),
+                    rtol=1e-5,
+                )
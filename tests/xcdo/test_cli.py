@@ -0,0 +1,134 @@
+import typing as t
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from xcdo import cli
+from xcdo.cli import main, parse_size
+from xcdo.operators.cdo_cache.cache_handler import CacheHandler
+
+from .operators.cdo_cache._utils import cdo_calls, create_randomfile, fake_cdo
+from .operators.cdo_cache.test_cache_handler import add_entry
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [("100", 100), ("2K", 2048), ("1.5M", 1572864), ("3GiB", 3 * 1024**3)],
+)
+def test_parse_size(size: str, expected: int):
+    assert parse_size(size) == expected
+
+
+def test_cache_stats(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    add_entry(CacheHandler(str(tmp_path)), "a", 2048)
+
+    assert main(["cache", "stats", "--root", str(tmp_path)]) == 0
+
+    out = capsys.readouterr().out
+    assert "entries:     1" in out
+    assert "2.0 KiB" in out
+
+
+def test_cache_gc(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    handler = CacheHandler(str(tmp_path))
+    for name in "abc":
+        add_entry(handler, name, 100)
+    handler.close()
+
+    main(["cache", "gc", "--root", str(tmp_path), "--max-entries", "1"])
+
+    # Fresh entries are within the eviction grace period
+    assert "evicted 0 entries" in capsys.readouterr().out
+
+
+class TestRunCdo:
+    @pytest.fixture
+    def env(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        cdo, log = fake_cdo(tmp_path)
+        monkeypatch.setenv("XCDO_CDO", cdo)
+        monkeypatch.setenv("XCDO_CACHE_DIR", str(tmp_path / "cache"))
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg"))
+        return tmp_path, log
+
+    @staticmethod
+    def runs(log: Path) -> list[str]:
+        return [c for c in cdo_calls(log) if c != "-V"]
+
+    def test_miss_then_hit(self, env: t.Any, mocker: MockerFixture):
+        tmp_path, log = env
+        spy = mocker.spy(cli, "materialize")
+        input_file = create_randomfile(tmp_path)
+        first, second = tmp_path / "first.nc", tmp_path / "second.nc"
+
+        assert main(["-fldmean", input_file, str(first)]) == 0
+        assert main(["-fldmean", input_file, str(second)]) == 0
+
+        assert len(self.runs(log)) == 1
+        assert first.read_text() == second.read_text() == f"-fldmean {input_file}"
+        assert spy.spy_return in ("reflink", "copy")
+
+    def test_output_edited_in_place(self, env: t.Any):
+        tmp_path, _ = env
+        input_file = create_randomfile(tmp_path)
+        first, second = tmp_path / "first.nc", tmp_path / "second.nc"
+        main(["-fldmean", input_file, str(first)])
+
+        with open(first, "r+") as f:
+            f.write("edited")
+        main(["-fldmean", input_file, str(second)])
+
+        assert second.read_text() == f"-fldmean {input_file}"
+
+    def test_hardlink_opt_in(
+        self, env: t.Any, monkeypatch: pytest.MonkeyPatch, mocker: MockerFixture
+    ):
+        tmp_path, _ = env
+        monkeypatch.setenv("XCDO_LINK", "hardlink")
+        spy = mocker.spy(cli, "materialize")
+        input_file = create_randomfile(tmp_path)
+        output = tmp_path / "out.nc"
+
+        assert main(["-fldmean", input_file, str(output)]) == 0
+
+        (cache_file, _, methods), _ = spy.call_args
+        assert methods == ("reflink", "hardlink", "copy")
+        # No data copied either way
+        assert spy.spy_return in ("reflink", "hardlink")
+        assert output.read_text() == Path(cache_file).read_text()
+
+    def test_info_printed(
+        self,
+        env: t.Any,
+        monkeypatch: pytest.MonkeyPatch,
+        capsys: pytest.CaptureFixture[str],
+    ):
+        tmp_path, log = env
+        monkeypatch.setenv("FAKE_CDO_NOUT", "0")
+        input_file = create_randomfile(tmp_path)
+
+        for _ in range(2):
+            assert main(["-sinfo", input_file]) == 0
+            assert capsys.readouterr().out == f"-sinfo {input_file}\n"
+        assert len(self.runs(log)) == 1
+
+    def test_not_understood_passed_through(self, env: t.Any):
+        tmp_path, log = env
+
+        assert (
+            main(["-splitname", create_randomfile(tmp_path), str(tmp_path / "prefix_")])
+            == 0
+        )
+        assert main(["-nosuchoperator", str(tmp_path / "x")]) == 0
+
+        assert [c.split()[0] for c in self.runs(log)] == [
+            "-splitname",
+            "-nosuchoperator",
+        ]
+
+    def test_cdo_not_found(
+        self, env: t.Any, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+    ):
+        monkeypatch.setenv("XCDO_CDO", str(tmp_path / "nosuchcdo"))
+
+        assert main(["-fldmean", create_randomfile(tmp_path), "out.nc"]) != 0